@@ -0,0 +1,80 @@
+//
+// Dictionary thread scaling benchmark
+//
+// Copyright (c) Boucher Lab. All rights reserved.
+// Licensed under the GNU license. See LICENSE file in the repository root for full license information.
+
+#include <hayai.hpp>
+#include <random>
+#include <pfp_algo.hpp>
+
+//------------------------------------------------------------------------------
+
+// Every run inserts all the phrases, half of them are repeated as it happens when parsing similar sequences
+std::size_t phrases_per_run = 1000000;
+std::size_t distinct_phrases = 500000;
+
+std::vector<std::vector<vcfbwt::char_type>>
+generate_phrases()
+{
+    std::mt19937 generator(42);
+    std::uniform_int_distribution<std::size_t> length_distribution(20, 200);
+    const char* acgt = "ACGT";
+    
+    std::vector<std::vector<vcfbwt::char_type>> distinct(distinct_phrases);
+    for (auto& phrase : distinct)
+    {
+        phrase.resize(length_distribution(generator));
+        for (auto& c : phrase) { c = acgt[generator() % 4]; }
+    }
+    
+    std::vector<std::vector<vcfbwt::char_type>> phrases;
+    for (std::size_t i = 0; i < phrases_per_run; i++) { phrases.push_back(distinct[generator() % distinct_phrases]); }
+    return phrases;
+}
+
+std::vector<std::vector<vcfbwt::char_type>> test_phrases = generate_phrases();
+
+void
+fill_dictionary(std::size_t workers)
+{
+    vcfbwt::pfp::Dictionary<vcfbwt::char_type> dictionary;
+    
+    #pragma omp parallel for schedule(static) num_threads(workers)
+    for (std::size_t i = 0; i < test_phrases.size(); i++) { dictionary.check_and_add(test_phrases[i]); }
+    
+    dictionary.sort();
+}
+
+//------------------------------------------------------------------------------
+
+BENCHMARK(DictionaryCheckAndAdd, Workers1, 5, 1)
+{
+    fill_dictionary(1);
+}
+
+BENCHMARK(DictionaryCheckAndAdd, Workers8, 5, 1)
+{
+    fill_dictionary(8);
+}
+
+BENCHMARK(DictionaryCheckAndAdd, Workers32, 5, 1)
+{
+    fill_dictionary(32);
+}
+
+BENCHMARK(DictionaryCheckAndAdd, Workers64, 5, 1)
+{
+    fill_dictionary(64);
+}
+
+//------------------------------------------------------------------------------
+
+int main()
+{
+    hayai::ConsoleOutputter consoleOutputter;
+
+    hayai::Benchmarker::AddOutputter(consoleOutputter);
+    hayai::Benchmarker::RunAllTests();
+    return 0;
+}
@@ -215,6 +215,27 @@ Mersenne_KR4(std::string& s)
     }
 }
 
+void
+Mersenne_KR_triggers(std::string& s)
+{
+    vcfbwt::Mersenne_KarpRabinHash kr_window(8, false);
+    std::vector<std::size_t> triggers;
+
+    kr_window.initialize((unsigned char*) s.data(), 8);
+    for (vcfbwt::size_type i = 8; i < s.size(); i++)
+    {
+        kr_window.update((vcfbwt::char_type) s[i - 8], (vcfbwt::char_type) s[i]);
+        if ((kr_window.get_hash() % 100) == 0) { triggers.push_back(i); }
+    }
+}
+
+void
+Mersenne_KR_triggers_lanes(std::string& s)
+{
+    std::vector<std::size_t> triggers;
+    vcfbwt::find_trigger_strings((const vcfbwt::char_type*) s.data(), s.size(), 8, 8, 100, triggers);
+}
+
 void
 KR_string_hash(std::string& s)
 {
@@ -251,6 +272,16 @@ BENCHMARK(KR, Mersenne, 100, 1000)
     Mersenne_KR(test_string);
 }
 
+BENCHMARK(KRTriggers, Mersenne, 100, 1000)
+{
+    Mersenne_KR_triggers(test_string);
+}
+
+BENCHMARK(KRTriggers, MersenneLanes, 100, 1000)
+{
+    Mersenne_KR_triggers_lanes(test_string);
+}
+
 BENCHMARK(KRStringHash, Manzini, 10, 100)
 {
     KR_string_hash(test_string);
@@ -16,13 +16,11 @@ template <typename data_type>
 void check(const std::string& input_dict_path, const std::string& input_parse_path, const std::string& input_occurrences_path, std::size_t window_size)
 {
     spdlog::info("Reading dictionary");
-    std::vector<std::vector<data_type>> dict;
-    vcfbwt::pfp::ParserUtils<data_type>::read_dictionary(input_dict_path, dict);
+    vcfbwt::pfp::DictionaryView<data_type> dict(input_dict_path);
     spdlog::info("Dictionary phrases: {}", dict.size());
 
     spdlog::info("Reading parse");
-    std::vector<vcfbwt::size_type> parse;
-    vcfbwt::pfp::ParserUtils<data_type>::read_parse(input_parse_path, parse);
+    vcfbwt::pfp::ParseView parse(input_parse_path);
     spdlog::info("Parse length: {}", parse.size());
 
     if (parse[0] != data_type(1)) { spdlog::error("parse[0] != 1"); exit(EXIT_FAILURE); }
@@ -35,8 +33,8 @@ void check(const std::string& input_dict_path, const std::string& input_parse_pa
         if (parse[i] == 0) { spdlog::error("parse[{}] == 0", i); exit(EXIT_FAILURE); }
 
         // Check Trigger Strings
-        std::vector<data_type> ts_prev(dict[parse[i-1] - 1].end() - window_size, dict[parse[i-1] - 1].end());
-        std::vector<data_type> ts_curr(dict[parse[i] - 1].begin(), dict[parse[i] - 1].begin() + window_size);
+        vcfbwt::pfp::PhraseView<data_type> ts_prev(dict[parse[i-1] - 1].end() - window_size, window_size);
+        vcfbwt::pfp::PhraseView<data_type> ts_curr(dict[parse[i] - 1].begin(), window_size);
 
         if (ts_prev != ts_curr)
         {
@@ -53,7 +51,7 @@ void check(const std::string& input_dict_path, const std::string& input_parse_pa
     {
         spdlog::info("Check occurrences");
         std::vector<vcfbwt::long_type> occ_computed(dict.size(), 0);
-        for (auto& p : parse) { occ_computed[p - 1] += 1; }
+        for (std::size_t i = 0; i < parse.size(); i++) { occ_computed[parse[i] - 1] += 1; }
 
         // Check the occ file
         bool occ_good = true;
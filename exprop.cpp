@@ -26,6 +26,7 @@ int main(int argc, char **argv)
     app.add_flag("--output-last", params.output_last, "Output last array.")->configurable();
     app.add_flag("--output-compressed-dict", params.compress_dictionary, "Output compressed dictionary.")->configurable();
     app.add_flag("--integers", integers_pfp, "Integer (uint32_t) PFP");
+    app.add_option("-j, --threads", params.threads, "Number of threads.")->configurable();
     app.add_flag_callback("--version",vcfbwt::Version::print,"Version");
     app.set_config("--configure");
     app.allow_windows_style_options();
@@ -46,5 +47,7 @@ int main(int argc, char **argv)
         properties_out.write();
     }
     
+    vcfbwt::Metrics::write(pfp_prefix + vcfbwt::EXT::METRICS, "exprop", params.threads);
+    
     return 0;
 }
\ No newline at end of file
@@ -10,6 +10,11 @@
 #include <vector>
 #include <unordered_map>
 #include <set>
+#include <queue>
+#include <atomic>
+#include <thread>
+#include <condition_variable>
+#include <memory>
 #include <iostream>
 #include <fstream>
 #include <vcf.hpp>
@@ -35,6 +40,29 @@ enum SPECIAL_TYPES
 
 //------------------------------------------------------------------------------
 
+// Read only view of a phrase stored somewhere else, compares as std::vector<data_type> does
+template <typename data_type>
+struct PhraseView
+{
+    const data_type* phrase = nullptr;
+    std::size_t length = 0;
+    
+    PhraseView() = default;
+    PhraseView(const data_type* p, std::size_t l) : phrase(p), length(l) {}
+    
+    const data_type* data() const { return phrase; }
+    std::size_t size() const { return length; }
+    const data_type* begin() const { return phrase; }
+    const data_type* end() const { return phrase + length; }
+    const data_type& operator[](std::size_t i) const { return phrase[i]; }
+    
+    bool operator==(const PhraseView& other) const
+    { return (length == other.length) and std::equal(begin(), end(), other.begin()); }
+    bool operator!=(const PhraseView& other) const { return not (*this == other); }
+    bool operator<(const PhraseView& other) const
+    { return std::lexicographical_compare(begin(), end(), other.begin(), other.end()); }
+};
+
 template <typename data_type>
 class Dictionary
 {
@@ -46,38 +74,137 @@ public:
 
     std::atomic_bool sorted;
     
-    struct DictionaryEntry
+    // Phrases are appended to a contiguous arena and addressed by offset and length. A flat open addressing
+    // table, linear probing, maps each phrase hash to its position in the arena.
+    struct Slot
+    {
+        hash_type hash = 0;
+        std::size_t offset = 0;
+        std::size_t length = 0; // 0 marks an empty slot, phrases are never empty
+    };
+    
+    // The table is split in shards selected by the phrase hash, each shard has its own lock so that
+    // workers inserting different phrases rarely wait on each other
+    static constexpr std::size_t shards_bits = 8;
+    static constexpr std::size_t num_of_shards = std::size_t(1) << shards_bits;
+    static constexpr std::size_t initial_slots = 64;
+    
+    struct Shard
     {
-        std::vector<data_type> phrase;
+        std::mutex shard_mutex;
+        std::vector<data_type> arena;
+        std::vector<Slot> slots;
+        std::size_t entries = 0;
+    };
+    
+    // key packs the first elements of the phrase, most significant first and zero padded, so that comparing
+    // keys gives the lexicographic order of the phrases unless the keys are equal
+    struct SortedEntry
+    {
+        uint64_t key;
+        PhraseView<data_type> phrase;
+        hash_type hash;
+        
+        bool operator<(const SortedEntry& other) const
+        {
+            if (key != other.key) { return key < other.key; }
+            return phrase < other.phrase;
+        }
+    };
+    
+    static uint64_t prefix_key(const PhraseView<data_type>& phrase)
+    {
+        constexpr std::size_t elements = sizeof(uint64_t) / sizeof(data_type);
+        constexpr std::size_t element_bits = sizeof(data_type) * 8;
+        uint64_t key = 0;
+        for (std::size_t i = 0; i < elements; i++)
+        {
+            key <<= (element_bits % 64);
+            if (i < phrase.size()) { key |= uint64_t(phrase[i]); }
+        }
+        return key;
+    }
     
-        DictionaryEntry() = default;
-        explicit DictionaryEntry(const std::vector<data_type>& s) : phrase(s) {}
+    Shard shards[num_of_shards];
+    struct HashRank
+    {
+        hash_type hash;
+        size_type rank;
+        
+        bool operator<(const HashRank& other) const { return hash < other.hash; }
     };
     
-    std::unordered_map<hash_type, DictionaryEntry> hash_string_map;
-    std::vector<std::pair<std::reference_wrapper<std::vector<data_type>>, hash_type>> sorted_phrases;
-    std::unordered_map<hash_type, size_type> hash_to_ranks;
+    std::vector<SortedEntry> sorted_phrases;
+    std::vector<HashRank> hash_ranks;
+    std::vector<std::size_t> hash_buckets;
+    std::size_t hash_buckets_bits = 1;
+    
+    static std::size_t shard_of(hash_type phrase_hash) { return phrase_hash >> ((sizeof(hash_type) * 8) - shards_bits); }
     
-    void sort()
+    // Locks the shard, the time spent waiting for another thread goes to the lock wait metric
+    static std::unique_lock<std::mutex> lock_shard(Shard& shard)
+    {
+        std::unique_lock<std::mutex> lock(shard.shard_mutex, std::try_to_lock);
+        if (not lock.owns_lock())
+        {
+            double wait_start = Metrics::wall_time();
+            lock.lock();
+            Metrics::add_lock_wait(Metrics::wall_time() - wait_start);
+        }
+        return lock;
+    }
+    
+    void sort(std::size_t threads = 1)
     {
         // lock the dictionary
         std::lock_guard<std::mutex> guard(dictionary_mutex);
 
         // if sorted, do nothing
         if (this->sorted.load()) { return; }
+        threads = std::max(threads, std::size_t(1));
 
-        // sort the dictionary
-        for (auto& entry : this->hash_string_map)
+        // collect phrases and their prefix keys
+        std::vector<std::size_t> shard_starts(num_of_shards + 1, 0);
+        for (std::size_t s = 0; s < num_of_shards; s++) { shard_starts[s + 1] = shard_starts[s] + this->shards[s].entries; }
+        this->sorted_phrases.resize(shard_starts[num_of_shards]);
+        
+        #pragma omp parallel for schedule(dynamic) num_threads(threads)
+        for (std::size_t s = 0; s < num_of_shards; s++)
         {
-            this->sorted_phrases.emplace_back(std::ref(entry.second.phrase), entry.first);
+            Shard& shard = this->shards[s];
+            std::lock_guard<std::mutex> shard_guard(shard.shard_mutex);
+            std::size_t out = shard_starts[s];
+            for (auto& slot : shard.slots)
+            {
+                if (slot.length == 0) { continue; }
+                PhraseView<data_type> phrase(shard.arena.data() + slot.offset, slot.length);
+                SortedEntry entry = { prefix_key(phrase), phrase, slot.hash };
+                this->sorted_phrases[out++] = entry;
+            }
         }
-        std::sort(sorted_phrases.begin(), sorted_phrases.end(), ref_smaller<data_type>);
+        
+        parallel_sort(this->sorted_phrases, threads);
 
-        // insert in hashmap
-        this->hash_to_ranks.clear();
-        for (size_type i = 0; i < sorted_phrases.size(); i++)
+        // hash to rank lookup table, pairs sorted by hash with a directory on the top bits of the hash
+        this->hash_ranks.resize(this->sorted_phrases.size());
+        #pragma omp parallel for schedule(static) num_threads(threads)
+        for (std::size_t i = 0; i < this->sorted_phrases.size(); i++)
+        {
+            HashRank entry = { this->sorted_phrases[i].hash, size_type(i + 1) }; // 1 based
+            this->hash_ranks[i] = entry;
+        }
+        parallel_sort(this->hash_ranks, threads);
+        
+        this->hash_buckets_bits = 1;
+        while (((std::size_t(1) << this->hash_buckets_bits) < this->hash_ranks.size()) and (this->hash_buckets_bits < 32))
+        { this->hash_buckets_bits++; }
+        std::size_t buckets = std::size_t(1) << this->hash_buckets_bits;
+        this->hash_buckets.resize(buckets + 1);
+        std::size_t pos = 0;
+        for (std::size_t bucket = 0; bucket <= buckets; bucket++)
         {
-            hash_to_ranks.insert(std::make_pair(sorted_phrases[i].second, i + 1)); // 1 based
+            while ((pos < this->hash_ranks.size()) and (bucket_of(this->hash_ranks[pos].hash) < bucket)) { pos++; }
+            this->hash_buckets[bucket] = pos;
         }
 
         this->sorted.store(true);
@@ -87,20 +214,22 @@ public:
     
     hash_type add(const std::vector<data_type>& phrase)
     {
-        // lock the dictionary
-        std::lock_guard<std::mutex> guard(dictionary_mutex);
+        hash_type phrase_hash = string_hash((const char*) &(phrase[0]), phrase.size() * sizeof(data_type));
+        Shard& shard = this->shards[shard_of(phrase_hash)];
+        
+        // lock the shard
+        std::unique_lock<std::mutex> guard = lock_shard(shard);
 
         this->sorted.store(false);
 
-        hash_type phrase_hash = string_hash(&(phrase[0]), phrase.size());
-        if (hash_string_map.contains(phrase_hash))
+        Slot& slot = find_slot(shard, phrase_hash);
+        if (slot.length != 0)
         {
             spdlog::error("Dictionary::addHash collision! Hash already in the dictionary");
             std::exit(EXIT_FAILURE);
         }
 
-        DictionaryEntry entry(phrase);
-        hash_string_map.insert(std::make_pair(phrase_hash, entry));
+        insert(shard, slot, phrase_hash, phrase);
 
         if (this->size() >= (std::numeric_limits<size_type>::max() - insertions_safe_guard))
         { spdlog::error("Dictionary::add Dictionary too big for type {}", typeid(size_type).name()); std::exit(EXIT_FAILURE); }
@@ -110,24 +239,25 @@ public:
 
     hash_type check_and_add(const std::vector<data_type>& phrase)
     {
-        // lock the dictionary
-        std::lock_guard<std::mutex> guard(dictionary_mutex);
+        hash_type phrase_hash = string_hash((const char*) &(phrase[0]), phrase.size() * sizeof(data_type));
+        Shard& shard = this->shards[shard_of(phrase_hash)];
+        
+        // lock the shard
+        std::unique_lock<std::mutex> guard = lock_shard(shard);
 
         // Check if present
-        hash_type phrase_hash = string_hash((const char*) &(phrase[0]), phrase.size() * sizeof(data_type));
-        const auto& ptr = hash_string_map.find(phrase_hash);
+        Slot& slot = find_slot(shard, phrase_hash);
 
-        if ((ptr != hash_string_map.end()) and (ptr->second.phrase != phrase))
+        if ((slot.length != 0) and (not same_phrase(shard, slot, phrase)))
         {
             spdlog::error("Dictionary::check_and_add Hash collision! Hash already in the dictionary for a different phrase");
             std::exit(EXIT_FAILURE);
         }
-        else if (ptr != hash_string_map.end()) { return phrase_hash; }
+        else if (slot.length != 0) { return phrase_hash; }
 
         this->sorted.store(false);
 
-        DictionaryEntry entry(phrase);
-        hash_string_map.insert(std::make_pair(phrase_hash, entry));
+        insert(shard, slot, phrase_hash, phrase);
 
         if (this->size() >= (std::numeric_limits<size_type>::max() - insertions_safe_guard))
         { spdlog::error("Dictionary::check_and_add Dictionary too big for type {}", typeid(size_type).name()); std::exit(EXIT_FAILURE); }
@@ -142,32 +272,137 @@ public:
 
     bool contains(const std::vector<data_type>& phrase)
     {
-        // lock the dictionary
-        std::lock_guard<std::mutex> guard(dictionary_mutex);
-
         hash_type phrase_hash = string_hash((const char*) &(phrase[0]), phrase.size() * sizeof(data_type));
-        const auto& ptr = hash_string_map.find(phrase_hash);
+        Shard& shard = this->shards[shard_of(phrase_hash)];
+        
+        // lock the shard
+        std::unique_lock<std::mutex> guard = lock_shard(shard);
 
-        return ((ptr != hash_string_map.end()) and (ptr->second.phrase == phrase));
+        if (shard.slots.empty()) { return false; }
+        const Slot& slot = find_slot(shard, phrase_hash);
+
+        return ((slot.length != 0) and same_phrase(shard, slot, phrase));
     }
 
     size_type hash_to_rank(hash_type hash)
     {
         if (not this->sorted.load()) { sort(); }
-        auto it = hash_to_ranks.find(hash);
-        if (it != hash_to_ranks.end()) { return it->second; }
-        else { spdlog::error("Dictionary::hash_to_rank hash requested not in the dictionary. hash: {}", hash); std::exit(EXIT_FAILURE); }
+        std::size_t bucket = bucket_of(hash);
+        for (std::size_t i = hash_buckets[bucket]; i < hash_buckets[bucket + 1]; i++)
+        {
+            if (hash_ranks[i].hash == hash) { return hash_ranks[i].rank; }
+        }
+        spdlog::error("Dictionary::hash_to_rank hash requested not in the dictionary. hash: {}", hash); std::exit(EXIT_FAILURE);
+    }
+    
+    size_type size() const { return this->entries.load(); }
+    
+    // Recomputes size and total length after the shards have been filled directly, as loading a cache does
+    void recount()
+    {
+        std::size_t count = 0, length = 0;
+        for (auto& shard : this->shards)
+        {
+            count += shard.entries;
+            for (auto& slot : shard.slots) { length += slot.length; }
+        }
+        this->entries.store(count); this->phrases_length.store(length);
+        this->sorted.store(false);
     }
     
-    size_type size() const { return hash_string_map.size(); }
+    // Sum of the lengths of all the phrases
+    std::size_t total_length() const { return this->phrases_length.load(); }
     
-    const std::vector<data_type>& sorted_entry_at(std::size_t i)
+    // Bytes of the shards and of the sorted views, not to be called while phrases are added
+    std::size_t memory_usage() const
+    {
+        std::size_t bytes = this->sorted_phrases.capacity() * sizeof(SortedEntry) + this->hash_ranks.capacity() * sizeof(HashRank) +
+                            this->hash_buckets.capacity() * sizeof(std::size_t);
+        for (auto& shard : this->shards) { bytes += shard.arena.capacity() * sizeof(data_type) + shard.slots.capacity() * sizeof(Slot); }
+        return bytes;
+    }
+    
+    PhraseView<data_type> sorted_entry_at(std::size_t i)
     {
         if (not this->sorted.load()) { sort(); }
-        return sorted_phrases[i].first.get();
+        return sorted_phrases[i].phrase;
     }
 
     friend class ParserVCF;
+    
+private:
+    
+    std::atomic<std::size_t> entries{0};
+    std::atomic<std::size_t> phrases_length{0};
+    
+    std::size_t bucket_of(hash_type hash) const { return hash >> ((sizeof(hash_type) * 8) - this->hash_buckets_bits); }
+    
+    // Sort chunks independently, then merge them pairwise
+    template <typename T>
+    static void parallel_sort(std::vector<T>& v, std::size_t threads)
+    {
+        std::size_t chunks = std::min(threads, std::max(v.size(), std::size_t(1)));
+        std::vector<std::size_t> bounds(chunks + 1);
+        for (std::size_t c = 0; c <= chunks; c++) { bounds[c] = (v.size() * c) / chunks; }
+        
+        #pragma omp parallel for schedule(static) num_threads(threads)
+        for (std::size_t c = 0; c < chunks; c++)
+        {
+            std::sort(v.begin() + bounds[c], v.begin() + bounds[c + 1]);
+        }
+        
+        for (std::size_t width = 1; width < chunks; width *= 2)
+        {
+            #pragma omp parallel for schedule(static) num_threads(threads)
+            for (std::size_t c = 0; c < chunks - width; c += 2 * width)
+            {
+                std::size_t last = std::min(c + 2 * width, chunks);
+                std::inplace_merge(v.begin() + bounds[c], v.begin() + bounds[c + width], v.begin() + bounds[last]);
+            }
+        }
+    }
+    
+    // Slot holding phrase_hash, or the empty slot where it should go. The shard has to be locked.
+    static Slot& find_slot(Shard& shard, hash_type phrase_hash)
+    {
+        // keep the load factor under 0.7
+        if ((shard.entries + 1) * 10 > shard.slots.size() * 7) { grow(shard); }
+        
+        std::size_t mask = shard.slots.size() - 1;
+        std::size_t i = phrase_hash & mask;
+        while ((shard.slots[i].length != 0) and (shard.slots[i].hash != phrase_hash)) { i = (i + 1) & mask; }
+        return shard.slots[i];
+    }
+    
+    static void grow(Shard& shard)
+    {
+        std::vector<Slot> new_slots(std::max(shard.slots.size() * 2, initial_slots));
+        std::size_t mask = new_slots.size() - 1;
+        for (auto& slot : shard.slots)
+        {
+            if (slot.length == 0) { continue; }
+            std::size_t i = slot.hash & mask;
+            while (new_slots[i].length != 0) { i = (i + 1) & mask; }
+            new_slots[i] = slot;
+        }
+        shard.slots.swap(new_slots);
+    }
+    
+    static bool same_phrase(const Shard& shard, const Slot& slot, const std::vector<data_type>& phrase)
+    {
+        return (slot.length == phrase.size()) and std::equal(phrase.begin(), phrase.end(), shard.arena.begin() + slot.offset);
+    }
+    
+    void insert(Shard& shard, Slot& slot, hash_type phrase_hash, const std::vector<data_type>& phrase)
+    {
+        slot.hash = phrase_hash;
+        slot.offset = shard.arena.size();
+        slot.length = phrase.size();
+        shard.arena.insert(shard.arena.end(), phrase.begin(), phrase.end());
+        shard.entries += 1;
+        
+        this->entries += 1; this->phrases_length += phrase.size();
+    }
 };
 
 //------------------------------------------------------------------------------
@@ -184,18 +419,79 @@ struct Params
     bool output_sai = false;
     bool output_last = false;
     uint32_t integers_shift = 10;
+    std::size_t threads = 1;
+    std::string reference_cache_dir; // empty, the reference parse is not cached
+    bool compact_parse = false;
+    std::size_t parse_memory_budget = 0; // bytes of phrase hashes all the parsers may keep in memory
 };
 
+// Parses block as the continuation of the open phrase. on_phrase(phrase, i) is called for every phrase closed by
+// the trigger string ending at block[i], afterwards phrase holds what is left open.
+template <typename data_type, typename callback_type>
+void parse_block(const data_type* block, std::size_t length, std::vector<data_type>& phrase, const Params& params,
+                 callback_type on_phrase)
+{
+    std::size_t w = params.w;
+    std::vector<std::size_t> triggers;
+    
+    // Windows ending in the first w - 1 elements of the block also cover the end of the open phrase,
+    // a phrase is closed only if longer than w
+    std::size_t tail_length = std::min(phrase.size(), w - 1);
+    std::vector<data_type> seam(phrase.end() - tail_length, phrase.end());
+    seam.insert(seam.end(), block, block + std::min(length, w - 1));
+    std::size_t seam_first = (phrase.size() >= w) ? tail_length : (w + tail_length - phrase.size());
+    find_trigger_strings(seam.data(), seam.size(), seam_first, w, params.p, triggers);
+    for (auto& trigger : triggers) { trigger -= tail_length; }
+    
+    // Windows inside the block
+    std::size_t block_first = std::max(w - 1, w - std::min(phrase.size(), w));
+    find_trigger_strings(block, length, block_first, w, params.p, triggers);
+    
+    std::size_t consumed = 0;
+    for (auto trigger : triggers)
+    {
+        phrase.insert(phrase.end(), block + consumed, block + trigger + 1);
+        consumed = trigger + 1;
+        
+        on_phrase(phrase, trigger);
+        
+        phrase.erase(phrase.begin(), phrase.end() - w); // Keep the last w chars
+    }
+    phrase.insert(phrase.end(), block + consumed, block + length);
+}
+
 struct Statistics
 {
     std::size_t parse_length = 0;
     std::size_t total_dictionary_length = 0;
     std::size_t num_of_phrases_dictionary = 0;
+    std::size_t bases_parsed = 0;
+    double parse_seconds = 0.0;
 };
 
 class ReferenceParse
 {
 
+private:
+    
+    // The cache holds the dictionary table, the parse and the trigger strings positions of a reference, keyed by
+    // the checksum of the reference and the parameters changing the parse. See load_cache and save_cache
+    struct CacheHeader
+    {
+        char magic[8];
+        uint64_t version;
+        uint64_t checksum[2];
+        uint64_t reference_length;
+        uint64_t w, p, acgt_only;
+        uint64_t hash_seed, hash_bytes, slot_bytes, shards;
+        uint64_t parse_size;
+    };
+    
+    CacheHeader cache_header(const std::string& reference) const;
+    std::string cache_file_name(const CacheHeader& header) const;
+    bool load_cache(const std::string& file_name, const CacheHeader& header);
+    void save_cache(const std::string& file_name, CacheHeader header) const;
+
 public :
     Dictionary<vcfbwt::char_type> dictionary;
     std::vector<hash_type> parse;
@@ -204,9 +500,84 @@ public :
     const Params& params;
     
     void init(const std::string& reference);
+    void parse_reference(const std::string& reference);
     
     ReferenceParse(const std::string& reference, const Params& pms) : params(pms) { this->init(reference); }
     const hash_type& operator[](std::size_t i) const { return this->parse[i]; }
+    
+    std::size_t memory_usage() const
+    {
+        return this->dictionary.memory_usage() + this->parse.capacity() * sizeof(hash_type) +
+               this->trigger_strings_position.capacity() * sizeof(std::size_t);
+    }
+};
+
+// Collects the hashes of the phrases of a parser. Hashes are kept in memory while the memory budget, shared by all
+// sinks, allows it, then they go to file_name. On disk a background thread writes one buffer while the parser fills
+// the other. After close the hashes are read through data(), from memory or from the mapped file.
+class ParseSink
+{
+public:
+    
+    ParseSink() = default;
+    // The moved from sink is left closed and empty, the budget and the file are released only by the new one
+    ParseSink(ParseSink&& other);
+    ~ParseSink() { close(); release(); }
+    
+    void open(const std::string& file_name, std::size_t memory_budget);
+    
+    void write(hash_type hash)
+    {
+        if (this->front.size() < this->front_capacity) { this->front.push_back(hash); this->length += 1; }
+        else { write(&hash, 1); }
+    }
+    void write(const hash_type* hashes, std::size_t n);
+    
+    void close();
+    
+    // Frees the hashes, data() is no longer valid
+    void release();
+    
+    const hash_type* data() const;
+    std::size_t size() const { return this->length; }
+    bool in_memory() const { return this->writer == nullptr; }
+    std::size_t disk_bytes() const { return in_memory() ? 0 : this->writer->bytes; }
+    
+private:
+    
+    static constexpr std::size_t buffer_length = 1 << 20;
+    static std::atomic<std::size_t> memory_used;
+    
+    struct Writer
+    {
+        std::ofstream out;
+        std::thread thread;
+        std::mutex mutex;
+        std::condition_variable condition;
+        std::vector<hash_type> back;
+        bool pending = false;
+        bool done = false;
+        std::size_t bytes = 0;
+    };
+    
+    std::string file_name;
+    std::size_t memory_budget = 0;
+    std::size_t length = 0;
+    bool closed = true;
+    
+    // hashes being filled, all of them while in memory. write(hash) appends without checks up to front_capacity
+    std::vector<hash_type> front;
+    std::size_t front_capacity = 0;
+    std::size_t reserved = 0; // bytes of memory_used held by this sink
+    
+    std::unique_ptr<Writer> writer;
+    mio::mmap_source mapped;
+    
+    bool reserve(std::size_t n);
+    void spill();
+    void hand_off();
+    
+    static void write_back(Writer* writer);
 };
 
 // Create a parse on disk
@@ -215,7 +586,7 @@ class ParserVCF
 
 private:
     
-    std::ofstream out_file;
+    ParseSink out_sink;
     std::string out_file_prefix;
     std::string out_file_name;
     std::string tmp_out_file_name;
@@ -238,8 +609,15 @@ private:
     
     std::size_t working_genotype = 0;
     
+    // Portion of the parse written for one haplotype, haplotypes go in the final parse by increasing unit
+    struct ParsedHaplotype { std::size_t unit; std::size_t first; std::size_t length; };
+    std::vector<ParsedHaplotype> parsed_haplotypes;
+    
 public:
     
+    // Haplotypes without a unit keep the order of the parsers and of the calls
+    static constexpr std::size_t NO_UNIT = std::numeric_limits<std::size_t>::max();
+    
     enum tags
     {
         MAIN = 1,
@@ -262,8 +640,7 @@ public:
     ~ParserVCF()
     {
         close();
-        std::size_t total_length = 0;
-        for (auto& entry : dictionary->hash_string_map) { total_length += entry.second.phrase.size(); }
+        std::size_t total_length = dictionary->total_length();
     
         // Fill out statistics
         this->statistics.parse_length = this->parse_size;
@@ -292,7 +669,12 @@ public:
     void register_worker(ParserVCF& parser) { this->registered_workers.push_back(std::ref(parser)); }
     void set_working_genotype(std::size_t genotype) { this->working_genotype = genotype; }
     
-    void operator()(const Sample& sample);
+    void operator()(const Sample& sample, std::size_t unit = NO_UNIT);
+    
+    // Writes the phrase that ends the text, the one parsing the last sample adds. For when the last sample is not
+    // known while parsing, unit must follow the units of all the haplotypes
+    void end_of_text(std::size_t unit = NO_UNIT);
+    
     void close();
 };
 
@@ -303,7 +685,7 @@ class ParserFasta
 
 private:
     
-    std::ofstream out_file;
+    ParseSink out_sink;
     std::string out_file_prefix;
     std::string out_file_name;
     std::string tmp_out_file_name;
@@ -320,6 +702,9 @@ private:
     
     bool closed = false;
     
+    // Parse a whole sequence splitting it in chunks among params.threads threads
+    void parse_sequence_parallel(const char* sequence, std::size_t length, std::vector<vcfbwt::char_type>& phrase);
+    
 public:
     
     void init(const Params& params, const std::string& prefix);
@@ -337,8 +722,7 @@ public:
     ~ParserFasta()
     {
         close();
-        std::size_t total_length = 0;
-        for (auto& entry : dictionary.hash_string_map) { total_length += entry.second.phrase.size(); }
+        std::size_t total_length = dictionary.total_length();
         
         // Fill out statistics
         this->statistics.parse_length = this->parse_size;
@@ -375,7 +759,7 @@ class ParserText
 
 private:
     
-    std::ofstream out_file;
+    ParseSink out_sink;
     std::string out_file_prefix;
     std::string out_file_name;
     std::string tmp_out_file_name;
@@ -409,8 +793,7 @@ public:
     ~ParserText()
     {
         close();
-        std::size_t total_length = 0;
-        for (auto& entry : dictionary.hash_string_map) { total_length += entry.second.phrase.size(); }
+        std::size_t total_length = dictionary.total_length();
         
         // Fill out statistics
         this->statistics.parse_length = this->parse_size;
@@ -448,7 +831,7 @@ class ParserIntegers
 
 private:
 
-    std::ofstream out_file;
+    ParseSink out_sink;
     std::string out_file_prefix;
     std::string out_file_name;
     std::string tmp_out_file_name;
@@ -482,8 +865,7 @@ public:
     ~ParserIntegers()
     {
         close();
-        std::size_t total_length = 0;
-        for (auto& entry : dictionary.hash_string_map) { total_length += entry.second.phrase.size() * sizeof(int32_t); }
+        std::size_t total_length = dictionary.total_length() * sizeof(int32_t);
 
         // Fill out statistics
         this->statistics.parse_length = this->parse_size;
@@ -515,150 +897,417 @@ public:
 
 //------------------------------------------------------------------------------
 
-#include <sys/stat.h>
+// Compact .parse, the header is followed by the ranks bit-packed in 64 bits words, least significant bits first,
+// plus one word of padding. A flat .parse starts with rank 1, so it can't be mistaken for the magic.
+struct PackedParseHeader
+{
+    char magic[8];
+    uint64_t bits;
+    uint64_t length;
+};
 
-template <typename data_type>
-class ParserUtils
+// Packs the flat .parse parse_file_name in place, using the bits needed by the largest rank dictionary_size
+void pack_parse(const std::string& parse_file_name, std::size_t dictionary_size, std::size_t threads);
+
+// Read only view of a .parse file mapped in memory, flat or packed, ranks are read in place
+class ParseView
 {
+private:
+    mio::mmap_source mapped;
+    const size_type* ranks = nullptr;
+    const uint64_t* words = nullptr; // packed ranks, when bits != 0
+    std::size_t bits = 0;
+    uint64_t mask = 0;
+    std::size_t length = 0;
+
 public:
-    
-    static void read_parse(std::string parse_file_name, std::vector<size_type>& parse)
+    ParseView() = default;
+    explicit ParseView(const std::string& parse_file_name) { open(parse_file_name); }
+
+    void open(const std::string& parse_file_name)
     {
-        // reserve memory for the parse
-        struct stat64 stat_buf;
-        int rc = stat64(parse_file_name.c_str(), &stat_buf);
-        if (rc == 0) { parse.reserve((stat_buf.st_size / sizeof(size_type)) + 1); }
+        map_file(parse_file_name, this->mapped, true);
         
-        std::ifstream parse_file(parse_file_name, std::ios::binary);
-        if (not parse_file.is_open()) { spdlog::error("Error opening file: {}", parse_file_name); std::exit(EXIT_FAILURE); }
+        PackedParseHeader header;
+        if ((this->mapped.size() >= sizeof(PackedParseHeader)) and
+            (std::memcmp(this->mapped.data(), "PFPPACK\0", sizeof(header.magic)) == 0))
+        {
+            std::memcpy(&header, this->mapped.data(), sizeof(PackedParseHeader));
+            std::size_t words_size = ((header.length * header.bits + 63) / 64) + 1;
+            if ((header.bits == 0) or (header.bits > sizeof(size_type) * 8) or
+                (this->mapped.size() != sizeof(PackedParseHeader) + words_size * sizeof(uint64_t)))
+            { spdlog::error("{} is not a valid packed parse", parse_file_name); std::exit(EXIT_FAILURE); }
+            
+            this->words = reinterpret_cast<const uint64_t*>(this->mapped.data() + sizeof(PackedParseHeader));
+            this->bits = header.bits;
+            this->mask = (this->bits == 64) ? ~uint64_t(0) : ((uint64_t(1) << this->bits) - 1);
+            this->length = header.length;
+            return;
+        }
         
-        while (not parse_file.eof()) { size_type i; parse_file.read((char*) &i, sizeof(size_type)); parse.push_back(i); }
+        if ((this->mapped.size() % sizeof(size_type)) != 0)
+        { spdlog::error("{} is not a sequence of {} bytes ranks", parse_file_name, sizeof(size_type)); std::exit(EXIT_FAILURE); }
 
-        // remove last entry, apparently it reads the last twice
-        parse.pop_back();
+        this->ranks = reinterpret_cast<const size_type*>(this->mapped.data());
+        this->length = this->mapped.size() / sizeof(size_type);
     }
 
-    static void read_dictionary(std::string dic_file_name, std::vector<std::vector<data_type>>& dictionary_vector)
+    std::size_t size() const { return this->length; }
+    bool empty() const { return this->length == 0; }
+    bool packed() const { return this->bits != 0; }
+    
+    size_type operator[](std::size_t i) const
+    {
+        if (this->bits == 0) { return this->ranks[i]; }
+        
+        std::size_t bit = i * this->bits, offset = bit & 63;
+        const uint64_t* word = this->words + (bit >> 6);
+        uint64_t value = word[0] >> offset;
+        if (offset + this->bits > 64) { value |= word[1] << (64 - offset); }
+        return size_type(value & this->mask);
+    }
+};
+
+// Read only view of a .dict file mapped in memory, phrases are PhraseViews over the mapped bytes located through
+// an offsets array built with a single scan of the file
+template <typename data_type>
+class DictionaryView
+{
+private:
+    mio::mmap_source mapped;
+    const data_type* symbols = nullptr;
+
+    // phrase i spans [offsets[i], offsets[i + 1] - 1), the last symbol of each span being its ENDOFWORD
+    std::vector<std::size_t> offsets;
+
+public:
+    DictionaryView() = default;
+    explicit DictionaryView(const std::string& dic_file_name) { open(dic_file_name); }
+
+    void open(const std::string& dic_file_name)
     {
-        std::ifstream dic_file(dic_file_name);
-        if (not dic_file.is_open()) { spdlog::error("Error opening file: {}", dic_file_name); std::exit(EXIT_FAILURE); }
+        map_file(dic_file_name, this->mapped, true);
+        this->symbols = reinterpret_cast<const data_type*>(this->mapped.data());
+        std::size_t length = this->mapped.size() / sizeof(data_type);
 
-        data_type c = 5;
-        while (c != ENDOFDICT)
+        this->offsets.assign(1, 0);
+        std::size_t i = 0;
+        while ((i < length) and (this->symbols[i] != data_type(ENDOFDICT)))
         {
-            std::vector<data_type> phrase;
-            while ((dic_file.read((char*) &c, sizeof(data_type)).good()) and (c != ENDOFWORD and c != ENDOFDICT))
-            {
-                phrase.emplace_back(c);
-            }
-            if (phrase.size() != 0) { dictionary_vector.push_back(phrase); }
+            const data_type* eow = std::find(this->symbols + i, this->symbols + length, data_type(ENDOFWORD));
+            const data_type* eod = std::find(this->symbols + i, eow, data_type(ENDOFDICT));
+            if ((eow == this->symbols + length) or (eod != eow))
+            { spdlog::error("{} is truncated, phrase {} is not terminated", dic_file_name, this->size()); std::exit(EXIT_FAILURE); }
+
+            i = (eow - this->symbols) + 1;
+            if (i - this->offsets.back() == 1)
+            { spdlog::error("{} contains an empty phrase at {}", dic_file_name, this->size()); std::exit(EXIT_FAILURE); }
+            this->offsets.push_back(i);
         }
     }
 
-    static void merge(const std::string& left_prefix, const std::string& right_prefix, const std::string& out_prefix, const Params& params)
+    std::size_t size() const { return this->offsets.size() - 1; }
+    bool empty() const { return this->size() == 0; }
+
+    PhraseView<data_type> operator[](std::size_t i) const
+    { return PhraseView<data_type>(this->symbols + this->offsets[i], this->offsets[i + 1] - this->offsets[i] - 1); }
+};
+
+//------------------------------------------------------------------------------
+
+template <typename data_type>
+class ParserUtils
+{
+public:
+    
+    // Copies of the mapped views, prefer ParseView and DictionaryView when the content is only read
+    static void read_parse(std::string parse_file_name, std::vector<size_type>& parse)
     {
-        // Merged Dictionary and Parse
-        Dictionary<data_type> dictionary;
+        ParseView view(parse_file_name);
+        parse.reserve(parse.size() + view.size());
+        for (std::size_t i = 0; i < view.size(); i++) { parse.push_back(view[i]); }
+    }
 
-        // Out parse, tmp
-        std::string tmp_out_file_name = TempFile::getName("parse");
-        std::ofstream tmp_out_parse(tmp_out_file_name);
-        std::size_t parse_size = 0;
+    static void read_dictionary(std::string dic_file_name, std::vector<std::vector<data_type>>& dictionary_vector)
+    {
+        DictionaryView<data_type> view(dic_file_name);
+        dictionary_vector.reserve(dictionary_vector.size() + view.size());
+        for (std::size_t i = 0; i < view.size(); i++) { dictionary_vector.emplace_back(view[i].begin(), view[i].end()); }
+    }
 
-        // Read Left and Right Dictionary
-        spdlog::info("Loading dictionaries from disk");
-        std::vector<std::vector<data_type>> left_dictionary;
-        read_dictionary(left_prefix + EXT::DICT, left_dictionary);
-        std::vector<std::vector<data_type>> right_dictionary;
-        read_dictionary(right_prefix + EXT::DICT, right_dictionary);
+    static void merge(const std::string& left_prefix, const std::string& right_prefix, const std::string& out_prefix, const Params& params)
+    {
+        merge(std::vector<std::string>({ left_prefix, right_prefix }), out_prefix, params);
+    }
 
-        // Read Left parse and substitute ranks with hash again storing in the merged dictionary
-        spdlog::info("Iterating over left parse");
-        std::ifstream left_parse(left_prefix + EXT::PARSE);
-        if (not left_parse.is_open()) { spdlog::error("Failed to open {}", left_prefix + EXT::PARSE); std::exit(EXIT_FAILURE); }
-        
-        size_type pel = 0;
-        hash_type last_phrase_hash;
-        while(left_parse.read((char*) &pel, sizeof(size_type)))
+    // Merges the PFPs in order. The last phrase of every PFP but the last loses its w dollars, as it already ends
+    // with DOLLAR_PRIME and DOLLAR_SEQUENCE, the first phrase of every PFP but the first has its dollar replaced by
+    // DOLLAR_PRIMEs and DOLLAR_SEQUENCE.
+    // The input dictionaries are sorted, so they are merged linearly together with the few rewritten boundary
+    // phrases, giving for each input a table from its ranks to the merged ones. The parses are then remapped
+    // through the tables, no phrase is hashed.
+    static void merge(const std::vector<std::string>& prefixes, const std::string& out_prefix, const Params& params)
+    {
+        // Map dictionaries and parses, find the phrases rewritten at the boundaries
+        spdlog::info("Loading dictionaries from disk");
+        Metrics::Phase load_phase("load dictionaries");
+        std::vector<DictionaryView<data_type>> dictionaries(prefixes.size());
+        std::vector<ParseView> parses(prefixes.size());
+        std::vector<std::vector<size_type>> rewritten(prefixes.size()); // 0 based ranks, sorted
+        #pragma omp parallel for schedule(dynamic) num_threads(params.threads)
+        for (std::size_t k = 0; k < prefixes.size(); k++)
         {
-            std::vector<data_type>& phrase = left_dictionary[pel - 1];
+            dictionaries[k].open(prefixes[k] + EXT::DICT);
+            parses[k].open(prefixes[k] + EXT::PARSE);
             
-            if (phrase[phrase.size() - 1] == DOLLAR)
+            for (std::size_t r = 0; r < dictionaries[k].size(); r++)
             {
-                // get rid of the dollars, it already has DOLLAR_PRIME and DOLLAR_SEQUENCE
-                phrase.resize(phrase.size() - params.w);
+                PhraseView<data_type> phrase = dictionaries[k][r];
+                bool last_phrase = (k + 1 < prefixes.size()) and (phrase[phrase.size() - 1] == DOLLAR);
+                bool first_phrase = (k != 0) and (r == 0);
+                if (last_phrase or first_phrase) { rewritten[k].push_back(r); }
             }
-            
-            hash_type hash = dictionary.check_and_add(phrase);
-            last_phrase_hash = hash;
-
-            tmp_out_parse.write((char*) (&hash), sizeof(hash_type));
-            parse_size += 1;
         }
-        left_parse.close();
-        left_dictionary.resize(0);
-
-        // Read right parse, changing first phrase
-        spdlog::info("Iterating over right parse");
-        std::ifstream right_parse(right_prefix + EXT::PARSE);
-        if (not right_parse.is_open()) { spdlog::error("Failed to open {}", right_prefix + EXT::PARSE); std::exit(EXIT_FAILURE); }
-
-        size_type per = 0;
-        while(right_parse.read((char*) &per, sizeof(size_type)))
+        
+        std::vector<BoundaryPhrase> boundary_phrases;
+        for (std::size_t k = 0; k < prefixes.size(); k++)
         {
-            std::vector<data_type>& phrase = right_dictionary[per - 1];
-            if (per == 1)
+            for (auto r : rewritten[k])
             {
-                phrase[0] = DOLLAR_SEQUENCE;
-                phrase.insert(phrase.begin(), params.w - 1, DOLLAR_PRIME);
+                PhraseView<data_type> entry = dictionaries[k][r];
+                BoundaryPhrase boundary = { std::vector<data_type>(entry.begin(), entry.end()), k, r };
+                std::vector<data_type>& phrase = boundary.phrase;
+                
+                if ((k + 1 < prefixes.size()) and (phrase[phrase.size() - 1] == DOLLAR))
+                {
+                    // get rid of the dollars, it already has DOLLAR_PRIME and DOLLAR_SEQUENCE
+                    phrase.resize(phrase.size() - params.w);
+                }
+                if ((k != 0) and (r == 0))
+                {
+                    phrase[0] = DOLLAR_SEQUENCE;
+                    phrase.insert(phrase.begin(), params.w - 1, DOLLAR_PRIME);
+                }
+                boundary_phrases.push_back(boundary);
             }
-            hash_type hash = dictionary.check_and_add(phrase);
-
-            tmp_out_parse.write((char*) (&hash), sizeof(hash_type));
-            parse_size += 1;
         }
-        right_parse.close();
-        right_dictionary.resize(0);
-
-        vcfbwt::DiskWrites::update(tmp_out_parse.tellp());
-        tmp_out_parse.close();
-
-        spdlog::info("Merge: Replacing hash values with ranks.");
         
-        if (parse_size != 0)
+        load_phase.stop();
+        
+        spdlog::info("Merge: merging {} sorted dictionaries.", prefixes.size());
+        std::vector<std::vector<size_type>> remaps;
+        std::size_t dictionary_size = merge_sorted(dictionaries, rewritten, boundary_phrases, out_prefix + EXT::DICT, remaps);
+        
+        spdlog::info("Merge: Replacing ranks.");
+        std::vector<ParseRange> ranges;
+        for (std::size_t k = 0; k < prefixes.size(); k++) { ranges.push_back({ k, 0, parses[k].size() }); }
+        std::size_t parse_size = remap_parses(parses, ranges, remaps, out_prefix + EXT::PARSE, params);
+        
+        if (params.compact_parse and (parse_size != 0)) { pack_parse(out_prefix + EXT::PARSE, dictionary_size, params.threads); }
+    }
+    
+    // Appends the haplotypes of new_prefix, a VCF PFP of the same reference parse whose first reference_length
+    // phrases are the reference, to the VCF PFP at existing_prefix. The end of text phrase of the existing PFP is
+    // dropped, so the output is the PFP of all the samples in one run. out_prefix can be existing_prefix.
+    static void append(const std::string& existing_prefix, const std::string& new_prefix, std::size_t reference_length,
+                       const std::string& out_prefix, const Params& params)
+    {
+        spdlog::info("Append: loading dictionaries from disk");
+        Metrics::Phase load_phase("load dictionaries");
+        std::vector<DictionaryView<data_type>> dictionaries(2);
+        std::vector<ParseView> parses(2);
+        dictionaries[0].open(existing_prefix + EXT::DICT); parses[0].open(existing_prefix + EXT::PARSE);
+        dictionaries[1].open(new_prefix + EXT::DICT); parses[1].open(new_prefix + EXT::PARSE);
+        
+        // Both must start with the same reference and end with the end of text phrase
+        std::vector<data_type> end_of_text(params.w - 1, DOLLAR_PRIME);
+        end_of_text.push_back(DOLLAR_SEQUENCE);
+        end_of_text.insert(end_of_text.end(), params.w, DOLLAR);
+        PhraseView<data_type> end_of_text_view(end_of_text.data(), end_of_text.size());
+        for (std::size_t k = 0; k < 2; k++)
         {
-            std::ofstream out_ranks(out_prefix + EXT::PARSE);
-            if (not out_ranks.is_open()) { spdlog::error("Can't open {}", out_prefix + EXT::PARSE); std::exit(EXIT_FAILURE); }
-
-            std::ifstream in_hash(tmp_out_file_name);
-            if (not in_hash.is_open()) { spdlog::error("Can't open {}", tmp_out_file_name); std::exit(EXIT_FAILURE); }
+            if ((parses[k].size() <= reference_length) or (dictionaries[k][parses[k][parses[k].size() - 1] - 1] != end_of_text_view))
+            { spdlog::error("Append: {} is not a VCF PFP with window {}", (k == 0) ? existing_prefix : new_prefix, params.w); std::exit(EXIT_FAILURE); }
+        }
+        
+        bool same_reference = true;
+        #pragma omp parallel for schedule(static) num_threads(params.threads) reduction(&&:same_reference)
+        for (std::size_t i = 0; i < reference_length; i++)
+        {
+            same_reference = same_reference and (dictionaries[0][parses[0][i] - 1] == dictionaries[1][parses[1][i] - 1]);
+        }
+        if (not same_reference)
+        { spdlog::error("Append: {} was not built on the same reference and parameters", existing_prefix); std::exit(EXIT_FAILURE); }
+        
+        // Every phrase of the new reference is in the existing dictionary, as is the end of text phrase, so the union
+        // of the dictionaries is the merged one
+        std::string tmp_out_prefix = out_prefix;
+        if ((out_prefix == existing_prefix) or (out_prefix == new_prefix)) { tmp_out_prefix = out_prefix + ".append"; }
+        
+        load_phase.stop();
+        
+        spdlog::info("Append: merging sorted dictionaries.");
+        std::vector<std::vector<size_type>> remaps;
+        std::size_t dictionary_size = merge_sorted(dictionaries, std::vector<std::vector<size_type>>(2),
+                                                   std::vector<BoundaryPhrase>(), tmp_out_prefix + EXT::DICT, remaps);
+        
+        spdlog::info("Append: Replacing ranks.");
+        std::vector<ParseRange> ranges = { { 0, 0, parses[0].size() - 1 }, { 1, reference_length, parses[1].size() } };
+        remap_parses(parses, ranges, remaps, tmp_out_prefix + EXT::PARSE, params);
+        
+        dictionaries.clear(); parses.clear();
+        if (params.compact_parse) { pack_parse(tmp_out_prefix + EXT::PARSE, dictionary_size, params.threads); }
+        if (tmp_out_prefix != out_prefix)
+        {
+            if ((std::rename((tmp_out_prefix + EXT::DICT).c_str(), (out_prefix + EXT::DICT).c_str()) != 0) or
+                (std::rename((tmp_out_prefix + EXT::PARSE).c_str(), (out_prefix + EXT::PARSE).c_str()) != 0))
+            { spdlog::error("Append: can't replace {}", out_prefix); std::exit(EXIT_FAILURE); }
+        }
+    }
 
-            for (std::size_t i = 0; i < parse_size; i++)
+private:
+    
+    // A phrase rewritten at the boundary between two PFPs, replacing the phrase of rank rank + 1 in input
+    struct BoundaryPhrase { std::vector<data_type> phrase; std::size_t input; size_type rank; };
+    
+    // Parse elements [first, last) of input
+    struct ParseRange { std::size_t input; std::size_t first; std::size_t last; };
+    
+    // Merges the sorted dictionaries, except their rewritten phrases, with the boundary phrases and writes the
+    // result in dict_file_name. remaps[k][r] is the merged rank of phrase r + 1 of dictionary k. Returns the number
+    // of merged phrases.
+    static std::size_t merge_sorted(const std::vector<DictionaryView<data_type>>& dictionaries,
+                             const std::vector<std::vector<size_type>>& rewritten,
+                             std::vector<BoundaryPhrase> boundary_phrases, const std::string& dict_file_name,
+                             std::vector<std::vector<size_type>>& remaps)
+    {
+        Metrics::Phase phase("merge dictionaries");
+        
+        std::sort(boundary_phrases.begin(), boundary_phrases.end(), [](const BoundaryPhrase& a, const BoundaryPhrase& b)
+        { return a.phrase < b.phrase; });
+        
+        std::ofstream dict(dict_file_name, std::ios_base::binary);
+        if (not dict.is_open()) { spdlog::error("Can't open {}", dict_file_name); std::exit(EXIT_FAILURE); }
+        
+        remaps.resize(dictionaries.size());
+        for (std::size_t k = 0; k < dictionaries.size(); k++) { remaps[k].assign(dictionaries[k].size(), 0); }
+        
+        // source dictionaries.size() is the list of boundary phrases
+        std::size_t boundary_source = dictionaries.size();
+        struct Head { PhraseView<data_type> phrase; std::size_t source; std::size_t index; };
+        auto after = [](const Head& a, const Head& b) { return b.phrase < a.phrase; };
+        std::priority_queue<Head, std::vector<Head>, decltype(after)> heads(after);
+        
+        // next phrase of a source from index on, rewritten phrases are taken from the boundary list instead
+        auto push_head = [&](std::size_t source, std::size_t index)
+        {
+            if (source == boundary_source)
             {
-                hash_type hash;
-                in_hash.read((char*) &hash, sizeof(hash_type));
-                size_type rank = dictionary.hash_to_rank(hash);
-                out_ranks.write((char*) &rank, sizeof(size_type));
+                if (index >= boundary_phrases.size()) { return; }
+                const std::vector<data_type>& phrase = boundary_phrases[index].phrase;
+                Head head = { PhraseView<data_type>(phrase.data(), phrase.size()), source, index };
+                heads.push(head);
+                return;
             }
-            in_hash.close();
-            vcfbwt::DiskWrites::update(out_ranks.tellp());
-            out_ranks.close();
+            while ((index < dictionaries[source].size()) and
+                   std::binary_search(rewritten[source].begin(), rewritten[source].end(), index)) { index++; }
+            if (index >= dictionaries[source].size()) { return; }
+            Head head = { dictionaries[source][index], source, index };
+            heads.push(head);
+        };
+        for (std::size_t source = 0; source <= boundary_source; source++) { push_head(source, 0); }
         
-        }
-        // Print dicitionary on disk
-        spdlog::info("Merge: writing dictionary on disk NOT COMPRESSED");
-        std::string dict_file_name = out_prefix + EXT::DICT;
-        std::ofstream dict(dict_file_name);
-
-        for (size_type i = 0; i < dictionary.size(); i++)
+        std::size_t merged_size = 0;
+        PhraseView<data_type> previous;
+        while (not heads.empty())
         {
-            dict.write((char*) dictionary.sorted_entry_at(i).data(), dictionary.sorted_entry_at(i).size());
-            dict.put(ENDOFWORD);
+            Head head = heads.top(); heads.pop();
+            
+            if ((merged_size == 0) or (head.phrase != previous))
+            {
+                merged_size += 1;
+                if (merged_size >= std::numeric_limits<size_type>::max())
+                { spdlog::error("Merge: Dictionary too big for type {}", typeid(size_type).name()); std::exit(EXIT_FAILURE); }
+                
+                dict.write((char*) head.phrase.data(), head.phrase.size() * sizeof(data_type));
+                data_type end_of_word = ENDOFWORD;
+                dict.write((char*) &end_of_word, sizeof(data_type));
+                previous = head.phrase;
+            }
+            
+            if (head.source == boundary_source)
+            {
+                const BoundaryPhrase& boundary = boundary_phrases[head.index];
+                remaps[boundary.input][boundary.rank] = merged_size;
+            }
+            else { remaps[head.source][head.index] = merged_size; }
+            
+            push_head(head.source, head.index + 1);
         }
-        dict.put(ENDOFDICT);
-
+        data_type end_of_dict = ENDOFDICT;
+        dict.write((char*) &end_of_dict, sizeof(data_type));
+        
         vcfbwt::DiskWrites::update(dict.tellp()); // Disk Stats
         dict.close();
+        
+        return merged_size;
+    }
+    
+    // Writes the ranges one after the other in out_file_name, remapping their ranks. Each range is split in chunks
+    // remapped in parallel. Returns the length of the written parse, nothing is written when empty.
+    static std::size_t remap_parses(const std::vector<ParseView>& parses, const std::vector<ParseRange>& ranges,
+                             const std::vector<std::vector<size_type>>& remaps, const std::string& out_file_name,
+                             const Params& params)
+    {
+        Metrics::Phase phase("rank substitution");
+        
+        struct RanksChunk { std::size_t input; std::size_t first; std::size_t last; std::size_t out_offset; };
+        const std::size_t chunk_size = 1 << 20;
+        std::vector<RanksChunk> chunks;
+        std::size_t parse_size = 0;
+        for (auto& range : ranges)
+        {
+            for (std::size_t first = range.first; first < range.last; first += chunk_size)
+            {
+                RanksChunk chunk = { range.input, first, std::min(first + chunk_size, range.last),
+                                     parse_size + (first - range.first) };
+                chunks.push_back(chunk);
+            }
+            parse_size += range.last - range.first;
+        }
+        
+        if (parse_size == 0) { return 0; }
+        
+        std::ofstream out_ranks(out_file_name, std::ios_base::binary);
+        if (not out_ranks.is_open()) { spdlog::error("Can't open {}", out_file_name); std::exit(EXIT_FAILURE); }
+        out_ranks.close();
+        vcfbwt::truncate_file(out_file_name, parse_size * sizeof(size_type));
+        
+        mio::mmap_sink out_parse;
+        std::error_code error;
+        out_parse.map(out_file_name, error);
+        if (error) { spdlog::error("Can't map {}: {}", out_file_name, error.message()); std::exit(EXIT_FAILURE); }
+        size_type* ranks = reinterpret_cast<size_type*>(out_parse.data());
+        
+        #pragma omp parallel for schedule(dynamic) num_threads(params.threads)
+        for (std::size_t c = 0; c < chunks.size(); c++)
+        {
+            const RanksChunk& chunk = chunks[c];
+            const std::vector<size_type>& remap = remaps[chunk.input];
+            size_type* chunk_ranks = ranks + chunk.out_offset;
+            for (std::size_t i = chunk.first; i < chunk.last; i++)
+            {
+                size_type rank = parses[chunk.input][i];
+                if ((rank == 0) or (rank > remap.size()))
+                { spdlog::error("Merge: rank {} out of the dictionary of input {}", rank, chunk.input); std::exit(EXIT_FAILURE); }
+                chunk_ranks[i - chunk.first] = remap[rank - 1];
+            }
+        }
+        
+        out_parse.unmap();
+        vcfbwt::DiskWrites::update(parse_size * sizeof(size_type)); // Disk Stats
+        
+        return parse_size;
     }
 };
 
@@ -681,10 +1330,11 @@ public:
         if (not (params.output_occurrences or params.output_last or params.output_sai or params.compress_dictionary))
         { spdlog::info("No properties requested."); return; }
         
-        // read in dictionary
+        Metrics::Phase properties_phase("properties");
+        
+        // map dictionary
         spdlog::info("Loading dictionary from disk.");
-        std::vector<std::vector<data_type>> dictionary;
-        ParserUtils<data_type>::read_dictionary(dict_path, dictionary);
+        DictionaryView<data_type> dictionary(dict_path);
         
         // output compressed dictionary if needed
         if (params.compress_dictionary)
@@ -693,15 +1343,16 @@ public:
             std::ofstream dicz(this->pfp_prefix + EXT::DICT_COMPRESSED);
             std::ofstream lengths(this->pfp_prefix + EXT::DICT_COMPRESSED_LENGTHS);
             
+            std::vector<uint32_t> lengths_buffer(dictionary.size());
             for (std::size_t i = 0; i < dictionary.size(); i++)
             {
                 std::size_t shift = 1; // skip dollar on first phrase
                 if (i != 0) { shift = this->params.w; }
                 dicz.write((char*) &(dictionary[i][shift]),
                            (dictionary[i].size() - shift) * sizeof(data_type));
-                uint32_t len = dictionary[i].size() - shift;
-                lengths.write((char*) &len, sizeof(uint32_t));
+                lengths_buffer[i] = dictionary[i].size() - shift;
             }
+            lengths.write((char*) lengths_buffer.data(), lengths_buffer.size() * sizeof(uint32_t));
             
             vcfbwt::DiskWrites::update(dicz.tellp()); // Disk Stats
             dicz.close();
@@ -710,80 +1361,149 @@ public:
             lengths.close();
         }
         
-        std::string last_file_name = this->pfp_prefix + EXT::LAST;
-        std::ofstream last_file;
-        if (params.output_last) { last_file.open(last_file_name); }
+        // map parse and output .occ, .last and .sai if needed
+        spdlog::info("Read in parse and output properties");
+        ParseView parse(parse_path);
         
-        std::string sai_file_name = this->pfp_prefix + EXT::SAI;
-        std::ofstream sai_file;
-        if (params.output_sai) { sai_file.open(sai_file_name); }
+        std::size_t threads = std::max(this->params.threads, std::size_t(1));
+        std::size_t chunks = (parse.size() + chunk_size - 1) / chunk_size;
         
-        std::vector<long_type> occurrences(dictionary.size(), 0);
-        std::string occ_file_name = this->pfp_prefix + EXT::OCC;
-        std::ofstream occ_file;
-        if (params.output_occurrences) { occ_file.open(occ_file_name); }
+        // Occurrences are counted in one histogram per thread, sai offsets of each chunk start from the sum of the
+        // lengths of the phrases in the previous chunks. A histogram has an 8 bytes counter per phrase of the
+        // dictionary, so each thread must count at least as many parse elements as it has counters: the histograms
+        // never take more than the parse in 8 bytes ranks plus one histogram.
+        std::vector<std::vector<long_type>> histograms;
+        std::vector<std::size_t> chunk_offsets(chunks + 1, 0);
+        std::size_t counting_threads = threads;
+        if (params.output_occurrences)
+        { counting_threads = std::min(threads, std::max<std::size_t>(1, parse.size() / std::max<std::size_t>(1, dictionary.size()))); }
         
-        // read in parse and output .occ, .last and .sai if needed
-        spdlog::info("Read in parse and output properties");
-        std::vector<size_type> parse;
-        ParserUtils<data_type>::read_parse(parse_path, parse);
-    
-        std::size_t pos_for_sai = 0;
-        if (not parse.empty())
+        #pragma omp parallel num_threads(counting_threads)
         {
-            for (std::size_t i = 0; i < parse.size(); i++)
-            {
-                size_type rank = parse[i];
-                occurrences[rank - 1] += 1;
+            // OpenMP can start fewer threads than requested
+            #pragma omp single
+            { if (params.output_occurrences) { histograms.resize(omp_get_num_threads()); } }
             
-                const std::vector<data_type>& dict_string = dictionary[rank - 1];
-                if (params.output_last)
-                {
-                    last_file.put(dict_string[(dict_string.size() - this->params.w) - 1]);
-                }
+            std::vector<long_type>* histogram = nullptr;
+            if (params.output_occurrences)
+            {
+                histogram = &(histograms[omp_get_thread_num()]);
+                histogram->assign(dictionary.size(), 0);
+            }
             
-                if (params.output_sai)
+            #pragma omp for schedule(static)
+            for (std::size_t c = 0; c < chunks; c++)
+            {
+                std::size_t length = 0;
+                for (std::size_t i = c * chunk_size; i < std::min(parse.size(), (c + 1) * chunk_size); i++)
                 {
-                    if (pos_for_sai == 0) { pos_for_sai = dict_string.size() - 1; } // -1 is for the initial $ of the first word
-                    else { pos_for_sai += dict_string.size() - this->params.w; }
-                    sai_file.write((char*) &pos_for_sai, IBYTES);
+                    size_type rank = parse[i];
+                    if (histogram != nullptr) { (*histogram)[rank - 1] += 1; }
+                    length += dictionary[rank - 1].size() - this->params.w;
                 }
+                chunk_offsets[c + 1] = length;
             }
         }
-    
-        if (params.output_last)
+        // positions are shifted by w - 1, the first phrase starts with one dollar instead of the trigger string
+        chunk_offsets[0] = this->params.w - 1;
+        for (std::size_t c = 0; c < chunks; c++) { chunk_offsets[c + 1] += chunk_offsets[c]; }
+        
+        if (params.output_last or params.output_sai) { write_last_and_sai(parse, dictionary, chunk_offsets); }
+        
+        if(params.output_occurrences)
         {
-            vcfbwt::DiskWrites::update(last_file.tellp());
-            last_file.close();
+            spdlog::info("Writing occurrences to file");
+            
+            std::vector<long_type> occurrences(dictionary.size(), 0);
+            #pragma omp parallel for schedule(static) num_threads(threads)
+            for (std::size_t i = 0; i < occurrences.size(); i++)
+            {
+                for (std::size_t t = 0; t < histograms.size(); t++) { occurrences[i] += histograms[t][i]; }
+            }
+            histograms.clear();
+            
+            std::ofstream occ_file(this->pfp_prefix + EXT::OCC);
+            if (parse.size() < std::numeric_limits<short_type>::max())
+            {
+                std::vector<short_type> to_write(occurrences.begin(), occurrences.end());
+                occ_file.write((char*) to_write.data(), to_write.size() * sizeof(short_type));
+            }
+            else
+            {
+                occ_file.write((char*) occurrences.data(), occurrences.size() * sizeof(long_type));
+            }
+            
+            vcfbwt::DiskWrites::update(occ_file.tellp()); // Disk Stats
+            occ_file.close();
         }
+    }
     
-        if (params.output_sai)
-        {
-            vcfbwt::DiskWrites::update(sai_file.tellp());
-            sai_file.close();
-        }
+private:
     
-        if(params.output_occurrences)
-        {
-            spdlog::info("Writing occurrences to file");
+    // Parse elements handled together by a thread, and written in one go
+    static constexpr std::size_t chunk_size = 1 << 20;
+    
+    // Chunks are filled in parallel and written in parse order
+    void write_last_and_sai(const ParseView& parse, const DictionaryView<data_type>& dictionary,
+                            const std::vector<std::size_t>& chunk_offsets)
+    {
+        std::ofstream last_file;
+        if (params.output_last) { last_file.open(this->pfp_prefix + EXT::LAST); }
         
-            for (std::size_t i = 0; i < occurrences.size(); i++)
+        std::ofstream sai_file;
+        if (params.output_sai) { sai_file.open(this->pfp_prefix + EXT::SAI); }
+        
+        std::size_t chunks = chunk_offsets.size() - 1;
+        std::size_t threads = std::max(this->params.threads, std::size_t(1));
+        
+        #pragma omp parallel num_threads(threads)
+        {
+            std::vector<char> last_buffer, sai_buffer;
+            
+            #pragma omp for ordered schedule(dynamic, 1)
+            for (std::size_t c = 0; c < chunks; c++)
             {
-                if (parse.size() < std::numeric_limits<short_type>::max())
+                std::size_t begin = c * chunk_size, end = std::min(parse.size(), (c + 1) * chunk_size);
+                if (params.output_last) { last_buffer.resize(end - begin); }
+                if (params.output_sai) { sai_buffer.resize((end - begin) * IBYTES); }
+                
+                std::size_t pos_for_sai = chunk_offsets[c];
+                for (std::size_t i = begin; i < end; i++)
                 {
-                    short_type to_write = occurrences[i];
-                    occ_file.write((char*)&to_write, sizeof(short_type));
+                    PhraseView<data_type> dict_string = dictionary[parse[i] - 1];
+                    if (params.output_last)
+                    {
+                        // a merged DOLLAR_PRIME phrase is only its trigger string, nothing precedes it
+                        if (dict_string.size() > this->params.w)
+                        { last_buffer[i - begin] = dict_string[(dict_string.size() - this->params.w) - 1]; }
+                        else { last_buffer[i - begin] = ENDOFDICT; }
+                    }
+                    
+                    if (params.output_sai)
+                    {
+                        pos_for_sai += dict_string.size() - this->params.w;
+                        std::memcpy(&(sai_buffer[(i - begin) * IBYTES]), &pos_for_sai, IBYTES);
+                    }
                 }
-                else
+                
+                #pragma omp ordered
                 {
-                    long_type to_write = occurrences[i];
-                    occ_file.write((char*)&to_write, sizeof(long_type));
+                    if (params.output_last) { last_file.write(last_buffer.data(), last_buffer.size()); }
+                    if (params.output_sai) { sai_file.write(sai_buffer.data(), sai_buffer.size()); }
                 }
             }
+        }
         
+        if (params.output_last)
+        {
+            vcfbwt::DiskWrites::update(last_file.tellp());
+            last_file.close();
+        }
         
-            vcfbwt::DiskWrites::update(occ_file.tellp()); // Disk Stats
-            occ_file.close();
+        if (params.output_sai)
+        {
+            vcfbwt::DiskWrites::update(sai_file.tellp());
+            sai_file.close();
         }
     }
 };
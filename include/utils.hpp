@@ -23,6 +23,7 @@
 #include <forward_list>
 #include <unordered_map>
 #include <cstring>
+#include <atomic>
 
 #include <unistd.h>
 #include <cmath>
@@ -88,6 +89,8 @@ const std::string N_LAST = ".aup.last";
 const std::string N_SAI = ".aup.sai";
 const std::string N_DICT_COMPRESSED = ".aup.dicz";
 const std::string N_DICT_COMPRESSED_LENGTHS = ".aup.dicz.len";
+const std::string REFERENCE_CACHE = ".refparse";
+const std::string METRICS = ".metrics.json";
 
 }
 
@@ -285,6 +288,16 @@ public:
     static hash_type string_hash(const char_type* data, std::size_t length);
 };
 
+// Appends to triggers every position i in [first, length), first >= w - 1, such that the Mersenne_KarpRabinHash of
+// the window text[i - w + 1, i] is 0 modulo p. Long texts are split in lanes hashed in the same loop, lanes have
+// no data dependency on each other.
+void find_trigger_strings(const char_type* text, std::size_t length, std::size_t first,
+                          std::size_t w, std::size_t p, std::vector<std::size_t>& triggers);
+
+// Same as above with Mersenne_KarpRabinHash4 over windows of w integers
+void find_trigger_strings(const uint32_t* text, std::size_t length, std::size_t first,
+                          std::size_t w, std::size_t p, std::vector<std::size_t>& triggers);
+
 //------------------------------------------------------------------------------
 
 /*
@@ -313,6 +326,10 @@ void truncate_file(std::string file_name, std::size_t new_size_in_bytes);
 
 bool is_gzipped(std::ifstream& in);
 
+// Maps file_name read only, an empty file is left unmapped. With sequential the kernel is advised that the mapping
+// will be read in order.
+void map_file(const std::string& file_name, mio::mmap_source& mapped, bool sequential = false);
+
 //------------------------------------------------------------------------------
 
 // Disk space statistics
@@ -321,6 +338,57 @@ namespace DiskWrites
     void update(std::size_t num_of_bytes);
 };
 
+namespace DiskReads
+{
+    void update(std::size_t num_of_bytes);
+    void update(const std::string& file_name); // the whole file
+};
+
+//------------------------------------------------------------------------------
+
+/*
+  Performance metrics of a run, written as JSON by Metrics::write(). A Phase
+  times a stage of the run from its construction to stop() or its destruction:
+  wall and cpu time, bytes read and written and the peak RSS at its end. Phases
+  with the same name add up, they are listed in the order they first started.
+  Metrics is thread-safe.
+*/
+
+namespace Metrics
+{
+    class Phase
+    {
+    public:
+        explicit Phase(const std::string& name);
+        ~Phase() { stop(); }
+        
+        void stop();
+        
+    private:
+        std::string name;
+        double wall_start = 0.0;
+        double cpu_start = 0.0;
+        std::size_t read_start = 0;
+        std::size_t written_start = 0;
+        bool running = false;
+    };
+    
+    struct Worker
+    {
+        std::string name;
+        std::size_t bases = 0;
+        std::size_t phrases = 0;
+        double seconds = 0.0;
+    };
+    
+    void add_worker(const Worker& worker);
+    void add_lock_wait(double seconds);
+    
+    double wall_time(); // seconds from an arbitrary point, for intervals
+    
+    void write(const std::string& file_name, const std::string& tool, std::size_t threads);
+}
+
 //------------------------------------------------------------------------------
 
 template <typename data_type>
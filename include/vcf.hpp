@@ -11,6 +11,7 @@
 #include <vector>
 #include <unordered_map>
 #include <functional>
+#include <limits>
 
 #include <spdlog/spdlog.h>
 
@@ -34,12 +35,12 @@ namespace vcfbwt
 
 //------------------------------------------------------------------------------
 
+// A single record while it is read from the vcf, stored afterwards in Variations
 struct Variation
 {
     std::size_t pos = 0; // already adjusted when read from the vcf by htslib. No need of -1
     std::size_t ref_len = 0;
     std::vector<std::string> alt;
-    std::vector<int> types;
     
     double freq = 0.0;
     bool used = false;
@@ -47,16 +48,109 @@ struct Variation
     enum variation_type { H1, H2, H12 };
 };
 
+// Read only view of an allele stored in Variations
+struct AlleleView
+{
+    const char* allele;
+    std::size_t length;
+    
+    const char* data() const { return allele; }
+    std::size_t size() const { return length; }
+    const char& operator[](std::size_t i) const { return allele[i]; }
+    const char& back() const { return allele[length - 1]; }
+};
+
+class Variations;
+
+// Read only view of a variation stored in Variations
+class VariationView
+{
+private:
+    
+    const Variations& variations_;
+    std::size_t index_;
+    
+public:
+    
+    std::size_t pos;
+    std::size_t ref_len;
+    
+    VariationView(const Variations& variations, std::size_t index);
+    
+    std::size_t n_alleles() const;
+    AlleleView alt(std::size_t allele) const;
+};
+
+// Columnar store of the variations. The alleles of all the variations are concatenated in one arena, biallelic and
+// multiallelic SNPs keep one byte per allele and nothing else, other records also keep the end of each allele
+class Variations
+{
+private:
+    
+    static constexpr uint64_t single_bases = std::numeric_limits<uint64_t>::max();
+    
+    std::vector<uint64_t> pos_;
+    std::vector<uint32_t> ref_len_;
+    std::vector<uint16_t> n_alleles_;
+    std::vector<uint64_t> arena_offset_;
+    std::vector<uint64_t> ends_offset_; // in allele_ends_, single_bases when every allele is one character
+    std::vector<uint32_t> allele_ends_; // relative to the arena offset of the variation
+    std::vector<double> freq_;
+    std::vector<char> arena_;
+    
+public:
+    
+    void push_back(const Variation& variation);
+    
+    // Moves the variations of other at the end of this one, other is left empty
+    void append(Variations&& other);
+    
+    std::size_t size() const { return pos_.size(); }
+    bool empty() const { return pos_.empty(); }
+    void clear();
+    void shrink_to_fit();
+    std::size_t memory_usage() const;
+    
+    std::size_t pos(std::size_t i) const { return pos_[i]; }
+    std::size_t ref_len(std::size_t i) const { return ref_len_[i]; }
+    std::size_t n_alleles(std::size_t i) const { return n_alleles_[i]; }
+    double freq(std::size_t i) const { return freq_[i]; }
+    void normalize_freq(double n) { for (auto& f : freq_) { f = f / n; } }
+    
+    AlleleView alt(std::size_t i, std::size_t allele) const
+    {
+        const char* base = arena_.data() + arena_offset_[i];
+        if (ends_offset_[i] == single_bases) { return { base + allele, 1 }; }
+        const uint32_t* ends = allele_ends_.data() + ends_offset_[i];
+        uint32_t begin = (allele == 0) ? 0 : ends[allele - 1];
+        return { base + begin, ends[allele] - begin };
+    }
+    
+    VariationView operator[](std::size_t i) const { return VariationView(*this, i); }
+};
+
+inline VariationView::VariationView(const Variations& variations, std::size_t index)
+: variations_(variations), index_(index), pos(variations.pos(index)), ref_len(variations.ref_len(index)) {}
+
+inline std::size_t VariationView::n_alleles() const { return variations_.n_alleles(index_); }
+inline AlleleView VariationView::alt(std::size_t allele) const { return variations_.alt(index_, allele); }
+
 class Sample
 {
 private:
     
     const std::string& reference_;
-    const std::vector<Variation>& variations_list;
+    const Variations& variations_list;
     
     std::string sample_id;
     bool is_last_sample = false;
     int last_variation_type = 0;
+    
+    // Sorted indices in variations_list of the variations carried by the sample, and for each of them the allele
+    // index of every haplotype, ploidy codes per variation. The per variation std::vector<int> used before cost
+    // more than 50 bytes per entry, which does not fit the 1000 Genomes autosomes in memory
+    std::vector<uint32_t> variations_;
+    std::vector<uint8_t> alleles_;
 
     friend class iterator;
     
@@ -64,16 +158,29 @@ public:
     void set_last(const int type){  this->is_last_sample = true; this->last_variation_type = type; }
     bool last(const int type) const { return this->is_last_sample and ( type == this->last_variation_type ); }
 
-    // variation, variation type
-    std::vector<std::size_t> variations;
-    std::vector<std::vector<int>> genotypes;
+    static constexpr std::size_t ploidy = 2;
+    static constexpr std::size_t max_allele = std::numeric_limits<uint8_t>::max();
 
     const std::string& id() const { return this->sample_id; }
     
-    Sample(const std::string& id, const std::string& ref, const std::vector<Variation>& variations)
+    Sample(const std::string& id, const std::string& ref, const Variations& variations)
     : sample_id(id), reference_(ref), variations_list(variations) {}
     
-    const Variation& get_variation(std::size_t i) const { return this->variations_list[variations[i]]; }
+    // Variations must be added in increasing order of index, alleles holds the allele index of each haplotype,
+    // haplotypes past the end of it are set to the reference
+    void add_variation(std::size_t variation, const std::vector<int>& alleles);
+    // Appends the variations of other, with their index shifted by variation_offset
+    void append(const Sample& other, std::size_t variation_offset);
+    void reserve(std::size_t n) { variations_.reserve(n); alleles_.reserve(n * ploidy); }
+    void shrink_to_fit() { variations_.shrink_to_fit(); alleles_.shrink_to_fit(); }
+    
+    std::size_t size() const { return this->variations_.size(); }
+    bool empty() const { return this->variations_.empty(); }
+    std::size_t variation(std::size_t i) const { return this->variations_[i]; }
+    int genotype(std::size_t i, std::size_t haplotype) const { return this->alleles_[i * ploidy + haplotype]; }
+    std::size_t memory_usage() const { return variations_.capacity() * sizeof(uint32_t) + alleles_.capacity() * sizeof(uint8_t); }
+    
+    VariationView get_variation(std::size_t i) const { return this->variations_list[variations_[i]]; }
     
     const std::string& get_reference() const { return this->reference_; }
     
@@ -91,6 +198,9 @@ public:
         std::size_t sample_length_;
         const char* curr_char_;
         
+        bool in_reference() const;
+        std::size_t reference_stretch() const;
+        
     public:
         
         iterator(const Sample& sample, std::size_t genotype = 0);
@@ -100,6 +210,14 @@ public:
         void go_to(std::size_t i);
         const char operator*();
         
+        // Contiguous run of the haplotype starting at the current character: a slice of the reference up to
+        // the next variation, or what is left of an alt allele
+        struct Run { const char* data; std::size_t size; };
+        Run current_run() const;
+        
+        // Same as calling operator++ n times
+        void advance(std::size_t n);
+        
         bool in_a_variation();
         
         std::size_t get_var_it() const { return var_it_; }
@@ -122,7 +240,7 @@ private:
     
     std::string reference;
     
-    std::vector<Variation> variations;
+    Variations variations;
     std::vector<Sample> samples;
     std::unordered_map<std::string, std::size_t> samples_id;
     
@@ -131,10 +249,74 @@ private:
     std::vector<std::size_t> populated_samples;
 
     std::vector<std::size_t> ref_sum_lengths;
+    
+    std::size_t threads = 1;
+    bool use_index = false;
+    
+    // Streaming, the samples of the vcfs in the order they are loaded, see next_batch
+    std::vector<std::string> vcfs_path;
+    std::vector<std::string> stream_samples;
+    std::size_t next_stream_sample = 0;
+    
+    // Streaming, for every record of a vcf the index of its variation, no_variation when no streamed sample carries
+    // it, and the header index of the last sample whose calls are applied, as add_record stops on symbolic alleles
+    static constexpr uint32_t no_variation = std::numeric_limits<uint32_t>::max();
+    struct StreamRecords
+    {
+        std::size_t first_variation = 0; // in variations, record variations are relative to it
+        std::vector<uint32_t> variation;
+        std::vector<uint32_t> last_sample;
+    };
+    std::vector<StreamRecords> stream_records;
+    
+    // A vcf record with its non reference calls, before overlapping variations are filtered out
+    struct Record
+    {
+        struct Call { uint32_t sample; uint16_t haplotype; uint16_t allele; };
+        
+        Variation variation;
+        hts_pos_t pos = 0;
+        hts_pos_t rlen = 0;
+        int max_ploidy = 0;
+        std::vector<int> trim_beg; // per allele
+        std::vector<int> var_len;  // per allele
+        std::vector<Call> calls;   // grouped by sample, in header order
+    };
+    
+    // End of the last variation applied to each haplotype of each sample, records must be added in vcf order
+    struct OverlapState
+    {
+        std::vector<std::vector<int>>  tppos;
+        std::vector<std::vector<bool>> prev_is_ins;
+        std::vector<int> alleles_idx;
+        
+        void fit(int ploidy, std::size_t n_samples)
+        {
+            while (std::size_t(ploidy) > tppos.size())
+            {
+                tppos.push_back(std::vector<int>(n_samples, 0));
+                prev_is_ins.push_back(std::vector<bool>(n_samples, false));
+            }
+            alleles_idx.assign(ploidy, 0);
+        }
+    };
 
     void init_samples(const std::string& samples_path);
     
-    void init_vcf(const std::string& vcf_path, std::vector<Variation>& l_variations,
+    static void decode_record(const bcf_hdr_t* hdr, bcf1_t* rec, std::size_t offset, int32_t** gt_arr, int* ngt_arr, Record& record);
+    static std::size_t apply_calls(const Record& record, std::size_t c, OverlapState& state, bool& alt_alleles_set, bool& skip);
+    void check_reference(const Record& record, const std::string& vcf_path) const;
+    void add_record(Record& record, OverlapState& state, const std::vector<long long int>& targets,
+                    Variations& l_variations, std::vector<Sample>& l_samples, const std::string& vcf_path);
+    bool init_vcf_regions(const std::string& vcf_path, std::size_t offset, std::size_t length, const std::string& subset,
+                          const std::vector<long long int>& targets, OverlapState& state,
+                          Variations& l_variations, std::vector<Sample>& l_samples);
+    void init_stream_samples();
+    void init_stream_records(std::size_t i, Variations& l_variations);
+    void init_multi_stream_records();
+    void load_stream_vcf(std::size_t i, const std::set<std::string>& batch, std::vector<Sample>& l_samples);
+    
+    void init_vcf(const std::string& vcf_path, Variations& l_variations,
                   std::vector<Sample>& l_samples, std::unordered_map<std::string, std::size_t>& l_samples_id,
                   std::size_t i = 0);
     void init_vcf(const std::string& vcf_path, std::size_t i = 0);
@@ -148,33 +330,63 @@ public:
     
     static const std::string vcf_freq;
 
-    VCF(const std::string &ref_path, const std::string &vcf_path, const std::string &samples_path, std::size_t ms = 0, const int last_genotype = 0) : max_samples(ms)
+    // With use_index and more than one thread, indexed vcfs over a single contig are decoded by regions in parallel
+    VCF(const std::string &ref_path, const std::string &vcf_path, const std::string &samples_path, std::size_t ms = 0, const int last_genotype = 0,
+        std::size_t threads = 1, bool use_index = false) : max_samples(ms), threads(threads), use_index(use_index)
     {
         if (samples_path != "") { init_samples(samples_path); }
         init_ref(ref_path); init_vcf(vcf_path);
         for (std::size_t i = 0; i < samples.size(); i++)
-        { if (not samples.at(i).variations.empty()) { this->populated_samples.push_back(i); } }
+        { if (not samples.at(i).empty()) { this->populated_samples.push_back(i); } }
 
         this->samples.at(populated_samples.back()).set_last(last_genotype);
     }
 
-    VCF(const std::vector<std::string> &refs_path, const std::vector<std::string> &vcfs_path, const std::string &samples_path, std::size_t ms = 0, const int last_genotype = 0) : max_samples(ms)
+    VCF(const std::vector<std::string> &refs_path, const std::vector<std::string> &vcfs_path, const std::string &samples_path, std::size_t ms = 0, const int last_genotype = 0,
+        std::size_t threads = 1, bool use_index = false) : max_samples(ms), threads(threads), use_index(use_index)
     {
         if (vcfs_path.size() != refs_path.size()) { spdlog::error("Number of reference files and vcf files differs."); std::exit(EXIT_FAILURE); }
         if (samples_path != "") { init_samples(samples_path); }
         init_multi_ref(refs_path);
         init_multi_vcf(vcfs_path);
         for (std::size_t i = 0; i < samples.size(); i++)
-        { if (not samples.at(i).variations.empty()) { this->populated_samples.push_back(i); } }
+        { if (not samples.at(i).empty()) { this->populated_samples.push_back(i); } }
 
         this->samples.at(populated_samples.back()).set_last(last_genotype);
     }
     
+    // Tag of the streaming constructor
+    struct Streaming {};
+    
+    // Reads the references and, in one pass over the vcfs, the variations. Samples are then loaded a batch at a time
+    // by next_batch, the vcfs are not read by regions. No sample is marked as the last one, see ParserVCF::end_of_text
+    VCF(const std::vector<std::string> &refs_path, const std::vector<std::string> &vcfs_path, const std::string &samples_path, Streaming,
+        std::size_t ms = 0, std::size_t threads = 1) : max_samples(ms), threads(threads), vcfs_path(vcfs_path)
+    {
+        if (vcfs_path.size() != refs_path.size()) { spdlog::error("Number of reference files and vcf files differs."); std::exit(EXIT_FAILURE); }
+        if (vcfs_path.empty()) { spdlog::error("No vcf file provided"); std::exit(EXIT_FAILURE); }
+        if (samples_path != "") { init_samples(samples_path); }
+        init_multi_ref(refs_path);
+        init_stream_samples();
+        init_multi_stream_records();
+    }
+    
     ~VCF() = default;
     
+    // Replaces the loaded samples with the next n samples of the vcfs, false once all of them have been loaded.
+    // Only the genotypes of the samples of the batch are decoded, the variations are kept
+    bool next_batch(std::size_t n);
+    std::size_t remaining_samples() const { return this->stream_samples.size() - this->next_stream_sample; }
+    
+    // Bytes of the reference and of the variations, that do not depend on the loaded samples
+    std::size_t fixed_memory_usage() const;
+    // Bytes of the loaded samples
+    std::size_t samples_memory_usage() const;
+    std::size_t memory_usage() const { return fixed_memory_usage() + samples_memory_usage(); }
+    
     std::size_t size() const { return this->populated_samples.size(); }
     Sample& operator[](std::size_t i) { assert(i < size()); return samples.at(populated_samples.at(i)); }
-    const std::vector<Variation>& get_variations() const { return this->variations; }
+    const Variations& get_variations() const { return this->variations; }
     const std::string& get_reference() const { return this->reference; }
     void set_max_samples(std::size_t max) { this->max_samples = max; }
 };
@@ -13,6 +13,7 @@ int main(int argc, char **argv)
 {
     CLI::App app("Merge PFPs");
     
+    std::vector<std::string> prefixes;
     std::string left_file;
     std::string right_file;
     std::string out_prefix;
@@ -20,8 +21,9 @@ int main(int argc, char **argv)
     
     vcfbwt::pfp::Params params;
     
-    app.add_option("-l,--left-prefix", left_file, "Left Prefix")->configurable()->required();
-    app.add_option("-r,--right-prefix", right_file, "Right Prefix")->configurable()->required();
+    CLI::Option* prefixes_option = app.add_option("-i,--prefixes", prefixes, "Prefixes of the PFPs to merge, in order")->configurable();
+    app.add_option("-l,--left-prefix", left_file, "Left Prefix")->configurable()->excludes(prefixes_option);
+    app.add_option("-r,--right-prefix", right_file, "Right Prefix")->configurable()->excludes(prefixes_option);
     app.add_option("-o,--out-prefix", out_prefix, "Output prefix")->configurable()->required();
     app.add_option("-w, --window-size", params.w, "Sliding window size")->check(CLI::Range(0, 100))->configurable();
     app.add_option("-p, --module", params.p, "Module used during parisng")->check(CLI::Range(0, 1000))->configurable();
@@ -29,6 +31,8 @@ int main(int argc, char **argv)
     app.add_flag("--output-sai", params.output_sai, "Output sai array.")->configurable();
     app.add_flag("--output-last", params.output_last, "Output last array.")->configurable();
     app.add_flag("--output-compressed-dict", params.compress_dictionary, "Output compressed dictionary.")->configurable();
+    app.add_flag("--compact-parse", params.compact_parse, "Output the parse bit-packed, with the bits needed by the largest rank.")->configurable();
+    app.add_option("-j, --threads", params.threads, "Number of threads.")->configurable();
     app.add_flag("--integers", integers_pfp, "Integer (uint32_t) PFP");
     app.add_flag_callback("--version",vcfbwt::Version::print,"Version");
     app.set_config("--configure");
@@ -39,21 +43,30 @@ int main(int argc, char **argv)
     // Print out configurations
     spdlog::info("Current Configuration:\n{}", app.config_to_str(true,true));
     
+    if (prefixes.empty()) { prefixes = { left_file, right_file }; }
+    for (auto& prefix : prefixes)
+    {
+        if (prefix.empty()) { spdlog::error("Either --prefixes or both --left-prefix and --right-prefix are required"); std::exit(EXIT_FAILURE); }
+    }
+    if (prefixes.size() < 2) { spdlog::error("At least two PFPs are needed to merge"); std::exit(EXIT_FAILURE); }
+    
     // Merge parsings
     if (not integers_pfp)
     {
-        vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::merge(left_file, right_file, out_prefix, params);
+        vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::merge(prefixes, out_prefix, params);
     
         vcfbwt::pfp::PropertiesWriter<vcfbwt::char_type> properties_out(out_prefix, params);
         properties_out.write();
     }
     else
     {
-        vcfbwt::pfp::ParserUtils<uint32_t>::merge(left_file, right_file, out_prefix, params);
+        vcfbwt::pfp::ParserUtils<uint32_t>::merge(prefixes, out_prefix, params);
     
         vcfbwt::pfp::PropertiesWriter<uint32_t> properties_out(out_prefix, params);
         properties_out.write();
     }
     
+    vcfbwt::Metrics::write(out_prefix + vcfbwt::EXT::METRICS, "mpfp++", params.threads);
+    
     return 0;
 }
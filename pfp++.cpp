@@ -4,6 +4,8 @@
 // Copyright (c) Boucher Lab. All rights reserved.
 // Licensed under the GNU license. See LICENSE file in the repository root for full license information.
 
+#include <memory>
+
 #include <CLI/CLI.hpp>
 #include <version.hpp>
 #include <utils.hpp>
@@ -28,6 +30,10 @@ int main(int argc, char **argv)
     bool only_trigger_strings = false;
     bool verbose = false;
     std::string haplotype_string = "1";
+    bool use_vcf_index = false;
+    std::size_t vcf_memory_budget = 0;
+    std::string append_prefix;
+    std::size_t parse_memory_budget = 0;
     
     vcfbwt::pfp::Params params;
     
@@ -45,12 +51,18 @@ int main(int argc, char **argv)
     app.add_option("-p, --modulo", params.p, "Modulo used during parsing.")->check(CLI::Range(5, 20000))->configurable();
     app.add_option("-j, --threads", threads, "Number of threads.")->configurable();
     app.add_option("--tmp-dir", tmp_dir, "Temporary files directory.")->check(CLI::ExistingDirectory)->configurable();
+    app.add_option("--ref-cache", params.reference_cache_dir, "Directory caching the reference parse between runs.")->check(CLI::ExistingDirectory)->configurable();
     app.add_flag("-c, --compress-dictionary", params.compress_dictionary, "Also output compressed the dictionary.")->configurable();
     app.add_flag("--use-vcf-acceleration", params.use_acceleration, "Use reference parse to avoid re-parsing.")->configurable();
     app.add_flag("--print-statistics", params.print_out_statistics_csv, "Print out csv containing stats.")->configurable();
     app.add_flag("--output-occurrences", params.output_occurrences, "Output count for each dictionary phrase.")->configurable();
     app.add_flag("--output-sai", params.output_sai, "Output sai array.")->configurable();
     app.add_flag("--output-last", params.output_last, "Output last array.")->configurable();
+    app.add_flag("--compact-parse", params.compact_parse, "Output the parse bit-packed, with the bits needed by the largest rank.")->configurable();
+    app.add_option("--parse-memory", parse_memory_budget, "Keep the parse in memory, without temporary files, while it fits in this many MB.")->configurable();
+    app.add_option("--vcf-memory", vcf_memory_budget, "Stream the vcf samples in batches, keeping them with the variations and the dictionary within this many MB.")->configurable();
+    app.add_option("--append", append_prefix, "Append the vcf samples to the vcf PFP with this prefix, built with the same reference and parameters.")->configurable();
+    app.add_flag("--vcf-index", use_vcf_index, "Read each indexed vcf by regions in parallel, using its tabix/CSI index. Not used with --vcf-memory.")->configurable();
     app.add_flag("--acgt-only", params.acgt_only, "Convert all non ACGT characters from a VCF or FASTA file to N.")->configurable();
     app.add_flag("--verbose", verbose, "Verbose output.")->configurable();
     app.add_flag_callback("--version",vcfbwt::Version::print,"Version number.");
@@ -70,6 +82,9 @@ int main(int argc, char **argv)
     // Print out configurations
     spdlog::info("Current Configuration:\n{}", app.config_to_str(true,true));
 
+    params.threads = threads;
+    params.parse_memory_budget = parse_memory_budget * vcfbwt::MEGABYTE;
+
     // Set tmp file dir
     if (not tmp_dir.empty()) { vcfbwt::TempFile::setDirectory(tmp_dir); }
     
@@ -79,7 +94,9 @@ int main(int argc, char **argv)
         vcfbwt::pfp::ParserFasta main_parser(params, fasta_file_path, out_prefix);
     
         // Run
+        vcfbwt::Metrics::Phase parse_phase("parse");
         main_parser();
+        parse_phase.stop();
     
         // Close the main parser
         main_parser.close();
@@ -90,7 +107,9 @@ int main(int argc, char **argv)
         vcfbwt::pfp::ParserText main_parser(params, text_file_path, out_prefix);
     
         // Run
+        vcfbwt::Metrics::Phase parse_phase("parse");
         main_parser();
+        parse_phase.stop();
     
         // Close the main parser
         main_parser.close();
@@ -106,7 +125,9 @@ int main(int argc, char **argv)
         vcfbwt::pfp::ParserIntegers main_parser(params, integers_file_path, out_prefix);
 
         // Run
+        vcfbwt::Metrics::Phase parse_phase("parse");
         main_parser();
+        parse_phase.stop();
 
         // Close the main parser
         main_parser.close();
@@ -116,16 +137,44 @@ int main(int argc, char **argv)
         int last_genotype = 0;
         if (haplotype_string == "2" or haplotype_string == "12")
             last_genotype = 1;
+        
+        // Without a prefix the vcf parser writes to "out", appending writes over the appended PFP
+        if (out_prefix.empty()) { out_prefix = append_prefix.empty() ? "out" : append_prefix; }
     
         // Set threads accordingly to configuration
         omp_set_num_threads(threads);
 
-        // Parse the VCF
-        vcfbwt::VCF vcf(refs_file_names, vcfs_file_names, samples_file_name, max_samples, last_genotype);
+        // Parse the VCF, all at once or streaming the samples in batches within the memory budget
+        bool streaming = vcf_memory_budget > 0;
+        std::unique_ptr<vcfbwt::VCF> vcf_ptr;
+        vcfbwt::Metrics::Phase load_phase("load vcf");
+        if (streaming)
+        {
+            if (use_vcf_index) { spdlog::warn("--vcf-index is ignored with --vcf-memory, streamed vcfs are not read by regions"); }
+            vcf_ptr.reset(new vcfbwt::VCF(refs_file_names, vcfs_file_names, samples_file_name, vcfbwt::VCF::Streaming(),
+                                          max_samples, threads));
+        }
+        else
+        {
+            vcf_ptr.reset(new vcfbwt::VCF(refs_file_names, vcfs_file_names, samples_file_name, max_samples, last_genotype,
+                                          threads, use_vcf_index));
+        }
+        vcfbwt::VCF& vcf = *vcf_ptr;
+        load_phase.stop();
     
         vcfbwt::pfp::ReferenceParse reference_parse(vcf.get_reference(), params);
     
-        vcfbwt::pfp::ParserVCF main_parser(params, out_prefix, reference_parse);
+        // When appending the new samples are parsed on their own and their properties are computed after the append
+        vcfbwt::pfp::Params parser_params = params;
+        std::string parser_prefix = out_prefix;
+        if (not append_prefix.empty())
+        {
+            parser_prefix = vcfbwt::TempFile::getName("append");
+            parser_params.compress_dictionary = false; parser_params.print_out_statistics_csv = false;
+            parser_params.output_occurrences = false; parser_params.output_last = false; parser_params.output_sai = false;
+            parser_params.compact_parse = false;
+        }
+        vcfbwt::pfp::ParserVCF main_parser(parser_params, parser_prefix, reference_parse);
     
         std::vector<vcfbwt::pfp::ParserVCF> workers(threads);
         for (std::size_t i = 0; i < workers.size(); i++)
@@ -135,40 +184,81 @@ int main(int argc, char **argv)
             main_parser.register_worker(workers[i]);
         }
 
-        if ( haplotype_string == "1" or haplotype_string == "2")
+        // Every haplotype is a work unit, the unit orders the haplotypes in the final parse. Units are
+        // scheduled dynamically, samples with more variations first. Batches continue the units of the previous ones.
+        std::size_t units_per_sample = (haplotype_string == "12") ? 2 : 1;
+        std::size_t first_unit = 0;
+        auto parse_loaded_samples = [&]()
         {
-            if (haplotype_string == "1") { for (std::size_t i = 0; i < workers.size(); i++) { workers[i].set_working_genotype(0); } }
-            else { for (std::size_t i = 0; i < workers.size(); i++) { workers[i].set_working_genotype(1); } }
-            
-            #pragma omp parallel for schedule(static)
+            vcfbwt::Metrics::Phase parse_phase("parse");
+            struct WorkUnit { std::size_t sample; std::size_t genotype; std::size_t unit; };
+            std::vector<WorkUnit> work_units;
             for (std::size_t i = 0; i < vcf.size(); i++)
+            {
+                std::size_t unit = first_unit + units_per_sample * i;
+                if (haplotype_string == "1") { work_units.push_back({ i, 0, unit }); }
+                else if (haplotype_string == "2") { work_units.push_back({ i, 1, unit }); }
+                else if (haplotype_string == "12") { work_units.push_back({ i, 0, unit }); work_units.push_back({ i, 1, unit + 1 }); }
+            }
+            std::stable_sort(work_units.begin(), work_units.end(), [&vcf](const WorkUnit& a, const WorkUnit& b)
+            { return vcf[a.sample].size() > vcf[b.sample].size(); });
+            
+            #pragma omp parallel for schedule(dynamic, 1)
+            for (std::size_t u = 0; u < work_units.size(); u++)
             {
                 int this_thread = omp_get_thread_num();
-                spdlog::info("Processing sample [{}/{} H{}]: {}", i, vcf.size(), haplotype_string, vcf[i].id());
-                workers[this_thread](vcf[i]);
+                const WorkUnit& work_unit = work_units[u];
+                
+                workers[this_thread].set_working_genotype(work_unit.genotype);
+                spdlog::info("Processing sample [{}/{} H{}]: {}", work_unit.sample, vcf.size(), work_unit.genotype + 1, vcf[work_unit.sample].id());
+                workers[this_thread](vcf[work_unit.sample], work_unit.unit);
             }
-        }
-        else if ( haplotype_string == "12" )
+            first_unit += units_per_sample * vcf.size();
+        };
+        
+        if (not streaming) { parse_loaded_samples(); }
+        else
         {
-            #pragma omp parallel for schedule(static)
-            for (std::size_t i = 0; i < vcf.size(); i++)
+            // The first batch measures the memory of a sample, the next ones are sized to fill what the variations,
+            // the reference and its parse, and the dictionary leave of the budget
+            std::size_t budget = vcf_memory_budget * vcfbwt::MEGABYTE;
+            std::size_t batch_size = threads;
+            while (true)
             {
-                int this_thread = omp_get_thread_num();
-
-                // get first genotype
-                workers[this_thread].set_working_genotype(0);
-                spdlog::info("Processing sample [{}/{} H{}]: {}", i, vcf.size(), 1, vcf[i].id());
-                workers[this_thread](vcf[i]);
-
-                // get second genotype
-                workers[this_thread].set_working_genotype(1);
-                spdlog::info("Processing sample [{}/{} H{}]: {}", i, vcf.size(), 2, vcf[i].id());
-                workers[this_thread](vcf[i]);
+                vcfbwt::Metrics::Phase batch_phase("load vcf");
+                if (not vcf.next_batch(batch_size)) { break; }
+                batch_phase.stop();
+                
+                parse_loaded_samples();
+                if (vcf.size() > 0)
+                {
+                    std::size_t fixed_bytes = vcf.fixed_memory_usage() + reference_parse.memory_usage();
+                    std::size_t sample_bytes = std::max<std::size_t>(1, vcf.samples_memory_usage() / vcf.size());
+                    if (fixed_bytes >= budget and batch_size > 1 and vcf.remaining_samples() > 0)
+                    { spdlog::warn("{} GB of fixed memory exceed the vcf memory budget, loading one sample at a time", vcfbwt::inGigabytes(fixed_bytes)); }
+                    batch_size = (fixed_bytes < budget) ? std::max<std::size_t>(1, (budget - fixed_bytes) / sample_bytes) : 1;
+                }
             }
+            
+            // The last sample was not known while parsing
+            main_parser.end_of_text(first_unit);
         }
         
-    
         // close the main parser and exit
         main_parser.close();
+        
+        if (not append_prefix.empty())
+        {
+            vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::append(append_prefix, parser_prefix, reference_parse.parse.size(),
+                                                                out_prefix, params);
+            std::remove((parser_prefix + vcfbwt::EXT::PARSE).c_str());
+            std::remove((parser_prefix + vcfbwt::EXT::DICT).c_str());
+            
+            vcfbwt::pfp::PropertiesWriter<vcfbwt::char_type> properties_out(out_prefix, params);
+            properties_out.write();
+        }
     }
+    
+    // Next to the outputs, with the prefix they were written with
+    vcfbwt::Metrics::write(out_prefix + vcfbwt::EXT::METRICS, "pfp++", threads);
 }
@@ -10,35 +10,189 @@
 
 void
 vcfbwt::pfp::ReferenceParse::init(const std::string& reference)
+{
+    Metrics::Phase phase("reference parse");
+    
+    if (params.reference_cache_dir.empty()) { parse_reference(reference); return; }
+    
+    CacheHeader header = cache_header(reference);
+    std::string file_name = cache_file_name(header);
+    if (load_cache(file_name, header)) { return; }
+    
+    parse_reference(reference);
+    save_cache(file_name, header);
+}
+
+//------------------------------------------------------------------------------
+
+vcfbwt::pfp::ReferenceParse::CacheHeader
+vcfbwt::pfp::ReferenceParse::cache_header(const std::string& reference) const
+{
+    CacheHeader header;
+    std::memset(&header, 0, sizeof(CacheHeader));
+    std::memcpy(header.magic, "PFPREF\0\0", sizeof(header.magic));
+    header.version = 1;
+    
+    // Checksum of the checksums of the reference blocks, MurmurHash3 takes int lengths
+    std::size_t blocks = (reference.size() + GIGABYTE - 1) / GIGABYTE;
+    std::vector<uint64_t> block_checksums(2 * blocks);
+    #pragma omp parallel for schedule(static) num_threads(this->params.threads)
+    for (std::size_t b = 0; b < blocks; b++)
+    {
+        std::size_t length = std::min(GIGABYTE, reference.size() - b * GIGABYTE);
+        MurmurHash3_x64_128(reference.data() + b * GIGABYTE, length, 0, &block_checksums[2 * b]);
+    }
+    MurmurHash3_x64_128(block_checksums.data(), block_checksums.size() * sizeof(uint64_t), 0, header.checksum);
+    
+    header.reference_length = reference.size();
+    header.w = params.w; header.p = params.p; header.acgt_only = params.acgt_only;
+    header.hash_seed = short_prime;
+    header.hash_bytes = sizeof(hash_type);
+    header.slot_bytes = sizeof(Dictionary<vcfbwt::char_type>::Slot);
+    header.shards = Dictionary<vcfbwt::char_type>::num_of_shards;
+    return header;
+}
+
+std::string
+vcfbwt::pfp::ReferenceParse::cache_file_name(const CacheHeader& header) const
+{
+    char checksum[33];
+    std::snprintf(checksum, sizeof(checksum), "%016llx%016llx",
+                  (unsigned long long) header.checksum[0], (unsigned long long) header.checksum[1]);
+    return params.reference_cache_dir + "/reference_" + checksum + "_w" + std::to_string(header.w) + "_p" + std::to_string(header.p)
+           + (header.acgt_only ? "_acgt" : "") + EXT::REFERENCE_CACHE;
+}
+
+bool
+vcfbwt::pfp::ReferenceParse::load_cache(const std::string& file_name, const CacheHeader& header)
+{
+    if (not std::ifstream(file_name).good()) { return false; }
+    
+    mio::mmap_source mapped;
+    map_file(file_name, mapped, true);
+    const char* data = mapped.data();
+    const char* end = data + mapped.size();
+    
+    // Bounds checked copy out of the mapped file
+    bool valid = true;
+    auto take = [&](void* out, std::size_t bytes)
+    {
+        if ((not valid) or (std::size_t(end - data) < bytes)) { valid = false; return; }
+        if (bytes > 0) { std::memcpy(out, data, bytes); }
+        data += bytes;
+    };
+    
+    CacheHeader stored;
+    take(&stored, sizeof(CacheHeader));
+    uint64_t parse_size = stored.parse_size; stored.parse_size = 0;
+    if ((not valid) or (std::memcmp(&stored, &header, sizeof(CacheHeader)) != 0))
+    {
+        spdlog::warn("{} does not match the reference and the parameters, parsing the reference", file_name);
+        return false;
+    }
+    
+    spdlog::info("Loading the reference parse from {}", file_name);
+    for (auto& shard : this->dictionary.shards)
+    {
+        uint64_t sizes[3]; // entries, arena, slots
+        take(sizes, sizeof(sizes));
+        if (not valid) { break; }
+        shard.entries = sizes[0];
+        shard.arena.resize(sizes[1]); take(shard.arena.data(), sizes[1] * sizeof(vcfbwt::char_type));
+        shard.slots.resize(sizes[2]); take(shard.slots.data(), sizes[2] * sizeof(Dictionary<vcfbwt::char_type>::Slot));
+    }
+    if (valid and (std::size_t(end - data) == parse_size * (sizeof(hash_type) + sizeof(uint64_t))))
+    {
+        this->parse.resize(parse_size); take(this->parse.data(), parse_size * sizeof(hash_type));
+        std::vector<uint64_t> positions(parse_size); take(positions.data(), parse_size * sizeof(uint64_t));
+        this->trigger_strings_position.assign(positions.begin(), positions.end());
+    }
+    else { valid = false; }
+    
+    if (not valid)
+    {
+        spdlog::warn("{} is truncated, parsing the reference", file_name);
+        for (auto& shard : this->dictionary.shards)
+        { shard.entries = 0; shard.arena.clear(); shard.slots.clear(); }
+        this->parse.clear(); this->trigger_strings_position.clear();
+        this->dictionary.recount();
+        return false;
+    }
+    
+    this->dictionary.recount();
+    spdlog::info("Reference parse loaded, {} phrases", this->parse.size());
+    return true;
+}
+
+void
+vcfbwt::pfp::ReferenceParse::save_cache(const std::string& file_name, CacheHeader header) const
+{
+    // Written aside and renamed, concurrent runs only ever see a complete cache
+    std::string tmp_file_name = file_name + "." + std::to_string(pid()) + ".tmp";
+    std::ofstream out(tmp_file_name, std::ios::binary);
+    if (not out.is_open()) { spdlog::warn("Can't write the reference parse cache {}", tmp_file_name); return; }
+    
+    header.parse_size = this->parse.size();
+    out.write((const char*) &header, sizeof(CacheHeader));
+    for (auto& shard : this->dictionary.shards)
+    {
+        uint64_t sizes[3] = { shard.entries, shard.arena.size(), shard.slots.size() };
+        out.write((const char*) sizes, sizeof(sizes));
+        out.write((const char*) shard.arena.data(), shard.arena.size() * sizeof(vcfbwt::char_type));
+        out.write((const char*) shard.slots.data(), shard.slots.size() * sizeof(Dictionary<vcfbwt::char_type>::Slot));
+    }
+    out.write((const char*) this->parse.data(), this->parse.size() * sizeof(hash_type));
+    std::vector<uint64_t> positions(this->trigger_strings_position.begin(), this->trigger_strings_position.end());
+    out.write((const char*) positions.data(), positions.size() * sizeof(uint64_t));
+    out.close();
+    
+    if ((not out) or (std::rename(tmp_file_name.c_str(), file_name.c_str()) != 0))
+    {
+        spdlog::warn("Can't write the reference parse cache {}", file_name);
+        std::remove(tmp_file_name.c_str());
+        return;
+    }
+    vcfbwt::DiskWrites::update(sizeof(CacheHeader) + this->parse.size() * (sizeof(hash_type) + sizeof(uint64_t)));
+    spdlog::info("Reference parse cached in {}", file_name);
+}
+
+//------------------------------------------------------------------------------
+
+void
+vcfbwt::pfp::ReferenceParse::parse_reference(const std::string& reference)
 {
     std::vector<vcfbwt::char_type> phrase;
     spdlog::info("Parsing reference");
     
-    // Karp Robin Hash Function for sliding window
-    Mersenne_KarpRabinHash kr_hash(this->params.w);
-    
     // Reference as first sample, just one dollar to be compatible with Giovanni's pscan.cpp
     phrase.emplace_back(DOLLAR);
     
-    for (std::size_t ref_it = 0; ref_it < reference.size(); ref_it++)
+    std::size_t block_start = 0;
+    auto on_phrase = [&](const std::vector<vcfbwt::char_type>& closed_phrase, std::size_t i)
     {
-        char c = reference[ref_it];
-        if (params.acgt_only) { c = acgt_only_table[c]; }
+        hash_type hash = this->dictionary.check_and_add(closed_phrase);
         
-        phrase.push_back(c);
-        if (phrase.size() == params.w) { kr_hash.initialize(phrase.data(), params.w); }
-        else if (phrase.size() > params.w) { kr_hash.update(phrase[phrase.size() - params.w - 1], phrase[phrase.size() - 1]); }
-        
-        if ((phrase.size() > this->params.w) and ((kr_hash.get_hash() % this->params.p) == 0))
-        {
-            hash_type hash = this->dictionary.check_and_add(phrase);
-            
-            this->parse.push_back(hash);
-            this->trigger_strings_position.push_back(ref_it - this->params.w + 1);
+        this->parse.push_back(hash);
+        this->trigger_strings_position.push_back(block_start + i - this->params.w + 1);
+    };
     
-            phrase.erase(phrase.begin(), phrase.end() - this->params.w); // Keep the last w chars
-            
-            kr_hash.reset(); kr_hash.initialize(phrase.data(), params.w);
+    if (not params.acgt_only)
+    {
+        parse_block((const vcfbwt::char_type*) reference.data(), reference.size(), phrase, this->params, on_phrase);
+    }
+    else
+    {
+        // Translate one block at a time
+        std::vector<vcfbwt::char_type> block;
+        for (block_start = 0; block_start < reference.size(); block_start += MEGABYTE)
+        {
+            block.resize(std::min(MEGABYTE, reference.size() - block_start));
+            for (std::size_t i = 0; i < block.size(); i++)
+            {
+                char c = reference[block_start + i];
+                block[i] = acgt_only_table[c];
+            }
+            parse_block(block.data(), block.size(), phrase, this->params, on_phrase);
         }
     }
     
@@ -59,6 +213,156 @@ vcfbwt::pfp::ReferenceParse::init(const std::string& reference)
 
 //------------------------------------------------------------------------------
 
+std::atomic<std::size_t> vcfbwt::pfp::ParseSink::memory_used(0);
+constexpr std::size_t vcfbwt::pfp::ParseSink::buffer_length;
+
+vcfbwt::pfp::ParseSink::ParseSink(ParseSink&& other) :
+file_name(std::move(other.file_name)), memory_budget(other.memory_budget), length(other.length), closed(other.closed),
+front(std::move(other.front)), front_capacity(other.front_capacity), reserved(other.reserved),
+writer(std::move(other.writer)), mapped(std::move(other.mapped))
+{
+    std::vector<hash_type>().swap(other.front);
+    other.length = 0; other.closed = true; other.front_capacity = 0; other.reserved = 0;
+}
+
+void
+vcfbwt::pfp::ParseSink::open(const std::string& file_name, std::size_t memory_budget)
+{
+    close(); release();
+    
+    this->file_name = file_name; this->memory_budget = memory_budget; this->length = 0; this->closed = false;
+    if (not reserve(buffer_length)) { spill(); }
+}
+
+bool
+vcfbwt::pfp::ParseSink::reserve(std::size_t n)
+{
+    if (this->memory_budget == 0) { return false; }
+    
+    // Grow geometrically, the budget is shared with the other sinks
+    std::size_t step = std::max(std::max(n, buffer_length), this->front_capacity);
+    std::size_t bytes = step * sizeof(hash_type);
+    std::size_t used = memory_used.load();
+    do { if (used + bytes > this->memory_budget) { return false; } }
+    while (not memory_used.compare_exchange_weak(used, used + bytes));
+    
+    this->reserved += bytes; this->front_capacity += step;
+    this->front.reserve(this->front_capacity);
+    return true;
+}
+
+void
+vcfbwt::pfp::ParseSink::spill()
+{
+    spdlog::debug("Parse sink: writing {} to disk", this->file_name);
+    
+    this->writer.reset(new Writer());
+    this->writer->out.open(this->file_name, std::ios::binary);
+    if (not this->writer->out.is_open()) { spdlog::error("Can't open {}", this->file_name); std::exit(EXIT_FAILURE); }
+    this->writer->thread = std::thread(write_back, this->writer.get());
+    
+    memory_used -= this->reserved; this->reserved = 0;
+    this->front_capacity = buffer_length;
+    if (not this->front.empty()) { hand_off(); }
+    else { this->front.reserve(buffer_length); }
+}
+
+void
+vcfbwt::pfp::ParseSink::hand_off()
+{
+    std::unique_lock<std::mutex> lock(this->writer->mutex);
+    this->writer->condition.wait(lock, [this]() { return not this->writer->pending; });
+    this->front.swap(this->writer->back);
+    this->writer->pending = true;
+    lock.unlock();
+    this->writer->condition.notify_all();
+    
+    this->front.clear();
+    if (this->front.capacity() < buffer_length) { this->front.reserve(buffer_length); }
+}
+
+void
+vcfbwt::pfp::ParseSink::write_back(Writer* writer)
+{
+    std::unique_lock<std::mutex> lock(writer->mutex);
+    while (true)
+    {
+        writer->condition.wait(lock, [writer]() { return writer->pending or writer->done; });
+        if (not writer->pending) { break; }
+        
+        lock.unlock();
+        writer->out.write((char*) writer->back.data(), writer->back.size() * sizeof(hash_type));
+        writer->bytes += writer->back.size() * sizeof(hash_type);
+        
+        // A buffer spilled from memory can be much larger than the double buffers
+        if (writer->back.capacity() > buffer_length) { std::vector<hash_type>().swap(writer->back); }
+        writer->back.clear();
+        lock.lock();
+        
+        writer->pending = false;
+        writer->condition.notify_all();
+    }
+}
+
+void
+vcfbwt::pfp::ParseSink::write(const hash_type* hashes, std::size_t n)
+{
+    if (in_memory() and (this->front.size() + n > this->front_capacity) and (not reserve(n))) { spill(); }
+    
+    if (in_memory())
+    {
+        this->front.insert(this->front.end(), hashes, hashes + n); this->length += n;
+        return;
+    }
+    
+    while (n > 0)
+    {
+        if (this->front.size() == this->front_capacity) { hand_off(); }
+        std::size_t m = std::min(n, this->front_capacity - this->front.size());
+        this->front.insert(this->front.end(), hashes, hashes + m);
+        hashes += m; n -= m; this->length += m;
+    }
+}
+
+void
+vcfbwt::pfp::ParseSink::close()
+{
+    if (this->closed) { return; } this->closed = true;
+    if (in_memory()) { return; }
+    
+    if (not this->front.empty()) { hand_off(); }
+    {
+        std::lock_guard<std::mutex> lock(this->writer->mutex);
+        this->writer->done = true;
+    }
+    this->writer->condition.notify_all();
+    this->writer->thread.join();
+    this->writer->out.close();
+    std::vector<hash_type>().swap(this->front);
+    
+    if (this->length != 0) { map_file(this->file_name, this->mapped, true); }
+}
+
+void
+vcfbwt::pfp::ParseSink::release()
+{
+    if (not this->closed) { close(); }
+    
+    std::vector<hash_type>().swap(this->front);
+    memory_used -= this->reserved; this->reserved = 0; this->front_capacity = 0;
+    if (this->mapped.is_mapped()) { this->mapped.unmap(); }
+    this->writer.reset();
+}
+
+const vcfbwt::hash_type*
+vcfbwt::pfp::ParseSink::data() const
+{
+    if (in_memory()) { return this->front.data(); }
+    return reinterpret_cast<const hash_type*>(this->mapped.data());
+}
+
+//------------------------------------------------------------------------------
+
 void
 vcfbwt::pfp::ParserVCF::init(const Params& params, const std::string& prefix, ReferenceParse& rp, std::size_t t)
 {
@@ -68,7 +372,7 @@ vcfbwt::pfp::ParserVCF::init(const Params& params, const std::string& prefix, Re
     if (tags & MAIN) {this->out_file_name = out_file_prefix + EXT::PARSE; }
     if ((tags & MAIN) and params.compress_dictionary) { tags = tags | COMPRESSED; }
     this->tmp_out_file_name = TempFile::getName("parse");
-    this->out_file.open(tmp_out_file_name, std::ios::binary);
+    this->out_sink.open(tmp_out_file_name, params.parse_memory_budget);
     this->reference_parse = &rp;
     this->dictionary = &this->reference_parse->dictionary;
     
@@ -76,10 +380,12 @@ vcfbwt::pfp::ParserVCF::init(const Params& params, const std::string& prefix, Re
 }
 
 void
-vcfbwt::pfp::ParserVCF::operator()(const vcfbwt::Sample& sample)
+vcfbwt::pfp::ParserVCF::operator()(const vcfbwt::Sample& sample, std::size_t unit)
 {
     Sample::iterator sample_iterator(sample, this->working_genotype);
     this->samples_processed.push_back(sample.id());
+    std::size_t parse_start = this->parse_size;
+    double start_time = Metrics::wall_time();
     
     std::vector<vcfbwt::char_type> phrase;
     
@@ -122,7 +428,7 @@ vcfbwt::pfp::ParserVCF::operator()(const vcfbwt::Sample& sample)
                     spdlog::debug("skipped phrases: {}", end_window - start_window);
                     
                     // copy from parse[start_window : end_window]
-                    out_file.write((char*) &(this->reference_parse->parse[start_window]), sizeof(hash_type) * (end_window - start_window + 1));
+                    out_sink.write(&(this->reference_parse->parse[start_window]), end_window - start_window + 1);
                     this->parse_size += end_window - start_window + 1;
             
                     // move iterators and re-initialize phrase
@@ -145,29 +451,38 @@ vcfbwt::pfp::ParserVCF::operator()(const vcfbwt::Sample& sample)
         }
         
         // Next phrase should contain a variation so parse as normal, also if we don't
-        // want to use the acceleration we should always end up here
-        char next_char  = (params.acgt_only) ? acgt_only_table[*sample_iterator] : *sample_iterator;
-        phrase.push_back(next_char);
-        kr_hash.update(phrase[phrase.size() - params.w - 1], phrase[phrase.size() - 1]);
-        ++sample_iterator;
-    
-        if ((phrase.size() > this->params.w) and ((kr_hash.get_hash() % this->params.p) == 0))
+        // want to use the acceleration we should always end up here. Consume the haplotype a run at a
+        // time, stopping after a trigger string if the acceleration might skip what follows.
+        Sample::iterator::Run run = sample_iterator.current_run();
+        std::size_t consumed = 0;
+        while (consumed < run.size)
         {
-            hash_type hash = this->dictionary->check_and_add(phrase);
-        
-            out_file.write((char*) (&hash), sizeof(hash_type)); this->parse_size += 1;
+            char next_char  = (params.acgt_only) ? acgt_only_table[run.data[consumed]] : run.data[consumed];
+            phrase.push_back(next_char);
+            kr_hash.update(phrase[phrase.size() - params.w - 1], phrase[phrase.size() - 1]);
+            consumed++;
     
-            if (phrase[0] != DOLLAR_PRIME)
+            if ((phrase.size() > this->params.w) and ((kr_hash.get_hash() % this->params.p) == 0))
             {
-                spdlog::debug("------------------------------------------------------------");
-                spdlog::debug("Parsed phrase [{}] {}", phrase.size(), std::string((char*) phrase.data(), phrase.size()));
-                spdlog::debug("------------------------------------------------------------");
-            }
+                hash_type hash = this->dictionary->check_and_add(phrase);
             
-            phrase.erase(phrase.begin(), phrase.end() - this->w); // Keep the last w chars
-    
-            kr_hash.reset(); kr_hash.initialize(phrase.data(), params.w);
+                out_sink.write(hash); this->parse_size += 1;
+        
+                if (phrase[0] != DOLLAR_PRIME)
+                {
+                    spdlog::debug("------------------------------------------------------------");
+                    spdlog::debug("Parsed phrase [{}] {}", phrase.size(), std::string((char*) phrase.data(), phrase.size()));
+                    spdlog::debug("------------------------------------------------------------");
+                }
+                
+                phrase.erase(phrase.begin(), phrase.end() - this->w); // Keep the last w chars
+        
+                kr_hash.reset(); kr_hash.initialize(phrase.data(), params.w);
+                
+                if (params.use_acceleration) { break; }
+            }
         }
+        sample_iterator.advance(consumed);
     }
     
     // Last phrase
@@ -179,7 +494,7 @@ vcfbwt::pfp::ParserVCF::operator()(const vcfbwt::Sample& sample)
 
         // write down last phrase of last sequence
         hash_type hash = this->dictionary->check_and_add(phrase);
-        out_file.write((char*) (&hash), sizeof(hash_type));   this->parse_size += 1;
+        out_sink.write(hash);   this->parse_size += 1;
 
         // if this is the last sample, add w dollars at the end
         if (sample.last(this->working_genotype))
@@ -189,10 +504,32 @@ vcfbwt::pfp::ParserVCF::operator()(const vcfbwt::Sample& sample)
 
             // write down last phrase
             hash_type hash_l = this->dictionary->check_and_add(phrase);
-            out_file.write((char*) (&hash_l), sizeof(hash_type));   this->parse_size += 1;
+            out_sink.write(hash_l);   this->parse_size += 1;
         }
     }
     else { spdlog::error("A sample doesn't have w dollar prime at the end!"); std::exit(EXIT_FAILURE); }
+    
+    ParsedHaplotype parsed = { unit, parse_start, this->parse_size - parse_start };
+    this->parsed_haplotypes.push_back(parsed);
+    
+    this->statistics.bases_parsed += sample_iterator.length();
+    this->statistics.parse_seconds += Metrics::wall_time() - start_time;
+}
+
+void
+vcfbwt::pfp::ParserVCF::end_of_text(std::size_t unit)
+{
+    // w-1 dollar prime and a dollar sequence closing the last sample, followed by w dollars
+    std::vector<vcfbwt::char_type> phrase(params.w - 1, DOLLAR_PRIME);
+    phrase.emplace_back(DOLLAR_SEQUENCE);
+    phrase.insert(phrase.end(), params.w, DOLLAR);
+    
+    hash_type hash = this->dictionary->check_and_add(phrase);
+    out_sink.write(hash);
+    
+    ParsedHaplotype parsed = { unit, this->parse_size, 1 };
+    this->parsed_haplotypes.push_back(parsed);
+    this->parse_size += 1;
 }
 
 void
@@ -202,8 +539,8 @@ vcfbwt::pfp::ParserVCF::close()
     
     if ((tags & MAIN) or (tags & WORKER))
     {
-        vcfbwt::DiskWrites::update(out_file.tellp()); // Disk Stats
-        this->out_file.close();
+        this->out_sink.close();
+        vcfbwt::DiskWrites::update(out_sink.disk_bytes()); // Disk Stats
     }
     
     // Output parse, substitute hash with rank
@@ -213,101 +550,107 @@ vcfbwt::pfp::ParserVCF::close()
         spdlog::info("Main parser: closing all registered workers");
         for (auto worker : registered_workers) { worker.get().close(); }
         
-        spdlog::info("Main parser: Replacing hash values with ranks in MAIN, WORKERS and reference");
+        spdlog::info("Main parser: Sorting the dictionary");
+        Metrics::Phase sort_phase("sort dictionary");
+        this->dictionary->sort(this->params.threads);
+        sort_phase.stop();
         
-        // repeat for reference
-        if (not this->reference_parse->parse.empty())
-        {
-            for (std::size_t i = 0; i < this->reference_parse->parse.size(); i++)
-            {
-                hash_type rank = this->dictionary->hash_to_rank(this->reference_parse->parse[i]);
-                this->reference_parse->parse[i] = rank;
-            }
-        }
-    
-        // MAIN read hash values and substitute with ranks
-        if (this->parse_size != 0)
-        {
-            std::ofstream out_ranks(tmp_out_file_name + ".ranks");
-            if (not out_ranks.is_open()) { spdlog::error("Can't open {}", tmp_out_file_name + ".ranks"); std::exit(EXIT_FAILURE); }
+        Metrics::Phase ranks_phase("rank substitution");
+        spdlog::info("Main parser: Replacing hash values with ranks in MAIN, WORKERS and reference");
         
-            std::ifstream in_hash(tmp_out_file_name);
-            if (not in_hash.is_open()) { spdlog::error("Can't open {}", tmp_out_file_name); std::exit(EXIT_FAILURE); }
+        // The final parse is the reference followed by the haplotypes parsed by MAIN and the WORKERS, ordered by
+        // unit. Each haplotype is written at its offset.
+        std::vector<std::reference_wrapper<ParserVCF>> parsers(1, std::ref(*this));
+        parsers.insert(parsers.end(), registered_workers.begin(), registered_workers.end());
         
-            for (std::size_t i = 0; i < this->parse_size; i++)
-            {
-                hash_type hash;
-                in_hash.read((char*) &hash, sizeof(hash_type));
-                size_type rank = this->dictionary->hash_to_rank(hash);
-                out_ranks.write((char*) &rank, sizeof(size_type));
-            }
-            in_hash.close();
-            vcfbwt::DiskWrites::update(out_ranks.tellp());
-            out_ranks.close();
+        for (std::size_t p = 0; p < parsers.size(); p++)
+        {
+            if ((p == 0) and (this->statistics.bases_parsed == 0)) { continue; } // only the workers parsed
+            Metrics::Worker worker;
+            worker.name = (p == 0) ? "main" : ("worker " + std::to_string(p - 1));
+            worker.bases = parsers[p].get().statistics.bases_parsed;
+            worker.phrases = parsers[p].get().parse_size;
+            worker.seconds = parsers[p].get().statistics.parse_seconds;
+            Metrics::add_worker(worker);
         }
         
-        // repeat for every worker
-        for (auto worker : registered_workers)
+        struct HaplotypeSegment { std::size_t parser; ParsedHaplotype haplotype; std::size_t out_offset; };
+        std::vector<HaplotypeSegment> segments;
+        for (std::size_t p = 0; p < parsers.size(); p++)
         {
-            if (worker.get().parse_size != 0)
+            for (auto& haplotype : parsers[p].get().parsed_haplotypes)
             {
-                std::ofstream out_ranks(worker.get().tmp_out_file_name + ".ranks");
-                if (not out_ranks.is_open()) { spdlog::error("Can't open {}", worker.get().tmp_out_file_name + ".ranks"); std::exit(EXIT_FAILURE); }
-    
-                std::ifstream in_hash(worker.get().tmp_out_file_name);
-                if (not in_hash.is_open()) { spdlog::error("Can't open {}", worker.get().tmp_out_file_name); std::exit(EXIT_FAILURE); }
-    
-                for (std::size_t i = 0; i < worker.get().parse_size; i++)
-                {
-                    hash_type hash;
-                    in_hash.read((char*) &hash, sizeof(hash_type));
-                    size_type rank = this->dictionary->hash_to_rank(hash);
-                    out_ranks.write((char*) &rank, sizeof(size_type));
-                }
-                in_hash.close();
-                vcfbwt::DiskWrites::update(out_ranks.tellp());
-                out_ranks.close();
+                HaplotypeSegment segment = { p, haplotype, 0 };
+                segments.push_back(segment);
             }
         }
+        std::stable_sort(segments.begin(), segments.end(), [](const HaplotypeSegment& a, const HaplotypeSegment& b)
+        { return a.haplotype.unit < b.haplotype.unit; });
+        
+        std::size_t out_parse_size = this->reference_parse->parse.size();
+        for (auto& segment : segments) { segment.out_offset = out_parse_size; out_parse_size += segment.haplotype.length; }
         
-        // Merging files together
-        spdlog::info("Main parser: concatenating parsings from workers and reference, reference as first");
         std::ofstream merged(out_file_name, std::ios_base::binary);
+        if (not merged.is_open()) { spdlog::error("Can't open {}", out_file_name); std::exit(EXIT_FAILURE); }
+        merged.close();
+        vcfbwt::truncate_file(out_file_name, out_parse_size * sizeof(size_type));
+        
+        mio::mmap_sink out_parse;
+        if (out_parse_size != 0)
+        {
+            std::error_code error;
+            out_parse.map(out_file_name, error);
+            if (error) { spdlog::error("Can't map {}: {}", out_file_name, error.message()); std::exit(EXIT_FAILURE); }
+        }
+        size_type* ranks = reinterpret_cast<size_type*>(out_parse.data());
         
         // Reference
-        std::size_t out_parse_size = 0;
-        out_parse_size += this->reference_parse->parse.size();
-        for (auto& e : this->reference_parse->parse)
+        #pragma omp parallel for schedule(static) num_threads(this->params.threads)
+        for (std::size_t i = 0; i < this->reference_parse->parse.size(); i++)
         {
-            size_type out_e = e;
-            merged.write((char*) &out_e, sizeof(size_type));
+            this->reference_parse->parse[i] = this->dictionary->hash_to_rank(this->reference_parse->parse[i]);
+            ranks[i] = this->reference_parse->parse[i];
         }
     
-        // Main
-        if ((this->parse_size) != 0)
+        // MAIN and WORKERS, map the hash files and substitute in chunks, in parallel
+        struct RanksChunk { std::size_t parser; std::size_t first; std::size_t last; std::size_t out_offset; };
+        const std::size_t chunk_size = 1 << 20;
+        std::vector<RanksChunk> chunks;
+        std::vector<const hash_type*> in_hashes(parsers.size());
+        for (std::size_t p = 0; p < parsers.size(); p++) { in_hashes[p] = parsers[p].get().out_sink.data(); }
+        
+        for (auto& segment : segments)
         {
-            std::ifstream main_parse(this->tmp_out_file_name + ".ranks");
-            merged << main_parse.rdbuf();
-            out_parse_size += this->parse_size;
+            std::size_t segment_end = segment.haplotype.first + segment.haplotype.length;
+            for (std::size_t first = segment.haplotype.first; first < segment_end; first += chunk_size)
+            {
+                RanksChunk chunk = { segment.parser, first, std::min(first + chunk_size, segment_end),
+                                     segment.out_offset + (first - segment.haplotype.first) };
+                chunks.push_back(chunk);
+            }
         }
-        
-        // Workers
-        for (auto worker : registered_workers)
+    
+        #pragma omp parallel for schedule(dynamic) num_threads(this->params.threads)
+        for (std::size_t c = 0; c < chunks.size(); c++)
         {
-            if (worker.get().parse_size != 0)
+            const hash_type* hashes = in_hashes[chunks[c].parser];
+            size_type* chunk_ranks = ranks + chunks[c].out_offset;
+            for (std::size_t i = chunks[c].first; i < chunks[c].last; i++)
             {
-                out_parse_size += worker.get().parse_size;
-                std::ifstream worker_parse(worker.get().tmp_out_file_name + ".ranks");
-                merged << worker_parse.rdbuf();
+                chunk_ranks[i - chunks[c].first] = this->dictionary->hash_to_rank(hashes[i]);
             }
         }
-        vcfbwt::DiskWrites::update(merged.tellp()); // Disk Stats
-        merged.close();
+        
+        for (auto parser : parsers) { parser.get().out_sink.release(); }
+        out_parse.unmap();
+        vcfbwt::DiskWrites::update(out_parse_size * sizeof(size_type)); // Disk Stats
         
         this->parse_size = out_parse_size;
+        ranks_phase.stop();
         
         // Print dicitionary on disk
         spdlog::info("Main parser: writing dictionary to disk NOT COMPRESSED");
+        Metrics::Phase dictionary_phase("write dictionary");
         std::string dict_file_name = out_file_prefix + EXT::DICT;
         std::ofstream dict(dict_file_name);
     
@@ -320,6 +663,9 @@ vcfbwt::pfp::ParserVCF::close()
         
         vcfbwt::DiskWrites::update(dict.tellp()); // Disk Stats
         dict.close();
+        dictionary_phase.stop();
+        
+        if (this->params.compact_parse) { pack_parse(this->out_file_name, this->dictionary->size(), this->params.threads); }
         
         vcfbwt::pfp::PropertiesWriter<vcfbwt::char_type> properties_out(this->out_file_prefix, this->params);
         properties_out.write();
@@ -340,7 +686,7 @@ vcfbwt::pfp::ParserFasta::init(const Params& params, const std::string& prefix)
     this->out_file_prefix = prefix;
     this->out_file_name = prefix + EXT::PARSE;
     this->tmp_out_file_name = TempFile::getName("parse");
-    this->out_file.open(tmp_out_file_name, std::ios::binary);
+    this->out_sink.open(tmp_out_file_name, params.parse_memory_budget);
 }
 
 void
@@ -354,13 +700,14 @@ vcfbwt::pfp::ParserFasta::operator()()
         spdlog::error("Failed to open input file {}", in_file_path);
         exit(EXIT_FAILURE);
     }
+    DiskReads::update(this->in_file_path);
+    
+    Metrics::Worker metrics; metrics.name = "main";
+    double start_time = Metrics::wall_time();
     
     std::vector<vcfbwt::char_type> phrase;
     spdlog::info("Parsing sequence");
     
-    // Karp Robin Hash Function for sliding window
-    Mersenne_KarpRabinHash kr_hash(this->params.w);
-    
     // First sequence start with one dollar
     phrase.emplace_back(DOLLAR);
     
@@ -372,6 +719,7 @@ vcfbwt::pfp::ParserFasta::operator()()
         if (record->comment.s != NULL) { sequence_comment = record->comment.s; }
         this->sequences_processed.push_back(sequence_name + " " + sequence_comment);
         spdlog::info("Parsed:\t{}", sequence_name + " " + sequence_comment);
+        metrics.bases += record->seq.l;
         
         // Previous last phrase
         if (phrase[0] != DOLLAR and phrase.size() >= this->params.w)
@@ -382,15 +730,21 @@ vcfbwt::pfp::ParserFasta::operator()()
     
             hash_type hash = this->dictionary.check_and_add(phrase);
      
-            out_file.write((char*) (&hash), sizeof(hash_type)); this->parse_size += 1;
+            out_sink.write(hash); this->parse_size += 1;
     
             // Reset phrase
             phrase.clear();
             for (std::size_t j = 0; j < this->params.w - 1; j++) { phrase.emplace_back(DOLLAR_PRIME); }
             phrase.emplace_back(DOLLAR_SEQUENCE);
-            kr_hash.reset(); kr_hash.initialize(phrase.data(), params.w);
         }
         
+        if (this->params.threads > 1)
+        {
+            this->parse_sequence_parallel(record->seq.s, record->seq.l, phrase);
+            continue;
+        }
+        
+        // Validate and translate in place, then parse the whole sequence
         for (std::size_t seq_it = 0; seq_it < record->seq.l; seq_it++)
         {
             char c = record->seq.s[seq_it];
@@ -400,23 +754,16 @@ vcfbwt::pfp::ParserFasta::operator()()
                 spdlog::error("Input may not contain bytes with integer value less than or equal to 5!");
                 std::exit(EXIT_FAILURE);
             }
-            if (params.acgt_only) { c = acgt_only_table[c]; }
-        
-            phrase.push_back(c);
-            if (phrase.size() == params.w) { kr_hash.initialize(phrase.data(), params.w); }
-            else if (phrase.size() > params.w) { kr_hash.update(phrase[phrase.size() - params.w - 1], phrase[phrase.size() - 1]); }
+            if (params.acgt_only) { record->seq.s[seq_it] = acgt_only_table[c]; }
+        }
         
-            if ((phrase.size() > this->params.w) and ((kr_hash.get_hash() % this->params.p) == 0))
-            {
-                hash_type hash = this->dictionary.check_and_add(phrase);
+        parse_block((const vcfbwt::char_type*) record->seq.s, record->seq.l, phrase, this->params,
+                    [&](const std::vector<vcfbwt::char_type>& closed_phrase, std::size_t)
+        {
+            hash_type hash = this->dictionary.check_and_add(closed_phrase);
     
-                out_file.write((char*) (&hash), sizeof(hash_type)); this->parse_size += 1;
-                
-                phrase.erase(phrase.begin(), phrase.end() - this->params.w); // Keep the last w chars
-                
-                kr_hash.reset(); kr_hash.initialize(phrase.data(), params.w);
-            }
-        }
+            out_sink.write(hash); this->parse_size += 1;
+        });
     }
 
     // Last phrase
@@ -428,7 +775,7 @@ vcfbwt::pfp::ParserFasta::operator()()
 
         // write down last phrase of last sequence
         hash_type hash = this->dictionary.check_and_add(phrase);
-        out_file.write((char*) (&hash), sizeof(hash_type));   this->parse_size += 1;
+        out_sink.write(hash);   this->parse_size += 1;
 
         // last sequence, add w dollars at the end
         phrase.erase(phrase.begin(), phrase.end() - this->params.w); // keep the last w chars
@@ -436,48 +783,118 @@ vcfbwt::pfp::ParserFasta::operator()()
 
         // write down last phrase
         hash_type hash_l = this->dictionary.check_and_add(phrase);
-        out_file.write((char*) (&hash_l), sizeof(hash_type));   this->parse_size += 1;
+        out_sink.write(hash_l);   this->parse_size += 1;
     }
     else { spdlog::error("Missing w DOLLAR at the end!"); std::exit(EXIT_FAILURE); }
     
     kseq_destroy(record);
     gzclose(fp);
+    
+    metrics.phrases = this->parse_size; metrics.seconds = Metrics::wall_time() - start_time;
+    Metrics::add_worker(metrics);
 }
 
+void
+vcfbwt::pfp::ParserFasta::parse_sequence_parallel(const char* sequence, std::size_t length, std::vector<vcfbwt::char_type>& phrase)
+{
+    // The text to parse is the phrase still open followed by the new sequence
+    std::size_t offset = phrase.size();
+    std::vector<vcfbwt::char_type> text(offset + length);
+    std::copy(phrase.begin(), phrase.end(), text.begin());
+    
+    bool invalid_input = false;
+    #pragma omp parallel for schedule(static) num_threads(this->params.threads) reduction(||:invalid_input)
+    for (std::size_t seq_it = 0; seq_it < length; seq_it++)
+    {
+        char c = sequence[seq_it];
+        if (c <= DOLLAR_PRIME) { invalid_input = true; continue; }
+        if (params.acgt_only) { c = acgt_only_table[c]; }
+        text[offset + seq_it] = c;
+    }
+    
+    if (invalid_input)
+    {
+        spdlog::error("Input may not contain bytes with integer value less than or equal to 5!");
+        std::exit(EXIT_FAILURE);
+    }
+    
+    // Trigger strings are found independently on each chunk, a window can close a phrase only if phrase.size() > w
+    std::size_t first_window_end = std::max(offset, std::size_t(this->params.w));
+    std::size_t chunks = this->params.threads;
+    std::vector<std::vector<std::size_t>> chunks_triggers(chunks);
+    if (first_window_end < text.size())
+    {
+        std::size_t chunk_length = ((text.size() - first_window_end) + chunks - 1) / chunks;
+        
+        #pragma omp parallel for schedule(static) num_threads(this->params.threads)
+        for (std::size_t chunk = 0; chunk < chunks; chunk++)
+        {
+            std::size_t chunk_start = first_window_end + chunk * chunk_length;
+            std::size_t chunk_end = std::min(chunk_start + chunk_length, text.size());
+            if (chunk_start >= chunk_end) { continue; }
+            
+            find_trigger_strings(text.data(), chunk_end, chunk_start, this->params.w, this->params.p, chunks_triggers[chunk]);
+        }
+    }
+    
+    // Join the chunks, phrases go from the previous trigger string to the current one
+    std::vector<std::size_t> triggers;
+    for (auto& chunk_triggers : chunks_triggers) { triggers.insert(triggers.end(), chunk_triggers.begin(), chunk_triggers.end()); }
+    
+    std::vector<hash_type> hashes(triggers.size());
+    #pragma omp parallel for schedule(static) num_threads(this->params.threads)
+    for (std::size_t i = 0; i < triggers.size(); i++)
+    {
+        std::size_t phrase_start = (i == 0) ? 0 : (triggers[i - 1] - this->params.w + 1);
+        std::vector<vcfbwt::char_type> to_add(text.begin() + phrase_start, text.begin() + triggers[i] + 1);
+        hashes[i] = this->dictionary.check_and_add(to_add);
+    }
+    
+    out_sink.write(hashes.data(), hashes.size()); this->parse_size += hashes.size();
+    
+    // Keep the open phrase, the last w chars of the last trigger string onward
+    std::size_t open_phrase_start = triggers.empty() ? 0 : (triggers.back() - this->params.w + 1);
+    phrase.assign(text.begin() + open_phrase_start, text.end());
+}
 
 void
 vcfbwt::pfp::ParserFasta::close()
 {
     if (closed) return; closed = true;
     
-    vcfbwt::DiskWrites::update(out_file.tellp()); // Disk Stats
-    this->out_file.close();
+    this->out_sink.close();
+    vcfbwt::DiskWrites::update(out_sink.disk_bytes()); // Disk Stats
     
+    spdlog::info("Main parser: Sorting the dictionary.");
+    Metrics::Phase sort_phase("sort dictionary");
+    this->dictionary.sort(this->params.threads);
+    sort_phase.stop();
+
     spdlog::info("Main parser: Replacing hash values with ranks.");
     
     // mmap file and substitute
+    Metrics::Phase ranks_phase("rank substitution");
     if (this->parse_size != 0)
     {
         std::ofstream out_ranks(this->out_file_name);
         if (not out_ranks.is_open()) { spdlog::error("Can't open {}", this->out_file_name); std::exit(EXIT_FAILURE); }
     
-        std::ifstream in_hash(tmp_out_file_name);
-        if (not in_hash.is_open()) { spdlog::error("Can't open {}", tmp_out_file_name); std::exit(EXIT_FAILURE); }
+        const hash_type* hashes = this->out_sink.data();
         
         for (std::size_t i = 0; i < this->parse_size; i++)
         {
-            hash_type hash;
-            in_hash.read((char*) &hash, sizeof(hash_type));
-            size_type rank = this->dictionary.hash_to_rank(hash);
+            size_type rank = this->dictionary.hash_to_rank(hashes[i]);
             out_ranks.write((char*) &rank, sizeof(size_type));
         }
-        in_hash.close();
+        this->out_sink.release();
         vcfbwt::DiskWrites::update(out_ranks.tellp());
         out_ranks.close();
     }
+    ranks_phase.stop();
     
     // Print dicitionary on disk
     spdlog::info("Main parser: writing dictionary on disk NOT COMPRESSED");
+    Metrics::Phase dictionary_phase("write dictionary");
     std::string dict_file_name = out_file_prefix + EXT::DICT;
     std::ofstream dict(dict_file_name);
     
@@ -490,6 +907,10 @@ vcfbwt::pfp::ParserFasta::close()
     
     vcfbwt::DiskWrites::update(dict.tellp()); // Disk Stats
     dict.close();
+    dictionary_phase.stop();
+    
+    if (this->params.compact_parse and (this->parse_size != 0))
+    { pack_parse(this->out_file_name, this->dictionary.size(), this->params.threads); }
     
     vcfbwt::pfp::PropertiesWriter<vcfbwt::char_type> properties_out(this->out_file_prefix, this->params);
     properties_out.write();
@@ -509,53 +930,75 @@ vcfbwt::pfp::ParserText::init(const Params& params, const std::string& prefix)
     this->out_file_prefix = prefix;
     this->out_file_name = prefix + EXT::PARSE;
     this->tmp_out_file_name = TempFile::getName("parse");
-    this->out_file.open(tmp_out_file_name, std::ios::binary);
+    this->out_sink.open(tmp_out_file_name, params.parse_memory_budget);
 }
 
 void
 vcfbwt::pfp::ParserText::operator()()
 {
-    // Open input file with kseq
-    gzFile fp;
-    fp = gzopen(this->in_file_path.c_str(), "r");
-    if (fp == nullptr)
-    {
-        spdlog::error("Failed to open input file {}", in_file_path);
-        exit(EXIT_FAILURE);
-    }
-    
     std::vector<vcfbwt::char_type> phrase;
     spdlog::info("Parsing {}", in_file_path);
     
-    // Karp Robin Hash Function for sliding window
-    Mersenne_KarpRabinHash kr_hash(this->params.w);
-    
     // First sequence start with one dollar
     phrase.emplace_back(DOLLAR);
     
-    char c;
-    while(gzread(fp, &c, 1) > 0)
+    Metrics::Worker metrics; metrics.name = "main";
+    double start_time = Metrics::wall_time();
+    
+    auto parse_text_block = [&](const vcfbwt::char_type* block, std::size_t length)
     {
-        if (c <= DOLLAR_PRIME)
+        metrics.bases += length;
+        for (std::size_t i = 0; i < length; i++)
         {
-            spdlog::error("Input may not contain bytes with integer value less than or equal to 5!");
-            std::exit(EXIT_FAILURE);
+            char c = block[i];
+            if (c <= DOLLAR_PRIME)
+            {
+                spdlog::error("Input may not contain bytes with integer value less than or equal to 5!");
+                std::exit(EXIT_FAILURE);
+            }
         }
         
-        phrase.push_back(c);
-        if (phrase.size() == params.w) { kr_hash.initialize(phrase.data(), params.w); }
-        else if (phrase.size() > params.w) { kr_hash.update(phrase[phrase.size() - params.w - 1], phrase[phrase.size() - 1]); }
-        
-        if ((phrase.size() > this->params.w) and ((kr_hash.get_hash() % this->params.p) == 0))
+        parse_block(block, length, phrase, this->params, [&](const std::vector<vcfbwt::char_type>& closed_phrase, std::size_t)
         {
-            hash_type hash = this->dictionary.check_and_add(phrase);
-            
-            out_file.write((char*) (&hash), sizeof(hash_type)); this->parse_size += 1;
+            hash_type hash = this->dictionary.check_and_add(closed_phrase);
             
-            phrase.erase(phrase.begin(), phrase.end() - this->params.w); // Keep the last w chars
-            
-            kr_hash.reset(); kr_hash.initialize(phrase.data(), params.w);
+            out_sink.write(hash); this->parse_size += 1;
+        });
+    };
+    
+    std::ifstream in_stream(this->in_file_path);
+    if (not in_stream.is_open()) { spdlog::error("Failed to open input file {}", in_file_path); std::exit(EXIT_FAILURE); }
+    bool gzipped = is_gzipped(in_stream);
+    in_stream.close();
+    
+    if (not gzipped)
+    {
+        // Parse the mapped file, no copies through stream buffers
+        mio::mmap_source in_map;
+        map_file(this->in_file_path, in_map, true);
+        
+        const vcfbwt::char_type* text = reinterpret_cast<const vcfbwt::char_type*>(in_map.data());
+        for (std::size_t block_start = 0; block_start < in_map.size(); block_start += MEGABYTE)
+        {
+            parse_text_block(text + block_start, std::min(MEGABYTE, in_map.size() - block_start));
+        }
+    }
+    else
+    {
+        gzFile fp;
+        fp = gzopen(this->in_file_path.c_str(), "r");
+        if (fp == nullptr)
+        {
+            spdlog::error("Failed to open input file {}", in_file_path);
+            exit(EXIT_FAILURE);
         }
+        DiskReads::update(this->in_file_path);
+        
+        std::vector<vcfbwt::char_type> block(MEGABYTE);
+        int read_bytes;
+        while((read_bytes = gzread(fp, block.data(), block.size())) > 0) { parse_text_block(block.data(), read_bytes); }
+        
+        gzclose(fp);
     }
     
     // Last phrase
@@ -566,11 +1009,12 @@ vcfbwt::pfp::ParserText::operator()()
         
         hash_type hash = this->dictionary.check_and_add(phrase);
         
-        out_file.write((char*) (&hash), sizeof(hash_type)); this->parse_size += 1;
+        out_sink.write(hash); this->parse_size += 1;
     }
     else { spdlog::error("A sequence doesn't have w DOLLAR at the end!"); std::exit(EXIT_FAILURE); }
     
-    gzclose(fp);
+    metrics.phrases = this->parse_size; metrics.seconds = Metrics::wall_time() - start_time;
+    Metrics::add_worker(metrics);
 }
 
 
@@ -579,35 +1023,40 @@ vcfbwt::pfp::ParserText::close()
 {
     if (closed) return; closed = true;
     
-    vcfbwt::DiskWrites::update(out_file.tellp()); // Disk Stats
-    this->out_file.close();
+    this->out_sink.close();
+    vcfbwt::DiskWrites::update(out_sink.disk_bytes()); // Disk Stats
     
     // Occurrences
+    spdlog::info("Main parser: Sorting the dictionary.");
+    Metrics::Phase sort_phase("sort dictionary");
+    this->dictionary.sort(this->params.threads);
+    sort_phase.stop();
+
     spdlog::info("Main parser: Replacing hash values with ranks.");
     
     // mmap file and substitute
+    Metrics::Phase ranks_phase("rank substitution");
     if (this->parse_size != 0)
     {
         std::ofstream out_ranks(this->out_file_name);
         if (not out_ranks.is_open()) { spdlog::error("Can't open {}", this->out_file_name); std::exit(EXIT_FAILURE); }
     
-        std::ifstream in_hash(tmp_out_file_name);
-        if (not in_hash.is_open()) { spdlog::error("Can't open {}", tmp_out_file_name); std::exit(EXIT_FAILURE); }
+        const hash_type* hashes = this->out_sink.data();
     
         for (std::size_t i = 0; i < this->parse_size; i++)
         {
-            hash_type hash;
-            in_hash.read((char*) &hash, sizeof(hash_type));
-            size_type rank = this->dictionary.hash_to_rank(hash);
+            size_type rank = this->dictionary.hash_to_rank(hashes[i]);
             out_ranks.write((char*) &rank, sizeof(size_type));
         }
-        in_hash.close();
+        this->out_sink.release();
         vcfbwt::DiskWrites::update(out_ranks.tellp());
         out_ranks.close();
     }
+    ranks_phase.stop();
     
     // Print dicitionary on disk
     spdlog::info("Main parser: writing dictionary on disk NOT COMPRESSED");
+    Metrics::Phase dictionary_phase("write dictionary");
     std::string dict_file_name = out_file_prefix + EXT::DICT;
     std::ofstream dict(dict_file_name);
     
@@ -621,6 +1070,10 @@ vcfbwt::pfp::ParserText::close()
     
     vcfbwt::DiskWrites::update(dict.tellp()); // Disk Stats
     dict.close();
+    dictionary_phase.stop();
+    
+    if (this->params.compact_parse and (this->parse_size != 0))
+    { pack_parse(this->out_file_name, this->dictionary.size(), this->params.threads); }
     
     vcfbwt::pfp::PropertiesWriter<vcfbwt::char_type> properties_out(this->out_file_prefix, this->params);
     properties_out.write();
@@ -640,50 +1093,86 @@ vcfbwt::pfp::ParserIntegers::init(const Params& params, const std::string& prefi
     this->out_file_prefix = prefix;
     this->out_file_name = prefix + EXT::PARSE;
     this->tmp_out_file_name = TempFile::getName("parse");
-    this->out_file.open(tmp_out_file_name, std::ios::binary);
+    this->out_sink.open(tmp_out_file_name, params.parse_memory_budget);
 }
 
 void
 vcfbwt::pfp::ParserIntegers::operator()()
 {
-    // Open input file with kseq
-    gzFile fp;
-    fp = gzopen(this->in_file_path.c_str(), "r");
-    if (fp == nullptr)
-    {
-        spdlog::error("Failed to open input file {}", in_file_path);
-        exit(EXIT_FAILURE);
-    }
-
     std::vector<uint32_t> phrase;
     spdlog::info("Parsing {}", in_file_path);
 
-    // Karp Robin Hash Function for sliding window
-    Mersenne_KarpRabinHash4 kr_hash(this->params.w * 4);
-
     // First sequence start with one dollar
     phrase.emplace_back(DOLLAR);
 
-    uint32_t c;
-    while(gzread(fp, &c, 4) > 0)
+    Metrics::Worker metrics; metrics.name = "main";
+    double start_time = Metrics::wall_time();
+    
+    std::vector<uint32_t> block(MEGABYTE);
+    auto parse_integers_block = [&](std::size_t length)
+    {
+        metrics.bases += length;
+        for (std::size_t i = 0; i < length; i++) { block[i] += this->params.integers_shift; }
+        
+        parse_block(block.data(), length, phrase, this->params, [&](const std::vector<uint32_t>& closed_phrase, std::size_t)
+        {
+            hash_type hash = this->dictionary.check_and_add(closed_phrase);
+            
+            out_sink.write(hash); this->parse_size += 1;
+        });
+    };
+    
+    std::ifstream in_stream(this->in_file_path);
+    if (not in_stream.is_open()) { spdlog::error("Failed to open input file {}", in_file_path); std::exit(EXIT_FAILURE); }
+    bool gzipped = is_gzipped(in_stream);
+    in_stream.close();
+    
+    if (not gzipped)
     {
-        phrase.push_back(c + this->params.integers_shift);
-        if (phrase.size() == params.w) { kr_hash.initialize((unsigned char*) phrase.data(), phrase.size() * sizeof(uint32_t)); }
-        else if (phrase.size() > params.w)
+        // Read from the mapped file, no copies through stream buffers
+        mio::mmap_source in_map;
+        map_file(this->in_file_path, in_map, true);
+        
+        if ((in_map.size() % sizeof(uint32_t)) != 0)
         {
-            kr_hash.update((const vcfbwt::char_type*)&(phrase[phrase.size() - params.w - 1]), (const vcfbwt::char_type*) &phrase[phrase.size() - 1]);
+            spdlog::error("{} is truncated, its size ({} bytes) is not a multiple of {} bytes", in_file_path, in_map.size(), sizeof(uint32_t));
+            std::exit(EXIT_FAILURE);
         }
-
-        if ((phrase.size() > this->params.w) and ((kr_hash.get_hash() % this->params.p) == 0))
+        
+        const uint32_t* integers = reinterpret_cast<const uint32_t*>(in_map.data());
+        std::size_t integers_size = in_map.size() / sizeof(uint32_t);
+        for (std::size_t block_start = 0; block_start < integers_size; block_start += block.size())
         {
-            hash_type hash = this->dictionary.check_and_add(phrase);
-            
-            out_file.write((char*) (&hash), sizeof(hash_type)); this->parse_size += 1;
-
-            phrase.erase(phrase.begin(), phrase.end() - this->params.w); // Keep the last w chars
-
-            kr_hash.reset(); kr_hash.initialize((unsigned char*) phrase.data(), phrase.size() * sizeof(uint32_t));
+            std::size_t block_length = std::min(block.size(), integers_size - block_start);
+            std::copy(integers + block_start, integers + block_start + block_length, block.begin());
+            parse_integers_block(block_length);
+        }
+    }
+    else
+    {
+        gzFile fp;
+        fp = gzopen(this->in_file_path.c_str(), "r");
+        if (fp == nullptr)
+        {
+            spdlog::error("Failed to open input file {}", in_file_path);
+            exit(EXIT_FAILURE);
+        }
+        DiskReads::update(this->in_file_path);
+        
+        std::size_t read_bytes_total = 0;
+        int read_bytes;
+        while((read_bytes = gzread(fp, block.data(), block.size() * sizeof(uint32_t))) > 0)
+        {
+            read_bytes_total += read_bytes;
+            if ((read_bytes % sizeof(uint32_t)) != 0)
+            {
+                spdlog::error("{} is truncated, its uncompressed size ({} bytes) is not a multiple of {} bytes", in_file_path, read_bytes_total, sizeof(uint32_t));
+                std::exit(EXIT_FAILURE);
+            }
+            parse_integers_block(read_bytes / sizeof(uint32_t));
         }
+        
+        gzclose(fp);
     }
 
     // Last phrase
@@ -694,11 +1183,12 @@ vcfbwt::pfp::ParserIntegers::operator()()
 
         hash_type hash = this->dictionary.check_and_add(phrase);
 
-        out_file.write((char*) (&hash), sizeof(hash_type)); this->parse_size += 1;
+        out_sink.write(hash); this->parse_size += 1;
     }
     else { spdlog::error("A sequence doesn't have w DOLLAR at the end!"); std::exit(EXIT_FAILURE); }
-
-    gzclose(fp);
+    
+    metrics.phrases = this->parse_size; metrics.seconds = Metrics::wall_time() - start_time;
+    Metrics::add_worker(metrics);
 }
 
 
@@ -707,34 +1197,39 @@ vcfbwt::pfp::ParserIntegers::close()
 {
     if (closed) return; closed = true;
 
-    vcfbwt::DiskWrites::update(out_file.tellp()); // Disk Stats
-    this->out_file.close();
+    this->out_sink.close();
+    vcfbwt::DiskWrites::update(out_sink.disk_bytes()); // Disk Stats
+
+    spdlog::info("Main parser: Sorting the dictionary.");
+    Metrics::Phase sort_phase("sort dictionary");
+    this->dictionary.sort(this->params.threads);
+    sort_phase.stop();
 
     spdlog::info("Main parser: Replacing hash values with ranks.");
     
     // mmap file and substitute
+    Metrics::Phase ranks_phase("rank substitution");
     if (this->parse_size != 0)
     {
         std::ofstream out_ranks(this->out_file_name);
         if (not out_ranks.is_open()) { spdlog::error("Can't open {}", this->out_file_name); std::exit(EXIT_FAILURE); }
     
-        std::ifstream in_hash(tmp_out_file_name);
-        if (not in_hash.is_open()) { spdlog::error("Can't open {}", tmp_out_file_name); std::exit(EXIT_FAILURE); }
+        const hash_type* hashes = this->out_sink.data();
     
         for (std::size_t i = 0; i < this->parse_size; i++)
         {
-            hash_type hash;
-            in_hash.read((char*) &hash, sizeof(hash_type));
-            size_type rank = this->dictionary.hash_to_rank(hash);
+            size_type rank = this->dictionary.hash_to_rank(hashes[i]);
             out_ranks.write((char*) &rank, sizeof(size_type));
         }
-        in_hash.close();
+        this->out_sink.release();
         vcfbwt::DiskWrites::update(out_ranks.tellp());
         out_ranks.close();
     }
+    ranks_phase.stop();
 
     // Print dicitionary on disk
     spdlog::info("Main parser: writing dictionary on disk NOT COMPRESSED");
+    Metrics::Phase dictionary_phase("write dictionary");
     std::string dict_file_name = out_file_prefix + EXT::DICT;
     std::ofstream dict(dict_file_name);
 
@@ -749,6 +1244,10 @@ vcfbwt::pfp::ParserIntegers::close()
 
     vcfbwt::DiskWrites::update(dict.tellp()); // Disk Stats
     dict.close();
+    dictionary_phase.stop();
+    
+    if (this->params.compact_parse and (this->parse_size != 0))
+    { pack_parse(this->out_file_name, this->dictionary.size(), this->params.threads); }
     
     vcfbwt::pfp::PropertiesWriter<uint32_t> properties_out(this->out_file_prefix, this->params);
     properties_out.write();
@@ -756,4 +1255,63 @@ vcfbwt::pfp::ParserIntegers::close()
     spdlog::info("Main parser: closed");
 }
 
-//------------------------------------------------------------------------------
\ No newline at end of file
+//------------------------------------------------------------------------------
+void
+vcfbwt::pfp::pack_parse(const std::string& parse_file_name, std::size_t dictionary_size, std::size_t threads)
+{
+    Metrics::Phase phase("pack parse");
+    
+    std::size_t bits = 1;
+    while ((bits < 64) and ((dictionary_size >> bits) != 0)) { bits++; }
+    
+    std::string tmp_file_name = parse_file_name + ".packed";
+    {
+        ParseView flat(parse_file_name);
+        if (flat.packed()) { return; }
+        
+        PackedParseHeader header;
+        std::memcpy(header.magic, "PFPPACK\0", sizeof(header.magic));
+        header.bits = bits; header.length = flat.size();
+        std::size_t words_size = ((header.length * bits + 63) / 64) + 1;
+        std::size_t file_size = sizeof(PackedParseHeader) + words_size * sizeof(uint64_t);
+        
+        std::ofstream packed(tmp_file_name, std::ios_base::binary);
+        if (not packed.is_open()) { spdlog::error("Can't open {}", tmp_file_name); std::exit(EXIT_FAILURE); }
+        packed.write((char*) &header, sizeof(PackedParseHeader));
+        packed.close();
+        vcfbwt::truncate_file(tmp_file_name, file_size);
+        
+        mio::mmap_sink out_parse;
+        std::error_code error;
+        out_parse.map(tmp_file_name, error);
+        if (error) { spdlog::error("Can't map {}: {}", tmp_file_name, error.message()); std::exit(EXIT_FAILURE); }
+        uint64_t* words = reinterpret_cast<uint64_t*>(out_parse.data() + sizeof(PackedParseHeader));
+        
+        // 64 ranks fill exactly bits words, so blocks of 64 ranks are packed in parallel
+        std::size_t blocks = (header.length + 63) / 64;
+        #pragma omp parallel for schedule(static) num_threads(threads)
+        for (std::size_t b = 0; b < blocks; b++)
+        {
+            uint64_t* block = words + b * bits;
+            for (std::size_t i = b * 64; i < std::min<std::size_t>(header.length, (b + 1) * 64); i++)
+            {
+                uint64_t rank = flat[i];
+                if (rank > dictionary_size)
+                { spdlog::error("Rank {} of {} out of a dictionary of {} phrases", rank, parse_file_name, dictionary_size); std::exit(EXIT_FAILURE); }
+                
+                std::size_t bit = (i - (b * 64)) * bits, offset = bit & 63;
+                block[bit >> 6] |= rank << offset;
+                if (offset + bits > 64) { block[(bit >> 6) + 1] |= rank >> (64 - offset); }
+            }
+        }
+        
+        out_parse.unmap();
+        vcfbwt::DiskWrites::update(file_size); // Disk Stats
+    }
+    
+    if (std::rename(tmp_file_name.c_str(), parse_file_name.c_str()) != 0)
+    { spdlog::error("Can't replace {} with {}", parse_file_name, tmp_file_name); std::exit(EXIT_FAILURE); }
+    spdlog::info("Parse packed with {} bits per rank", bits);
+}
+
+//------------------------------------------------------------------------------
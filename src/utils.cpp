@@ -5,6 +5,10 @@
 // Licensed under the GNU license. See LICENSE file in the repository root for full license information.
 
 
+#include <chrono>
+#include <iomanip>
+#include <sys/resource.h>
+
 #include <utils.hpp>
 
 //------------------------------------------------------------------------------
@@ -258,6 +262,95 @@ vcfbwt::Mersenne_KarpRabinHash4::string_hash(const char_type* data, std::size_t
 
 //------------------------------------------------------------------------------
 
+namespace
+{
+
+void kr_initialize(vcfbwt::Mersenne_KarpRabinHash& kr, const vcfbwt::char_type* window, std::size_t w)
+{ kr.initialize(window, w); }
+
+void kr_initialize(vcfbwt::Mersenne_KarpRabinHash4& kr, const uint32_t* window, std::size_t w)
+{ kr.initialize((const vcfbwt::char_type*) window, w * sizeof(uint32_t)); }
+
+void kr_update(vcfbwt::Mersenne_KarpRabinHash& kr, const vcfbwt::char_type* char_out, const vcfbwt::char_type* char_in)
+{ kr.update(*char_out, *char_in); }
+
+void kr_update(vcfbwt::Mersenne_KarpRabinHash4& kr, const uint32_t* chars_out, const uint32_t* chars_in)
+{ kr.update((const vcfbwt::char_type*) chars_out, (const vcfbwt::char_type*) chars_in); }
+
+template <typename data_type, typename kr_type>
+void
+find_trigger_strings_lanes(const data_type* text, std::size_t length, std::size_t first, std::size_t w, std::size_t p,
+                           std::size_t window_length, std::vector<std::size_t>& triggers)
+{
+    constexpr std::size_t lanes = 4;
+    constexpr std::size_t min_lane_length = 1024;
+    
+    first = std::max(first, w - 1);
+    if (first >= length) { return; }
+    
+    std::size_t lane_length = (length - first) / lanes;
+    if (lane_length < min_lane_length) { lane_length = 0; }
+    
+    // Each lane starts from its own window, the hash is a function of the window only so
+    // the values are the same the scalar rolling hash would compute
+    if (lane_length != 0)
+    {
+        std::vector<kr_type> kr_hashes(lanes, kr_type(window_length));
+        std::vector<std::size_t> lanes_triggers[lanes];
+        for (std::size_t l = 0; l < lanes; l++)
+        {
+            std::size_t lane_start = first + l * lane_length;
+            kr_initialize(kr_hashes[l], text + lane_start - w + 1, w);
+            if ((kr_hashes[l].get_hash() % p) == 0) { lanes_triggers[l].push_back(lane_start); }
+        }
+        
+        for (std::size_t i = 1; i < lane_length; i++)
+        {
+            for (std::size_t l = 0; l < lanes; l++)
+            {
+                std::size_t pos = first + l * lane_length + i;
+                kr_update(kr_hashes[l], text + pos - w, text + pos);
+                if ((kr_hashes[l].get_hash() % p) == 0) { lanes_triggers[l].push_back(pos); }
+            }
+        }
+        
+        for (std::size_t l = 0; l < lanes; l++)
+        { triggers.insert(triggers.end(), lanes_triggers[l].begin(), lanes_triggers[l].end()); }
+    }
+    
+    // What is left, one lane
+    std::size_t tail_start = first + lanes * lane_length;
+    if (tail_start < length)
+    {
+        kr_type kr_hash(window_length);
+        kr_initialize(kr_hash, text + tail_start - w + 1, w);
+        if ((kr_hash.get_hash() % p) == 0) { triggers.push_back(tail_start); }
+        for (std::size_t pos = tail_start + 1; pos < length; pos++)
+        {
+            kr_update(kr_hash, text + pos - w, text + pos);
+            if ((kr_hash.get_hash() % p) == 0) { triggers.push_back(pos); }
+        }
+    }
+}
+
+}
+
+void
+vcfbwt::find_trigger_strings(const char_type* text, std::size_t length, std::size_t first,
+                             std::size_t w, std::size_t p, std::vector<std::size_t>& triggers)
+{
+    find_trigger_strings_lanes<char_type, Mersenne_KarpRabinHash>(text, length, first, w, p, w, triggers);
+}
+
+void
+vcfbwt::find_trigger_strings(const uint32_t* text, std::size_t length, std::size_t first,
+                             std::size_t w, std::size_t p, std::vector<std::size_t>& triggers)
+{
+    find_trigger_strings_lanes<uint32_t, Mersenne_KarpRabinHash4>(text, length, first, w, p, w * sizeof(uint32_t), triggers);
+}
+
+//------------------------------------------------------------------------------
+
 const std::string vcfbwt::TempFile::DEFAULT_TEMP_DIR = ".";
 std::string vcfbwt::TempFile::temp_dir = vcfbwt::TempFile::DEFAULT_TEMP_DIR;
 
@@ -328,6 +421,8 @@ vcfbwt::TempFile::remove(std::string& filename)
 //------------------------------------------------------------------------------
 
 #include <unistd.h>
+#include <sys/stat.h>
+#include <sys/mman.h>
 void
 vcfbwt::truncate_file(std::string file_name, std::size_t new_size_in_bytes)
 {
@@ -335,6 +430,23 @@ vcfbwt::truncate_file(std::string file_name, std::size_t new_size_in_bytes)
     if (res != 0) { spdlog::error("Error while truncating {} to {} bytes", file_name, new_size_in_bytes); }
 }
 
+void
+vcfbwt::map_file(const std::string& file_name, mio::mmap_source& mapped, bool sequential)
+{
+    struct stat file_stat;
+    if (stat(file_name.c_str(), &file_stat) != 0) { spdlog::error("Can't open {}", file_name); std::exit(EXIT_FAILURE); }
+    
+    mapped.unmap();
+    if (file_stat.st_size == 0) { return; }
+    
+    std::error_code error;
+    mapped.map(file_name, error);
+    if (error) { spdlog::error("Can't map {}: {}", file_name, error.message()); std::exit(EXIT_FAILURE); }
+    DiskReads::update(file_stat.st_size);
+    
+    if (sequential) { posix_madvise((void*) mapped.data(), mapped.mapped_length(), POSIX_MADV_SEQUENTIAL); }
+}
+
 bool
 vcfbwt::is_gzipped(std::ifstream& in)
 {
@@ -368,3 +480,198 @@ void vcfbwt::DiskWrites::update(std::size_t num_of_bytes)
 }
 
 //------------------------------------------------------------------------------
+
+namespace
+{
+
+std::atomic<std::size_t> disk_bytes_read(0);
+
+}
+
+void vcfbwt::DiskReads::update(std::size_t num_of_bytes)
+{
+    disk_bytes_read += num_of_bytes;
+}
+
+void vcfbwt::DiskReads::update(const std::string& file_name)
+{
+    struct stat file_stat;
+    if (stat(file_name.c_str(), &file_stat) == 0) { update(file_stat.st_size); }
+}
+
+//------------------------------------------------------------------------------
+
+namespace
+{
+
+struct MetricsRegistry
+{
+    struct PhaseRecord
+    {
+        std::string name;
+        double wall_seconds = 0.0;
+        double cpu_seconds = 0.0;
+        std::size_t bytes_read = 0;
+        std::size_t bytes_written = 0;
+        std::size_t peak_rss = 0;
+    };
+    
+    std::mutex metrics_lock;
+    std::vector<PhaseRecord> phases;
+    std::vector<vcfbwt::Metrics::Worker> workers;
+    std::atomic<std::size_t> lock_wait_nanoseconds;
+    double wall_start;
+    
+    MetricsRegistry() : lock_wait_nanoseconds(0), wall_start(vcfbwt::Metrics::wall_time()) {}
+    
+    PhaseRecord& phase(const std::string& name)
+    {
+        for (auto& record : phases) { if (record.name == name) { return record; } }
+        PhaseRecord record; record.name = name;
+        phases.push_back(record);
+        return phases.back();
+    }
+} metrics_registry;
+
+double cpu_time()
+{
+    struct rusage usage;
+    getrusage(RUSAGE_SELF, &usage);
+    return usage.ru_utime.tv_sec + usage.ru_stime.tv_sec + (usage.ru_utime.tv_usec + usage.ru_stime.tv_usec) / vcfbwt::MILLION_DOUBLE;
+}
+
+std::size_t peak_rss()
+{
+    struct rusage usage;
+    getrusage(RUSAGE_SELF, &usage);
+#ifdef __APPLE__
+    return std::size_t(usage.ru_maxrss); // bytes on macOS
+#else
+    return std::size_t(usage.ru_maxrss) * vcfbwt::KILOBYTE; // kilobytes on Linux
+#endif
+}
+
+std::size_t bytes_written()
+{
+    std::lock_guard<std::mutex> lock_guard(writes_counter.write_stats_lock);
+    return writes_counter.bytes_wrote;
+}
+
+std::string json_string(const std::string& s)
+{
+    std::string out = "\"";
+    for (char c : s)
+    {
+        if (c == '"' or c == '\\') { out += '\\'; out += c; }
+        else if ((unsigned char) c < 0x20)
+        {
+            char escaped[8]; std::snprintf(escaped, sizeof(escaped), "\\u%04x", c);
+            out += escaped;
+        }
+        else { out += c; }
+    }
+    return out + "\"";
+}
+
+}
+
+double
+vcfbwt::Metrics::wall_time()
+{
+    return std::chrono::duration<double>(std::chrono::steady_clock::now().time_since_epoch()).count();
+}
+
+vcfbwt::Metrics::Phase::Phase(const std::string& name) : name(name), running(true)
+{
+    this->wall_start = wall_time(); this->cpu_start = cpu_time();
+    this->read_start = disk_bytes_read.load(); this->written_start = bytes_written();
+    
+    // Register the phase in the order it starts
+    std::lock_guard<std::mutex> lock_guard(metrics_registry.metrics_lock);
+    metrics_registry.phase(name);
+}
+
+void
+vcfbwt::Metrics::Phase::stop()
+{
+    if (not this->running) { return; } this->running = false;
+    
+    double wall = wall_time() - this->wall_start, cpu = cpu_time() - this->cpu_start;
+    std::size_t read = disk_bytes_read.load() - this->read_start, written = bytes_written() - this->written_start;
+    std::size_t rss = peak_rss();
+    
+    std::lock_guard<std::mutex> lock_guard(metrics_registry.metrics_lock);
+    MetricsRegistry::PhaseRecord& record = metrics_registry.phase(this->name);
+    record.wall_seconds += wall; record.cpu_seconds += cpu;
+    record.bytes_read += read; record.bytes_written += written;
+    record.peak_rss = std::max(record.peak_rss, rss);
+}
+
+void
+vcfbwt::Metrics::add_worker(const Worker& worker)
+{
+    std::lock_guard<std::mutex> lock_guard(metrics_registry.metrics_lock);
+    metrics_registry.workers.push_back(worker);
+}
+
+void
+vcfbwt::Metrics::add_lock_wait(double seconds)
+{
+    // Called by threads waiting on a lock, not worth another lock
+    metrics_registry.lock_wait_nanoseconds += std::size_t(seconds * 1e9);
+}
+
+void
+vcfbwt::Metrics::write(const std::string& file_name, const std::string& tool, std::size_t threads)
+{
+    double wall = wall_time() - metrics_registry.wall_start, cpu = cpu_time();
+    std::size_t read = disk_bytes_read.load(), written = bytes_written(), rss = peak_rss();
+    
+    std::ofstream out(file_name);
+    if (not out.is_open()) { spdlog::error("Can't open {}", file_name); return; }
+    out << std::fixed << std::setprecision(6);
+    
+    std::lock_guard<std::mutex> lock_guard(metrics_registry.metrics_lock);
+    out << "{\n";
+    out << "  \"tool\": " << json_string(tool) << ",\n";
+    out << "  \"threads\": " << threads << ",\n";
+    out << "  \"wall_seconds\": " << wall << ",\n";
+    out << "  \"cpu_seconds\": " << cpu << ",\n";
+    out << "  \"peak_rss_bytes\": " << rss << ",\n";
+    out << "  \"bytes_read\": " << read << ",\n";
+    out << "  \"bytes_written\": " << written << ",\n";
+    out << "  \"dictionary_lock_wait_seconds\": " << (metrics_registry.lock_wait_nanoseconds.load() / 1e9) << ",\n";
+    
+    out << "  \"phases\": [";
+    for (std::size_t i = 0; i < metrics_registry.phases.size(); i++)
+    {
+        const MetricsRegistry::PhaseRecord& phase = metrics_registry.phases[i];
+        out << ((i == 0) ? "\n" : ",\n");
+        out << "    { \"name\": " << json_string(phase.name)
+            << ", \"wall_seconds\": " << phase.wall_seconds
+            << ", \"cpu_seconds\": " << phase.cpu_seconds
+            << ", \"bytes_read\": " << phase.bytes_read
+            << ", \"bytes_written\": " << phase.bytes_written
+            << ", \"peak_rss_bytes\": " << phase.peak_rss << " }";
+    }
+    out << (metrics_registry.phases.empty() ? "],\n" : "\n  ],\n");
+    
+    out << "  \"workers\": [";
+    for (std::size_t i = 0; i < metrics_registry.workers.size(); i++)
+    {
+        const Worker& worker = metrics_registry.workers[i];
+        double throughput = (worker.seconds > 0.0) ? (worker.bases / worker.seconds) : 0.0;
+        out << ((i == 0) ? "\n" : ",\n");
+        out << "    { \"name\": " << json_string(worker.name)
+            << ", \"bases\": " << worker.bases
+            << ", \"phrases\": " << worker.phrases
+            << ", \"wall_seconds\": " << worker.seconds
+            << ", \"bases_per_second\": " << throughput << " }";
+    }
+    out << (metrics_registry.workers.empty() ? "]\n" : "\n  ]\n");
+    out << "}" << std::endl;
+    
+    spdlog::info("Metrics written to {}", file_name);
+}
+
+//------------------------------------------------------------------------------
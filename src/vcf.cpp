@@ -8,8 +8,132 @@
 #include <pfp_algo.hpp>
 
 const std::string vcfbwt::VCF::vcf_freq = "AF";
+constexpr std::size_t vcfbwt::Sample::ploidy;
+constexpr std::size_t vcfbwt::Sample::max_allele;
+constexpr uint32_t vcfbwt::VCF::no_variation;
 
 
+//------------------------------------------------------------------------------
+
+constexpr uint64_t vcfbwt::Variations::single_bases;
+
+void
+vcfbwt::Variations::push_back(const Variation& variation)
+{
+    if (variation.ref_len > std::numeric_limits<uint32_t>::max() or variation.alt.size() > std::numeric_limits<uint16_t>::max())
+    { spdlog::error("vcfbwt::Variations::push_back: variation at {} too large", variation.pos); std::exit(EXIT_FAILURE); }
+    
+    pos_.push_back(variation.pos);
+    ref_len_.push_back(uint32_t(variation.ref_len));
+    n_alleles_.push_back(uint16_t(variation.alt.size()));
+    arena_offset_.push_back(arena_.size());
+    freq_.push_back(variation.freq);
+    
+    bool all_single = true;
+    for (auto& allele : variation.alt) { if (allele.size() != 1) { all_single = false; break; } }
+    
+    if (all_single)
+    {
+        ends_offset_.push_back(single_bases);
+        for (auto& allele : variation.alt) { arena_.push_back(allele[0]); }
+    }
+    else
+    {
+        ends_offset_.push_back(allele_ends_.size());
+        uint64_t end = 0;
+        for (auto& allele : variation.alt)
+        {
+            arena_.insert(arena_.end(), allele.begin(), allele.end());
+            end += allele.size();
+            if (end > std::numeric_limits<uint32_t>::max())
+            { spdlog::error("vcfbwt::Variations::push_back: alleles of variation at {} too long", variation.pos); std::exit(EXIT_FAILURE); }
+            allele_ends_.push_back(uint32_t(end));
+        }
+    }
+}
+
+void
+vcfbwt::Variations::append(Variations&& other)
+{
+    if (this->empty()) { std::swap(*this, other); other.clear(); return; }
+    
+    uint64_t arena_shift = arena_.size(), ends_shift = allele_ends_.size();
+    std::size_t first = arena_offset_.size();
+    
+    pos_.insert(pos_.end(), other.pos_.begin(), other.pos_.end());
+    ref_len_.insert(ref_len_.end(), other.ref_len_.begin(), other.ref_len_.end());
+    n_alleles_.insert(n_alleles_.end(), other.n_alleles_.begin(), other.n_alleles_.end());
+    arena_offset_.insert(arena_offset_.end(), other.arena_offset_.begin(), other.arena_offset_.end());
+    ends_offset_.insert(ends_offset_.end(), other.ends_offset_.begin(), other.ends_offset_.end());
+    allele_ends_.insert(allele_ends_.end(), other.allele_ends_.begin(), other.allele_ends_.end());
+    freq_.insert(freq_.end(), other.freq_.begin(), other.freq_.end());
+    arena_.insert(arena_.end(), other.arena_.begin(), other.arena_.end());
+    other.clear();
+    
+    for (std::size_t i = first; i < arena_offset_.size(); i++)
+    {
+        arena_offset_[i] += arena_shift;
+        if (ends_offset_[i] != single_bases) { ends_offset_[i] += ends_shift; }
+    }
+}
+
+void
+vcfbwt::Variations::clear()
+{
+    Variations empty; std::swap(*this, empty);
+}
+
+void
+vcfbwt::Variations::shrink_to_fit()
+{
+    pos_.shrink_to_fit(); ref_len_.shrink_to_fit(); n_alleles_.shrink_to_fit(); arena_offset_.shrink_to_fit();
+    ends_offset_.shrink_to_fit(); allele_ends_.shrink_to_fit(); freq_.shrink_to_fit(); arena_.shrink_to_fit();
+}
+
+std::size_t
+vcfbwt::Variations::memory_usage() const
+{
+    return pos_.capacity() * sizeof(uint64_t) + ref_len_.capacity() * sizeof(uint32_t) +
+           n_alleles_.capacity() * sizeof(uint16_t) + arena_offset_.capacity() * sizeof(uint64_t) +
+           ends_offset_.capacity() * sizeof(uint64_t) + allele_ends_.capacity() * sizeof(uint32_t) +
+           freq_.capacity() * sizeof(double) + arena_.capacity() * sizeof(char);
+}
+
+//------------------------------------------------------------------------------
+
+void
+vcfbwt::Sample::append(const Sample& other, std::size_t variation_offset)
+{
+    if (other.empty()) { return; }
+    if (variation_offset + other.variations_.back() > std::numeric_limits<uint32_t>::max())
+    { spdlog::error("vcfbwt::Sample::append: variation index {} does not fit in 32 bits", variation_offset + other.variations_.back()); std::exit(EXIT_FAILURE); }
+    if (not variations_.empty() and variation_offset + other.variations_.front() <= variations_.back())
+    { spdlog::error("vcfbwt::Sample::append: variations must be added in increasing order"); std::exit(EXIT_FAILURE); }
+    
+    std::size_t first = variations_.size();
+    variations_.insert(variations_.end(), other.variations_.begin(), other.variations_.end());
+    for (std::size_t i = first; i < variations_.size(); i++) { variations_[i] += uint32_t(variation_offset); }
+    alleles_.insert(alleles_.end(), other.alleles_.begin(), other.alleles_.end());
+}
+
+void
+vcfbwt::Sample::add_variation(std::size_t variation, const std::vector<int>& alleles)
+{
+    if (variation > std::numeric_limits<uint32_t>::max())
+    { spdlog::error("vcfbwt::Sample::add_variation: variation index {} does not fit in 32 bits", variation); std::exit(EXIT_FAILURE); }
+    if (not variations_.empty() and variation <= variations_.back())
+    { spdlog::error("vcfbwt::Sample::add_variation: variations must be added in increasing order"); std::exit(EXIT_FAILURE); }
+    
+    variations_.push_back(uint32_t(variation));
+    for (std::size_t h = 0; h < ploidy; h++)
+    {
+        int allele = (h < alleles.size()) ? alleles[h] : 0;
+        if (allele < 0 or std::size_t(allele) > max_allele)
+        { spdlog::error("vcfbwt::Sample::add_variation: allele index {} out of range", allele); std::exit(EXIT_FAILURE); }
+        alleles_.push_back(uint8_t(allele));
+    }
+}
+
 //------------------------------------------------------------------------------
 
 vcfbwt::Sample::iterator::iterator(const Sample& sample, std::size_t genotype) :
@@ -17,21 +141,24 @@ sample_(sample), genotype(genotype),
 ref_it_(0), sam_it_(0), var_it_(0), curr_var_it_(0), prev_variation_it(0),
 curr_char_(NULL), sample_length_(sample.reference_.size())
 {
+    if (genotype >= Sample::ploidy)
+    { spdlog::error("Genotype {} out of range, only {} haplotypes per sample are stored", genotype, Sample::ploidy); std::exit(EXIT_FAILURE); }
+
     // Compute sample length, might take some time
     long long int indels = 0; // could be negative, so int
-    for (std::size_t i = 0; i < this->sample_.variations.size(); i++)
+    for (std::size_t i = 0; i < this->sample_.size(); i++)
     {
-        std::size_t var_id = this->sample_.variations[i];
-        int var_genotype = this->sample_.genotypes[i].at(this->genotype);
+        std::size_t var_id = this->sample_.variation(i);
+        int var_genotype = this->sample_.genotype(i, this->genotype);
         if (var_genotype != 0)
         {
-            indels += sample_.variations_list[var_id].alt[var_genotype].size() -
-                      sample_.variations_list[var_id].ref_len;
+            indels += sample_.variations_list.alt(var_id, var_genotype).size() -
+                      sample_.variations_list.ref_len(var_id);
         }
         
     }
     sample_length_ = sample_length_ + indels;
-    while (var_it_ < sample_.variations.size() and sample_.genotypes[var_it_].at(genotype) == 0)
+    while (var_it_ < sample_.size() and sample_.genotype(var_it_, genotype) == 0)
     { var_it_++; }
     this->operator++();
 }
@@ -45,14 +172,14 @@ vcfbwt::Sample::iterator::operator*() { return *curr_char_; }
 bool
 vcfbwt::Sample::iterator::in_a_variation()
 {
-    const Variation& curr_variation = sample_.variations_list[sample_.variations[var_it_]];
+    const VariationView curr_variation = sample_.get_variation(var_it_);
     return (ref_it_ == curr_variation.pos);
 }
 
 std::size_t
 vcfbwt::Sample::iterator::next_variation() const
 {
-    if (var_it_ < sample_.variations.size()) { return sample_.get_variation(var_it_).pos; }
+    if (var_it_ < sample_.size()) { return sample_.get_variation(var_it_).pos; }
     else { return sample_.reference_.size() - 1; }
 }
 
@@ -73,9 +200,9 @@ void
 vcfbwt::Sample::iterator::operator++()
 {
     // There are variations to process
-    if (var_it_ < sample_.variations.size())
+    if (var_it_ < sample_.size())
     {
-        const Variation& curr_variation = sample_.variations_list[sample_.variations[var_it_]];
+        const VariationView curr_variation = sample_.get_variation(var_it_);
         
         if (ref_it_ < curr_variation.pos)
         {
@@ -84,7 +211,7 @@ vcfbwt::Sample::iterator::operator++()
         }
         
         // Più nucleotidi nella variaizione
-        int var_genotype = sample_.genotypes[var_it_].at(genotype);
+        int var_genotype = sample_.genotype(var_it_, genotype);
         // Handling same position insertions see bcftools consensus:
         // https://github.com/samtools/bcftools/blob/df43fd4781298e961efc951ba33fc4cdcc165a19/consensus.c#L723
         int gap = ref_it_ - curr_variation.pos;
@@ -92,9 +219,9 @@ vcfbwt::Sample::iterator::operator++()
         {
             // Check length of unchanged bases
             int start = 0;
-            int len = curr_variation.alt[var_genotype].size();
+            int len = curr_variation.alt(var_genotype).size();
             assert(len >= gap);
-            while (start < std::min(gap, len) && curr_variation.alt[var_genotype][start] == curr_variation.alt[0][start])
+            while (start < std::min(gap, len) && curr_variation.alt(var_genotype)[start] == curr_variation.alt(0)[start])
                 ++start;
             if (start < gap)
             {
@@ -108,14 +235,14 @@ vcfbwt::Sample::iterator::operator++()
         bool get_next_variant = true;
         bool iterate = false;
 
-        if (curr_var_it_ < curr_variation.alt[var_genotype].size() - 1)
+        if (curr_var_it_ < curr_variation.alt(var_genotype).size() - 1)
         {
-            curr_char_ = &curr_variation.alt[var_genotype][curr_var_it_];
+            curr_char_ = &curr_variation.alt(var_genotype)[curr_var_it_];
             curr_var_it_++;
             get_next_variant = false;
         }
-        else if (curr_var_it_ < curr_variation.alt[var_genotype].size())
-            curr_char_ = &curr_variation.alt[var_genotype].back();
+        else if (curr_var_it_ < curr_variation.alt(var_genotype).size())
+            curr_char_ = &curr_variation.alt(var_genotype).back();
         else
             iterate = true; // We evaluate the next position that might be either on the reference or another variation
 
@@ -124,7 +251,7 @@ vcfbwt::Sample::iterator::operator++()
         {
             prev_variation_it = var_it_;
             var_it_++;
-            while (var_it_ < sample_.variations.size() and sample_.genotypes[var_it_].at(genotype) == 0)
+            while (var_it_ < sample_.size() and sample_.genotype(var_it_, genotype) == 0)
             {
                 var_it_++;
             }
@@ -152,10 +279,71 @@ vcfbwt::Sample::iterator::go_to(std::size_t i)
         std::exit(EXIT_FAILURE);
     }
     
-    // Not an efficient implementation, TODO: make it more efficient
+    // Reference stretches are skipped in constant time, variations in between are still processed by
+    // operator++ to keep the handling of overlapping variations
     while (ref_it_ < i)
     {
-        this->operator++();
+        std::size_t stretch_end = i;
+        if (var_it_ < sample_.size())
+        {
+            std::size_t next_variation_pos = sample_.get_variation(var_it_).pos;
+            if (ref_it_ >= next_variation_pos) { this->operator++(); continue; }
+            stretch_end = std::min(stretch_end, next_variation_pos);
+        }
+        
+        // same as calling operator++ (stretch_end - ref_it_) times on the reference
+        sam_it_ += stretch_end - ref_it_;
+        ref_it_ = stretch_end;
+        curr_char_ = &(sample_.reference_[ref_it_ - 1]);
+    }
+}
+
+bool
+vcfbwt::Sample::iterator::in_reference() const
+{
+    const char* reference_begin = sample_.reference_.data();
+    return (curr_char_ >= reference_begin) and (curr_char_ < reference_begin + sample_.reference_.size());
+}
+
+std::size_t
+vcfbwt::Sample::iterator::reference_stretch() const
+{
+    // Reference characters that follow the current one before the next variation
+    std::size_t stretch_end = sample_.reference_.size();
+    if (var_it_ < sample_.size()) { stretch_end = sample_.get_variation(var_it_).pos; }
+    return (ref_it_ < stretch_end) ? (stretch_end - ref_it_) : 0;
+}
+
+vcfbwt::Sample::iterator::Run
+vcfbwt::Sample::iterator::current_run() const
+{
+    Run run = { curr_char_, 1 };
+    if (ref_it_ > sample_.reference_.size()) { return run; }
+    
+    if (in_reference()) { run.size += reference_stretch(); }
+    else if (var_it_ < sample_.size())
+    {
+        // curr_char_ points inside the alt allele of the variation being processed, the rest of it follows
+        AlleleView alt = sample_.get_variation(var_it_).alt(sample_.genotype(var_it_, genotype));
+        const char* alt_begin = alt.data();
+        if ((curr_char_ >= alt_begin) and (curr_char_ < alt_begin + alt.size())) { run.size = alt_begin + alt.size() - curr_char_; }
+    }
+    return run;
+}
+
+void
+vcfbwt::Sample::iterator::advance(std::size_t n)
+{
+    while (n > 0)
+    {
+        if (in_reference())
+        {
+            std::size_t step = std::min(n, reference_stretch());
+            ref_it_ += step; sam_it_ += step; curr_char_ += step;
+            n -= step;
+            if (n == 0) { break; }
+        }
+        this->operator++(); n--;
     }
 }
 
@@ -190,6 +378,7 @@ vcfbwt::VCF::init_ref(const std::string& ref_path, bool last)
     
     gzFile fp; kseq_t *record;
     fp = gzopen(ref_path.c_str(), "r");
+    DiskReads::update(ref_path);
     if (fp == 0)
     {
         spdlog::error("Error: failed to open reference FASTA file {}", ref_path);
@@ -216,7 +405,281 @@ vcfbwt::VCF::init_ref(const std::string& ref_path, bool last)
 //------------------------------------------------------------------------------
 
 void
-vcfbwt::VCF::init_vcf(const std::string& vcf_path, std::vector<Variation>& l_variations,
+vcfbwt::VCF::decode_record(const bcf_hdr_t* hdr, bcf1_t* rec, std::size_t offset, int32_t** gt_arr, int* ngt_arr, Record& record)
+{
+    record.variation.ref_len = rec->rlen;
+    record.variation.pos = rec->pos + offset;
+    record.variation.freq = 0;
+    record.variation.used = false;
+    record.variation.alt.clear();
+    record.pos = rec->pos;
+    record.rlen = rec->rlen;
+    record.max_ploidy = 0;
+    record.trim_beg.assign(rec->n_allele, 0);
+    record.var_len.assign(rec->n_allele, 0);
+    record.calls.clear();
+    
+    // get all alternate alleles
+    bcf_unpack(rec, BCF_UN_ALL);
+    
+    for (int allele_idx = 0; allele_idx < rec->n_allele; allele_idx++)
+    {
+        record.variation.alt.push_back(rec->d.allele[allele_idx]);
+        
+        // Determine if overlap. Logic copied from leviosam's:
+        // https://github.com/alshai/levioSAM/blob/f72d84ad1141c84e4b315c0dc5d705d2c0d5b936/src/leviosam.hpp#L530
+        // copied from bcftools consensus`:
+        // https://github.com/samtools/bcftools/blob/df43fd4781298e961efc951ba33fc4cdcc165a19/consensus.c#L579
+        
+        // For some variant types POS+REF refer to the base *before* the event; in such case set trim_beg
+        int var_type = bcf_get_variant_type(rec, allele_idx);
+        record.var_len[allele_idx] = rec->d.var[allele_idx].n;
+        if ( var_type & VCF_INDEL ) { record.trim_beg[allele_idx] = 1; }
+        else if ( (var_type & VCF_OTHER) && !strcasecmp(rec->d.allele[allele_idx],"<DEL>") )
+        {
+            record.trim_beg[allele_idx] = 1;
+            record.var_len[allele_idx] = 1 - rec->rlen;
+        }
+        else if ( (var_type & VCF_OTHER) && !strncasecmp(rec->d.allele[allele_idx],"<INS",4) )
+        {
+            record.trim_beg[allele_idx] = 1;
+        }
+    }
+    
+    int ngt = bcf_get_genotypes(hdr, rec, gt_arr, ngt_arr);
+    if ( ngt <= 0 ) { return; }
+    
+    std::size_t n_samples = bcf_hdr_nsamples(hdr);
+    record.max_ploidy = ngt / n_samples;
+    for (std::size_t i_s = 0; i_s < n_samples; i_s++)
+    {
+        int32_t *ptr = *gt_arr + i_s * record.max_ploidy;
+        for (int j = 0; j < record.max_ploidy; j++)
+        {
+            // if true, the sample has smaller ploidy
+            if ( ptr[j]==bcf_int32_vector_end ) { break; }
+            
+            // missing allele
+            if ( bcf_gt_is_missing(ptr[j]) ) { continue; }
+            
+            // the VCF 0-based allele index
+            int allele_index = bcf_gt_allele(ptr[j]);
+            if (allele_index) { record.calls.push_back({ uint32_t(i_s), uint16_t(j), uint16_t(allele_index) }); }
+        }
+    }
+}
+
+//------------------------------------------------------------------------------
+
+std::size_t
+vcfbwt::VCF::apply_calls(const Record& record, std::size_t c, OverlapState& state, bool& alt_alleles_set, bool& skip)
+{
+    const Variation& var = record.variation;
+    std::size_t i_s = record.calls[c].sample;
+    std::fill(state.alleles_idx.begin(), state.alleles_idx.end(), 0);
+    alt_alleles_set = false;
+    for (; c < record.calls.size() and record.calls[c].sample == i_s; c++)
+    {
+        int j = record.calls[c].haplotype;
+        int allele_index = record.calls[c].allele;
+        
+        if (record.pos <= state.tppos[j][i_s])
+        {
+            int overlap = 0;
+            if ( record.pos < state.tppos[j][i_s] || !record.trim_beg[allele_index] ||
+                 record.var_len[allele_index]==0 || state.prev_is_ins[j][i_s] ) { overlap = 1; }
+            if (overlap)
+            {
+                spdlog::debug("vcfbwt::VCF::init_vcf: Skipping overlapping variantat sample {} in pos {}", i_s, var.pos);
+                continue;
+            }
+        }
+        
+        // Skip symbolic allele
+        if (var.alt[allele_index][0] == '<')
+        {
+            spdlog::debug("vcfbwt::VCF::init_vcf: Skipping symbolic allele at pos {}", var.pos);
+            skip = true;
+            continue;
+        }
+        // Update tppos and prev_is_ins
+        state.tppos[j][i_s] = record.pos + record.rlen - 1;
+        state.prev_is_ins[j][i_s] = (var.alt[0].size() < var.alt[allele_index].size());
+        
+        state.alleles_idx[j] = allele_index;
+        alt_alleles_set = true;
+    }
+    return c;
+}
+
+void
+vcfbwt::VCF::check_reference(const Record& record, const std::string& vcf_path) const
+{
+    // check if reference allele matches our reference in used variations
+    const Variation& var = record.variation;
+    for (std::size_t pos = 0; pos < var.ref_len; pos++)
+    {
+        if (pos >= var.alt[0].size() or var.alt[0][pos] != this->reference[var.pos + pos])
+        {
+            spdlog::warn("[{}] Variation {} does not match reference allele. VAR: {} REF: {}",
+                         vcf_path,
+                         record.pos,
+                         pos < var.alt[0].size() ? var.alt[0][pos] : ' ',
+                         this->reference[var.pos + pos]);
+            std::exit(EXIT_FAILURE);
+        }
+    }
+}
+
+void
+vcfbwt::VCF::add_record(Record& record, OverlapState& state, const std::vector<long long int>& targets,
+                        Variations& l_variations, std::vector<Sample>& l_samples, const std::string& vcf_path)
+{
+    Variation& var = record.variation;
+    state.fit(record.max_ploidy, targets.size());
+    
+    // Calls come grouped by sample, in header order. A symbolic allele ends the record after the calls of its sample
+    bool skip_this_variation = false;
+    std::size_t c = 0;
+    while (c < record.calls.size() and not skip_this_variation)
+    {
+        std::size_t i_s = record.calls[c].sample;
+        bool alt_alleles_set = false;
+        c = apply_calls(record, c, state, alt_alleles_set, skip_this_variation);
+        
+        // Process only wanted l_samples
+        if (alt_alleles_set and targets[i_s] >= 0)
+        {
+            // Update frequency, to be normalized by the number of samples when parsing ends
+            var.freq += 1;
+            var.used = true;
+            // Add variation to sample, size() because we have not added the variations to the list yet
+            l_samples[targets[i_s]].add_variation(l_variations.size(), state.alleles_idx);
+        }
+    }
+    
+    if (var.used)
+    {
+        l_variations.push_back(var);
+        check_reference(record, vcf_path);
+    }
+}
+
+//------------------------------------------------------------------------------
+
+bool
+vcfbwt::VCF::init_vcf_regions(const std::string& vcf_path, std::size_t offset, std::size_t length, const std::string& subset,
+                              const std::vector<long long int>& targets, OverlapState& state,
+                              Variations& l_variations, std::vector<Sample>& l_samples)
+{
+    // Look for an index listing a single contig, the whole file maps on one reference
+    htsFile * inf = bcf_open(vcf_path.c_str(), "r");
+    if (inf == NULL) { spdlog::error("Can't open vcf file: {}", vcf_path); std::exit(EXIT_FAILURE); }
+    bool is_bcf = hts_get_format(inf)->format == bcf;
+    bcf_hdr_t *hdr = bcf_hdr_read(inf);
+    
+    int n_contigs = 0;
+    const char** contigs = NULL;
+    hts_idx_t* idx = NULL; tbx_t* tbx = NULL;
+    if (is_bcf) { idx = bcf_index_load(vcf_path.c_str()); if (idx != NULL) { contigs = bcf_index_seqnames(idx, hdr, &n_contigs); } }
+    else { tbx = tbx_index_load(vcf_path.c_str()); if (tbx != NULL) { contigs = tbx_seqnames(tbx, &n_contigs); } }
+    
+    std::string contig = (n_contigs == 1) ? std::string(contigs[0]) : "";
+    free(contigs);
+    if (idx != NULL) { hts_idx_destroy(idx); }
+    if (tbx != NULL) { tbx_destroy(tbx); }
+    bcf_hdr_destroy(hdr);
+    bcf_close(inf);
+    
+    if (contig.empty())
+    {
+        spdlog::info("No index over a single contig for {}, reading it sequentially", vcf_path);
+        return false;
+    }
+    DiskReads::update(vcf_path);
+    
+    // Regions are decoded in parallel and added in order. Each record belongs to the region where it starts,
+    // records starting before a region and overlapping it are returned by the index but skipped
+    std::size_t n_regions = this->threads * 4;
+    hts_pos_t region_length = std::max<hts_pos_t>(1, (length + n_regions - 1) / n_regions);
+    spdlog::info("Parsing vcf: {} in {} regions of {} bp", vcf_path, n_regions, region_length);
+    
+    #pragma omp parallel num_threads(this->threads)
+    {
+        htsFile * t_inf = bcf_open(vcf_path.c_str(), "r");
+        if (t_inf == NULL) { spdlog::error("Can't open vcf file: {}", vcf_path); std::exit(EXIT_FAILURE); }
+        bcf_hdr_t *t_hdr = bcf_hdr_read(t_inf);
+        if ((not subset.empty()) and bcf_hdr_set_samples(t_hdr, subset.c_str(), 0) != 0)
+        { spdlog::error("Error while selecting the samples of {}", vcf_path); std::exit(EXIT_FAILURE); }
+        
+        hts_idx_t* t_idx = NULL; tbx_t* t_tbx = NULL; int tid = -1;
+        if (is_bcf) { t_idx = bcf_index_load(vcf_path.c_str()); tid = bcf_hdr_name2id(t_hdr, contig.c_str()); }
+        else { t_tbx = tbx_index_load(vcf_path.c_str()); tid = tbx_name2id(t_tbx, contig.c_str()); }
+        if ((t_idx == NULL and t_tbx == NULL) or tid < 0)
+        { spdlog::error("Error while loading the index of {}", vcf_path); std::exit(EXIT_FAILURE); }
+        
+        bcf1_t *rec = bcf_init();
+        kstring_t line = { 0, 0, NULL };
+        int32_t *gt_arr = NULL; int ngt_arr = 0;
+        std::vector<Record> records;
+        
+        #pragma omp for schedule(dynamic, 1) ordered
+        for (std::size_t r = 0; r < n_regions; r++)
+        {
+            hts_pos_t beg = r * region_length;
+            hts_pos_t end = (r == n_regions - 1) ? HTS_POS_MAX : (r + 1) * region_length;
+            
+            hts_itr_t* itr = is_bcf ? bcf_itr_queryi(t_idx, tid, beg, end) : tbx_itr_queryi(t_tbx, tid, beg, end);
+            if (itr == NULL) { spdlog::error("Error while querying {} in {}", contig, vcf_path); std::exit(EXIT_FAILURE); }
+            
+            std::size_t n_records = 0;
+            while (true)
+            {
+                int res = 0;
+                if (is_bcf)
+                {
+                    // reading through the index does not subset the samples
+                    res = bcf_itr_next(t_inf, itr, rec);
+                    if (res >= 0 and t_hdr->keep_samples != NULL) { bcf_subset_format(t_hdr, rec); }
+                }
+                else
+                {
+                    res = tbx_itr_next(t_inf, t_tbx, itr, &line);
+                    if (res >= 0 and vcf_parse(&line, t_hdr, rec) != 0)
+                    { spdlog::error("Error while parsing vcf file: {}", vcf_path); std::exit(EXIT_FAILURE); }
+                }
+                if (res < -1) { spdlog::error("Error while parsing vcf file: {}", vcf_path); std::exit(EXIT_FAILURE); }
+                if (res < 0) { break; }
+                
+                if (rec->pos < beg) { continue; }
+                if (n_records == records.size()) { records.emplace_back(); }
+                decode_record(t_hdr, rec, offset, &gt_arr, &ngt_arr, records[n_records++]);
+            }
+            hts_itr_destroy(itr);
+            
+            #pragma omp ordered
+            {
+                for (std::size_t k = 0; k < n_records; k++)
+                { add_record(records[k], state, targets, l_variations, l_samples, vcf_path); }
+            }
+        }
+        
+        free(gt_arr);
+        free(line.s);
+        bcf_destroy(rec);
+        if (t_idx != NULL) { hts_idx_destroy(t_idx); }
+        if (t_tbx != NULL) { tbx_destroy(t_tbx); }
+        bcf_hdr_destroy(t_hdr);
+        bcf_close(t_inf);
+    }
+    
+    return true;
+}
+
+//------------------------------------------------------------------------------
+
+void
+vcfbwt::VCF::init_vcf(const std::string& vcf_path, Variations& l_variations,
                       std::vector<Sample>& l_samples, std::unordered_map<std::string, std::size_t>& l_samples_id,
                       std::size_t i)
 {
@@ -227,8 +690,7 @@ vcfbwt::VCF::init_vcf(const std::string& vcf_path, std::vector<Variation>& l_var
         spdlog::error("Can't open vcf file: {}", vcf_path);
         std::exit(EXIT_FAILURE);
     }
-    
-    spdlog::info("Parsing vcf: {}", vcf_path);
+    DiskReads::update(vcf_path);
     
     // read header
     bcf_hdr_t *hdr = bcf_hdr_read(inf);
@@ -236,6 +698,23 @@ vcfbwt::VCF::init_vcf(const std::string& vcf_path, std::vector<Variation>& l_var
     // get l_samples ids from header
     std::size_t n_samples = bcf_hdr_nsamples(hdr);
     if (this->max_samples == 0) { set_max_samples(n_samples); }
+    
+    // The samples after the last wanted one can't change the wanted ones, decode only the samples up to it
+    std::string subset;
+    bool any_wanted = true;
+    if (not input_samples.empty())
+    {
+        std::size_t wanted_end = 0;
+        for (std::size_t i_s = 0; i_s < std::min(n_samples, this->max_samples); i_s++)
+        { if (input_samples.find(std::string(hdr->samples[i_s])) != input_samples.end()) { wanted_end = i_s + 1; } }
+        any_wanted = wanted_end > 0;
+        
+        if (any_wanted and wanted_end < n_samples)
+        {
+            for (std::size_t i_s = 0; i_s < wanted_end; i_s++)
+            { if (i_s != 0) { subset.push_back(','); } subset.append(hdr->samples[i_s]); }
+        }
+    }
 
     std::size_t size_before = l_samples.size();
     for (std::size_t i = 0; i < std::min(n_samples, this->max_samples); i++)
@@ -249,175 +728,82 @@ vcfbwt::VCF::init_vcf(const std::string& vcf_path, std::vector<Variation>& l_var
     }
     spdlog::debug("{} new l_samples in the vcf, tot: {}", l_samples.size() - size_before, l_samples.size());
     
-    // struct for storing each record
-    bcf1_t *rec = bcf_init();
-    if (rec == NULL)
+    if (not subset.empty())
     {
-        spdlog::error("Error while parsing vcf file: {}", vcf_path);
-        bcf_close(inf);
-        bcf_hdr_destroy(hdr);
-        std::exit(EXIT_FAILURE);
+        if (bcf_hdr_set_samples(hdr, subset.c_str(), 0) != 0)
+        { spdlog::error("Error while selecting the samples of {}", vcf_path); std::exit(EXIT_FAILURE); }
+        n_samples = bcf_hdr_nsamples(hdr);
     }
-
-    std::vector<std::vector<int>>  tppos(1, std::vector<int>(n_samples,0));
-    std::vector<std::vector<bool>> prev_is_ins(1, std::vector<bool>(n_samples,false));
     
+    // sample of l_samples receiving the calls of each sample in the header, -1 if not wanted
+    std::vector<long long int> targets(n_samples, -1);
+    for (std::size_t i_s = 0; i_s < n_samples; i_s++)
+    {
+        auto id = l_samples_id.find(std::string(hdr->samples[i_s]));
+        if ((id != l_samples_id.end() and id->second < max_samples)
+        and
+        ((input_samples.empty()) or (input_samples.find(id->first) != input_samples.end())))
+        { targets[i_s] = id->second; }
+    }
     
-    // start parsing
-    while (bcf_read(inf, hdr, rec) == 0)
+    std::size_t offset = i != 0 ? ref_sum_lengths[i-1] : 0; // when using multiple vcfs
+    OverlapState state;
+    
+    bool loaded = not any_wanted;
+    if (not loaded and this->use_index and this->threads > 1)
     {
-        vcfbwt::Variation var;
-        
-        var.ref_len = rec->rlen;
-        std::size_t offset = i != 0 ? ref_sum_lengths[i-1] : 0; // when using multiple vcfs
-        var.pos = rec->pos + offset;
-        var.freq = 0;
+        loaded = init_vcf_regions(vcf_path, offset, ref_sum_lengths[i] - offset, subset, targets, state, l_variations, l_samples);
+    }
+    
+    if (not loaded)
+    {
+        spdlog::info("Parsing vcf: {}", vcf_path);
         
-        // get all alternate alleles
-        bcf_unpack(rec, BCF_UN_ALL);
+        // BGZF decompression threads, unless the vcfs are already read in parallel
+        if (this->threads > 1 and not omp_in_parallel()) { hts_set_threads(inf, this->threads); }
         
-        int type = bcf_get_variant_types(rec);
-        for (int allele_idx = 0; allele_idx < rec->n_allele; allele_idx++)
+        // struct for storing each record
+        bcf1_t *rec = bcf_init();
+        if (rec == NULL)
         {
-            var.alt.push_back(rec->d.allele[allele_idx]);
-            var.types.push_back(rec->d.var[allele_idx].type);
+            spdlog::error("Error while parsing vcf file: {}", vcf_path);
+            bcf_close(inf);
+            bcf_hdr_destroy(hdr);
+            std::exit(EXIT_FAILURE);
         }
         
-        int32_t *gt_arr = NULL, ngt_arr = 0;
-        int ngt = bcf_get_genotypes(hdr, rec, &gt_arr, &ngt_arr);
-        if ( ngt > 0 )
+        // start parsing, the record is reused to keep the capacity of its buffers
+        Record record;
+        int32_t *gt_arr = NULL; int ngt_arr = 0;
+        while (bcf_read(inf, hdr, rec) == 0)
         {
-            int max_ploidy = ngt/n_samples;
-            while (max_ploidy > tppos.size())
-            {
-                tppos.push_back(std::vector<int>(n_samples,0));
-                prev_is_ins.push_back(std::vector<bool>(n_samples,false));
-            }
-            bool skip_this_variation = false;
-            for (std::size_t i_s = 0; i_s < n_samples; i_s++)
-            {
-                if (skip_this_variation) { break; }
-                int32_t *ptr = gt_arr + i_s * max_ploidy;
-                std::vector<int> alleles_idx(max_ploidy, 0);
-                bool alt_alleles_set = false;
-                for (int j = 0; j < max_ploidy; j++)
-                {
-                    // if true, the sample has smaller ploidy
-                    if ( ptr[j]==bcf_int32_vector_end ) { break; }
-
-                    // missing allele
-                    if ( bcf_gt_is_missing(ptr[j]) ) { continue; }
-                    
-                    if (bcf_gt_allele(ptr[j]))
-                    {
-                        // the VCF 0-based allele index
-                        int allele_index = bcf_gt_allele(ptr[j]);
-                        int var_type = bcf_get_variant_type(rec, allele_index);
-
-                        // Determine if overlap. Logic copied from leviosam's:
-                        // https://github.com/alshai/levioSAM/blob/f72d84ad1141c84e4b315c0dc5d705d2c0d5b936/src/leviosam.hpp#L530
-                        // copied from bcftools consensus`:
-                        // https://github.com/samtools/bcftools/blob/df43fd4781298e961efc951ba33fc4cdcc165a19/consensus.c#L579
-
-                        // For some variant types POS+REF refer to the base *before* the event; in such case set trim_beg
-                        int trim_beg = 0;
-                        int var_len  = rec->d.var[allele_index].n;
-                        if ( var_type & VCF_INDEL ) { trim_beg = 1; }
-                        else if ( (var_type & VCF_OTHER) && !strcasecmp(rec->d.allele[allele_index],"<DEL>") )
-                        {
-                            trim_beg = 1;
-                            var_len  = 1 - var.ref_len;
-                        }
-                        else if ( (var_type & VCF_OTHER) && !strncasecmp(rec->d.allele[allele_index],"<INS",4) )
-                        {
-                            trim_beg = 1;
-                        }
-
-                        if (rec->pos <= tppos[j][i_s])
-                        {
-                            int overlap = 0;
-                            if ( rec->pos < tppos[j][i_s] || !trim_beg || var_len==0 || prev_is_ins[j][i_s] ) { overlap = 1; }
-                            if (overlap)
-                            {
-                                spdlog::debug("vcfbwt::VCF::init_vcf: Skipping overlapping variantat sample {} in pos {}", i_s, var.pos);
-                                continue;
-                            }
-                        }
-
-                        // Skip symbolic allele
-                        if (var.alt[allele_index][0] == '<')
-                        {
-                            spdlog::debug("vcfbwt::VCF::init_vcf: Skipping symbolic allele at pos {}", var.pos);
-                            skip_this_variation = true;
-                            continue;
-                        }
-                        // Update tppos and prev_is_ins
-                        tppos[j][i_s] = rec->pos + rec->rlen - 1;
-                        prev_is_ins[j][i_s] = (var.alt[0].size() < var.alt[allele_index].size());
-
-                        alleles_idx[j] = allele_index;
-                        alt_alleles_set = true;
-                    }
-                }
-                
-                if (alt_alleles_set)
-                {
-                    auto id = l_samples_id.find(std::string(hdr->samples[i_s]));
-                    if ((id != l_samples_id.end() and id->second < max_samples)
-                    and
-                    ((input_samples.empty()) or (input_samples.find(id->first) != input_samples.end()))) // Process only wanted l_samples
-                    {
-                        // Update frequency, to be normalized by the number of samples when parsing ends
-                        var.freq += 1;
-                        var.used = true;
-                        // Add variation to sample, size() because we have not added the variations to the list yet
-                        l_samples[id->second].variations.emplace_back(l_variations.size());
-                        l_samples[id->second].genotypes.emplace_back(alleles_idx);
-                    }
-                }
-            }
-        }
-        if (var.used)
-        {
-            l_variations.push_back(var);
-    
-            // check if reference allele matches our reference in used variations
-            for (std::size_t pos = 0; pos < var.ref_len; pos++)
-            {
-                if (rec->d.allele[0][pos] != this->reference[var.pos + pos])
-                {
-                    spdlog::warn("[{}] Variation {} does not match reference allele. VAR: {} REF: {}",
-                                 vcf_path,
-                                 rec->pos,
-                                 rec->d.allele[0][pos],
-                                 this->reference[var.pos + pos]);
-                    std::exit(EXIT_FAILURE);
-                }
-            }
+            decode_record(hdr, rec, offset, &gt_arr, &ngt_arr, record);
+            add_record(record, state, targets, l_variations, l_samples, vcf_path);
         }
         free(gt_arr);
+        bcf_destroy(rec);
     }
     
     // free allocated memory
     bcf_hdr_destroy(hdr);
     bcf_close(inf);
-    bcf_destroy(rec);
     
     // Compute normalized variations frequency
     std::size_t number_of_samples = 0;
-    for (auto& s : l_samples) { if (s.variations.size() > 0) { number_of_samples += 1; } }
-    for (auto& v : l_variations) { v.freq = v.freq / double(number_of_samples); }
+    for (auto& s : l_samples) { s.shrink_to_fit(); if (not s.empty()) { number_of_samples += 1; } }
+    l_variations.normalize_freq(double(number_of_samples));
+    l_variations.shrink_to_fit();
     
     // print some statistics
-    spdlog::info("Variations size [{}]: {} GB", l_variations.size(), inGigabytes(l_variations.size() * sizeof(Variation)));
+    spdlog::info("Variations size [{}]: {} GB", l_variations.size(), inGigabytes(l_variations.memory_usage()));
     spdlog::info("Reference size: {} GB", inGigabytes(reference.size()));
     
     std::size_t tot_a_s = 0;
     for (auto& s : l_samples)
     {
-        tot_a_s += s.variations.size();
+        tot_a_s += s.memory_usage();
     }
-    spdlog::info("Samples size: {} GB", inGigabytes(tot_a_s * 8));
+    spdlog::info("Samples size: {} GB", inGigabytes(tot_a_s));
 }
 
 //------------------------------------------------------------------------------
@@ -429,10 +815,10 @@ vcfbwt::VCF::init_vcf(const std::string &vcf_path, std::size_t i)
     std::size_t tot_a_s = 0, tot_samples = 0;
     for (auto& s : this->samples)
     {
-        tot_a_s += s.variations.size();
-        if (s.variations.size() > 0) { tot_samples += 1; }
+        tot_a_s += s.size();
+        if (not s.empty()) { tot_samples += 1; }
     }
-    spdlog::info("Average variations per sample: {}", tot_a_s / tot_samples);
+    if (tot_samples > 0) { spdlog::info("Average variations per sample: {}", tot_a_s / tot_samples); }
 }
 
 //------------------------------------------------------------------------------
@@ -457,14 +843,15 @@ vcfbwt::VCF::init_multi_vcf(const std::vector<std::string>& vcfs_path)
     spdlog::info("Opening {} vcf files, assuming input order reflects the intended genome order", vcfs_path.size());
 
     std::vector<std::vector<Sample>> tmp_samples_array;
-    std::vector<std::vector<Variation>> tmp_variations_array;
+    std::vector<Variations> tmp_variations_array;
     std::vector<std::unordered_map<std::string, std::size_t>> tmp_samples_id;
 
     tmp_samples_array.resize(vcfs_path.size());
     tmp_variations_array.resize(vcfs_path.size());
     tmp_samples_id.resize(vcfs_path.size());
     
-    #pragma omp parallel for schedule(dynamic)
+    // With the index every file is read by regions using all the threads, one file at a time
+    #pragma omp parallel for schedule(dynamic) if (not this->use_index)
     for (std::size_t i = 0; i < vcfs_path.size(); i++)
     {
         init_vcf(vcfs_path[i],
@@ -479,8 +866,7 @@ vcfbwt::VCF::init_multi_vcf(const std::vector<std::string>& vcfs_path)
     for (std::size_t i = 0; i < vcfs_path.size(); i++)
     {
         std::size_t prev_variations_arr_size = variations.size();
-        this->variations.insert(this->variations.end(), tmp_variations_array[i].begin(), tmp_variations_array[i].end());
-        tmp_variations_array[i].clear();
+        this->variations.append(std::move(tmp_variations_array[i]));
 
         for (auto& sample : tmp_samples_array[i])
         {
@@ -491,32 +877,294 @@ vcfbwt::VCF::init_multi_vcf(const std::vector<std::string>& vcfs_path)
                 this->samples_id.insert(std::make_pair(sample.id(), this->samples.size() - 1));
             }
 
-            for (auto& sample_variation : sample.variations)
-            {
-                this->samples[samples_id[sample.id()]].variations.push_back(sample_variation + prev_variations_arr_size);
-            }
-    
-            for (auto& genotype_info : sample.genotypes)
-            {
-                this->samples[samples_id[sample.id()]].genotypes.push_back(genotype_info);
-            }
+            this->samples[samples_id[sample.id()]].append(sample, prev_variations_arr_size);
         }
         tmp_samples_array[i].clear();
         tmp_samples_id[i].clear();
     }
 
     // print some statistics
-    spdlog::info("Variations size [{}]: {}GB", variations.size(), inGigabytes(variations.size() * sizeof(Variation)));
+    spdlog::info("Variations size [{}]: {}GB", variations.size(), inGigabytes(variations.memory_usage()));
     spdlog::info("Reference size: {} GB", inGigabytes(reference.size()));
     
-    std::size_t tot_a_s = 0, tot_samples = 0;
+    std::size_t tot_a_s = 0, tot_samples = 0, samples_bytes = 0;
     for (auto& s : this->samples)
     {
-        tot_a_s += s.variations.size();
-        if (s.variations.size() > 0) { tot_samples += 1; }
+        tot_a_s += s.size();
+        samples_bytes += s.memory_usage();
+        if (not s.empty()) { tot_samples += 1; }
+    }
+    spdlog::info("Samples size: {} GB", inGigabytes(samples_bytes));
+    if (tot_samples > 0) { spdlog::info("Average variations per sample: {}", tot_a_s / tot_samples); }
+}
+
+//------------------------------------------------------------------------------
+
+void
+vcfbwt::VCF::init_stream_samples()
+{
+    // Same order of the samples of init_multi_vcf
+    std::set<std::string> seen;
+    for (std::size_t i = 0; i < vcfs_path.size(); i++)
+    {
+        htsFile * inf = bcf_open(vcfs_path[i].c_str(), "r");
+        if (inf == NULL) { spdlog::error("Can't open vcf file: {}", vcfs_path[i]); std::exit(EXIT_FAILURE); }
+        bcf_hdr_t *hdr = bcf_hdr_read(inf);
+        
+        std::size_t n_samples = bcf_hdr_nsamples(hdr);
+        if (this->max_samples == 0) { set_max_samples(n_samples); }
+        for (std::size_t i_s = 0; i_s < std::min(n_samples, this->max_samples); i_s++)
+        {
+            std::string id(hdr->samples[i_s]);
+            if ((not input_samples.empty()) and (input_samples.find(id) == input_samples.end())) { continue; }
+            if (seen.insert(id).second) { this->stream_samples.push_back(id); }
+        }
+        
+        bcf_hdr_destroy(hdr);
+        bcf_close(inf);
+    }
+    spdlog::info("Streaming {} samples", this->stream_samples.size());
+}
+
+//------------------------------------------------------------------------------
+
+void
+vcfbwt::VCF::init_stream_records(std::size_t i, Variations& l_variations)
+{
+    const std::string& vcf_path = this->vcfs_path[i];
+    StreamRecords& records = this->stream_records[i];
+    
+    htsFile * inf = bcf_open(vcf_path.c_str(), "r");
+    if (inf == NULL) { spdlog::error("Can't open vcf file: {}", vcf_path); std::exit(EXIT_FAILURE); }
+    bcf_hdr_t *hdr = bcf_hdr_read(inf);
+    
+    // The samples after the last streamed one can't change the streamed ones, decode only the samples up to it
+    std::size_t n_samples = std::min<std::size_t>(bcf_hdr_nsamples(hdr), this->max_samples);
+    std::vector<bool> streamed(n_samples, false);
+    std::size_t streamed_end = 0;
+    for (std::size_t i_s = 0; i_s < n_samples; i_s++)
+    {
+        if (input_samples.empty() or input_samples.find(std::string(hdr->samples[i_s])) != input_samples.end())
+        { streamed[i_s] = true; streamed_end = i_s + 1; }
     }
-    spdlog::info("Samples size: {} GB", inGigabytes(tot_a_s * 8));
-    spdlog::info("Average variations per sample: {}", tot_a_s / tot_samples);
+    
+    if (streamed_end > 0)
+    {
+        DiskReads::update(vcf_path);
+        spdlog::info("Indexing vcf: {}", vcf_path);
+        
+        if (streamed_end < std::size_t(bcf_hdr_nsamples(hdr)))
+        {
+            std::string subset;
+            for (std::size_t i_s = 0; i_s < streamed_end; i_s++)
+            { if (i_s != 0) { subset.push_back(','); } subset.append(hdr->samples[i_s]); }
+            if (bcf_hdr_set_samples(hdr, subset.c_str(), 0) != 0)
+            { spdlog::error("Error while selecting the samples of {}", vcf_path); std::exit(EXIT_FAILURE); }
+        }
+        n_samples = streamed_end;
+        
+        // BGZF decompression threads, unless the vcfs are already read in parallel
+        if (this->threads > 1 and not omp_in_parallel()) { hts_set_threads(inf, this->threads); }
+        
+        // Same filtering of add_record, the calls are only counted
+        std::size_t offset = i != 0 ? ref_sum_lengths[i-1] : 0;
+        std::vector<bool> carriers(n_samples, false);
+        OverlapState state;
+        Record record;
+        bcf1_t *rec = bcf_init();
+        int32_t *gt_arr = NULL; int ngt_arr = 0;
+        while (bcf_read(inf, hdr, rec) == 0)
+        {
+            decode_record(hdr, rec, offset, &gt_arr, &ngt_arr, record);
+            state.fit(record.max_ploidy, n_samples);
+            
+            bool skip_this_variation = false;
+            uint32_t last_sample = std::numeric_limits<uint32_t>::max();
+            std::size_t c = 0;
+            while (c < record.calls.size() and not skip_this_variation)
+            {
+                std::size_t i_s = record.calls[c].sample;
+                bool alt_alleles_set = false;
+                c = apply_calls(record, c, state, alt_alleles_set, skip_this_variation);
+                if (skip_this_variation) { last_sample = uint32_t(i_s); }
+                if (alt_alleles_set and streamed[i_s]) { record.variation.freq += 1; carriers[i_s] = true; }
+            }
+            records.last_sample.push_back(last_sample);
+            
+            if (record.variation.freq > 0)
+            {
+                if (l_variations.size() >= no_variation)
+                { spdlog::error("vcfbwt::VCF::init_stream_records: too many variations in {}", vcf_path); std::exit(EXIT_FAILURE); }
+                records.variation.push_back(uint32_t(l_variations.size()));
+                l_variations.push_back(record.variation);
+                check_reference(record, vcf_path);
+            }
+            else { records.variation.push_back(no_variation); }
+        }
+        free(gt_arr);
+        bcf_destroy(rec);
+        
+        l_variations.normalize_freq(double(std::count(carriers.begin(), carriers.end(), true)));
+        l_variations.shrink_to_fit();
+        records.variation.shrink_to_fit();
+        records.last_sample.shrink_to_fit();
+    }
+    
+    bcf_hdr_destroy(hdr);
+    bcf_close(inf);
+}
+
+void
+vcfbwt::VCF::init_multi_stream_records()
+{
+    this->stream_records.resize(this->vcfs_path.size());
+    std::vector<Variations> tmp_variations_array(this->vcfs_path.size());
+    
+    #pragma omp parallel for schedule(dynamic) num_threads(this->threads) if (this->vcfs_path.size() > 1)
+    for (std::size_t i = 0; i < this->vcfs_path.size(); i++) { init_stream_records(i, tmp_variations_array[i]); }
+    
+    for (std::size_t i = 0; i < this->vcfs_path.size(); i++)
+    {
+        this->stream_records[i].first_variation = this->variations.size();
+        this->variations.append(std::move(tmp_variations_array[i]));
+    }
+    
+    spdlog::info("Variations size [{}]: {}GB", variations.size(), inGigabytes(variations.memory_usage()));
+    spdlog::info("Reference size: {} GB", inGigabytes(reference.size()));
+}
+
+//------------------------------------------------------------------------------
+
+void
+vcfbwt::VCF::load_stream_vcf(std::size_t i, const std::set<std::string>& batch, std::vector<Sample>& l_samples)
+{
+    const std::string& vcf_path = this->vcfs_path[i];
+    const StreamRecords& records = this->stream_records[i];
+    
+    htsFile * inf = bcf_open(vcf_path.c_str(), "r");
+    if (inf == NULL) { spdlog::error("Can't open vcf file: {}", vcf_path); std::exit(EXIT_FAILURE); }
+    bcf_hdr_t *hdr = bcf_hdr_read(inf);
+    
+    // Only the samples of the batch are decoded, header_index maps them back to the whole header
+    std::string subset;
+    std::vector<uint32_t> header_index;
+    for (std::size_t i_s = 0; i_s < std::min<std::size_t>(bcf_hdr_nsamples(hdr), this->max_samples); i_s++)
+    {
+        std::string id(hdr->samples[i_s]);
+        if (batch.find(id) == batch.end()) { continue; }
+        if (not subset.empty()) { subset.push_back(','); }
+        subset.append(id);
+        header_index.push_back(uint32_t(i_s));
+        l_samples.emplace_back(id, this->reference, this->variations);
+    }
+    
+    if (not header_index.empty())
+    {
+        DiskReads::update(vcf_path);
+        spdlog::info("Parsing vcf: {}", vcf_path);
+        if (bcf_hdr_set_samples(hdr, subset.c_str(), 0) != 0)
+        { spdlog::error("Error while selecting the samples of {}", vcf_path); std::exit(EXIT_FAILURE); }
+        
+        // BGZF decompression threads, unless the vcfs are already read in parallel
+        if (this->threads > 1 and not omp_in_parallel()) { hts_set_threads(inf, this->threads); }
+        
+        // Records no streamed sample carries leave the overlap state of the batch unchanged, the calls of the
+        // other records are applied up to their last sample, as in init_stream_records
+        std::size_t offset = i != 0 ? ref_sum_lengths[i-1] : 0;
+        OverlapState state;
+        Record record;
+        bcf1_t *rec = bcf_init();
+        int32_t *gt_arr = NULL; int ngt_arr = 0;
+        std::size_t r = 0;
+        while (bcf_read(inf, hdr, rec) == 0)
+        {
+            std::size_t k = r++;
+            if (k >= records.variation.size()) { break; }
+            if (records.variation[k] == no_variation) { continue; }
+            
+            decode_record(hdr, rec, offset, &gt_arr, &ngt_arr, record);
+            state.fit(record.max_ploidy, header_index.size());
+            
+            bool skip_this_variation = false;
+            std::size_t c = 0;
+            while (c < record.calls.size() and header_index[record.calls[c].sample] <= records.last_sample[k])
+            {
+                std::size_t i_s = record.calls[c].sample;
+                bool alt_alleles_set = false;
+                c = apply_calls(record, c, state, alt_alleles_set, skip_this_variation);
+                if (alt_alleles_set) { l_samples[i_s].add_variation(records.variation[k], state.alleles_idx); }
+            }
+        }
+        free(gt_arr);
+        bcf_destroy(rec);
+        
+        if (r != records.variation.size())
+        { spdlog::error("{} changed while streaming its samples", vcf_path); std::exit(EXIT_FAILURE); }
+    }
+    
+    bcf_hdr_destroy(hdr);
+    bcf_close(inf);
+}
+
+bool
+vcfbwt::VCF::next_batch(std::size_t n)
+{
+    if (this->next_stream_sample >= this->stream_samples.size()) { return false; }
+    
+    this->samples.clear();
+    this->samples_id.clear();
+    this->populated_samples.clear();
+    
+    std::size_t batch_end = std::min(this->stream_samples.size(), this->next_stream_sample + std::max<std::size_t>(n, 1));
+    std::set<std::string> batch(this->stream_samples.begin() + this->next_stream_sample, this->stream_samples.begin() + batch_end);
+    spdlog::info("Loading samples {} to {} of {}", this->next_stream_sample, batch_end, this->stream_samples.size());
+    this->next_stream_sample = batch_end;
+    
+    std::vector<std::vector<Sample>> tmp_samples_array(this->vcfs_path.size());
+    
+    #pragma omp parallel for schedule(dynamic) num_threads(this->threads) if (this->vcfs_path.size() > 1)
+    for (std::size_t i = 0; i < this->vcfs_path.size(); i++) { load_stream_vcf(i, batch, tmp_samples_array[i]); }
+    
+    // Merge as init_multi_vcf does, the variations of the samples are relative to their vcf
+    for (std::size_t i = 0; i < this->vcfs_path.size(); i++)
+    {
+        for (auto& sample : tmp_samples_array[i])
+        {
+            if (this->samples_id.find(sample.id()) == this->samples_id.end())
+            {
+                Sample s(sample.id(), this->reference, this->variations);
+                this->samples.push_back(s);
+                this->samples_id.insert(std::make_pair(sample.id(), this->samples.size() - 1));
+            }
+            this->samples[samples_id[sample.id()]].append(sample, this->stream_records[i].first_variation);
+        }
+        tmp_samples_array[i].clear();
+    }
+    
+    for (std::size_t i = 0; i < samples.size(); i++)
+    {
+        this->samples[i].shrink_to_fit();
+        if (not samples.at(i).empty()) { this->populated_samples.push_back(i); }
+    }
+    
+    return true;
+}
+
+std::size_t
+vcfbwt::VCF::fixed_memory_usage() const
+{
+    std::size_t bytes = this->reference.capacity() + this->variations.memory_usage();
+    for (auto& records : this->stream_records)
+    { bytes += (records.variation.capacity() + records.last_sample.capacity()) * sizeof(uint32_t); }
+    return bytes;
+}
+
+std::size_t
+vcfbwt::VCF::samples_memory_usage() const
+{
+    std::size_t bytes = this->samples.capacity() * sizeof(Sample);
+    for (auto& s : this->samples) { bytes += s.memory_usage(); }
+    return bytes;
 }
 
 //------------------------------------------------------------------------------
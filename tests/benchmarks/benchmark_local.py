@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+from utils import *
+import json, csv, random
+
+# Offline benchmarks on synthetic data, no cluster paths and no downloads.
+#
+# Assuming installed
+# - /usr/bin/time (GNU time)
+# - the python modules used by utils.py and ../vcf_generator.py
+#
+# Usage:
+#   ./benchmark_local.py --pfp ../../build/pfp++ --scales small,medium --threads 1,4 --save-baseline
+#   ./benchmark_local.py --pfp ../../build/pfp++ --scales small,medium --threads 1,4
+
+project_base_dir        = os.path.dirname(os.path.abspath(__file__))
+vcf_generator_path      = os.path.join(project_base_dir, '..', 'vcf_generator.py')
+date_string             = datetime.datetime.now().strftime("%d-%m-%Y_%H-%M-%S")
+
+# Synthetic datasets: reference length, groups of similar samples, samples per group and variations per group
+scales = {
+    'small':  { 'length':  1000000, 'groups': 2, 'samples': 10, 'variations':  1000 },
+    'medium': { 'length': 10000000, 'groups': 2, 'samples': 25, 'variations': 10000 },
+    'large':  { 'length': 50000000, 'groups': 4, 'samples': 25, 'variations': 25000 }
+}
+
+# pfp++ variants, each one runs with every thread count
+variants = ['fasta', 'vcf', 'vcf_acceleration']
+
+w_value     = 10
+p_value     = 100
+
+# Measures compared with the baseline
+compared_measures = ['wall_seconds', 'max_rss_kb']
+
+#------------------------------------------------------------
+# random reference, gzipped fasta with one sequence
+def generate_reference(out_file_path, length, seed):
+    rootLogger = logging.getLogger()
+    if os.path.exists(out_file_path):
+        rootLogger.info('{} already exists'.format(out_file_path))
+        return out_file_path
+    generator = random.Random(seed)
+    with gzip.open(out_file_path, 'wt') as out_file:
+        out_file.write('>GEN synthetic reference, seed {}\n'.format(seed))
+        for start in range(0, length, 60):
+            out_file.write(''.join(generator.choice('ACGT') for _ in range(min(60, length - start))) + '\n')
+    return out_file_path
+
+#------------------------------------------------------------
+# vcf of the synthetic samples, from vcf_generator.py
+def generate_vcf(out_file_path, reference_path, scale, seed):
+    rootLogger = logging.getLogger()
+    if os.path.exists(out_file_path):
+        rootLogger.info('{} already exists'.format(out_file_path))
+        return out_file_path
+    command = '{python} {generator} -R {ref} -r {groups} -s {samples} -n {variations} --offset 1 --seed {seed} -o {out}'.format(
+        python=sys.executable, generator=vcf_generator_path, ref=reference_path, groups=scale['groups'],
+        samples=scale['samples'], variations=scale['variations'], seed=seed, out=out_file_path)
+    execute_command(command)
+    if not os.path.exists(out_file_path):
+        rootLogger.info('Failed to generate {}'.format(out_file_path))
+        exit(1)
+    return out_file_path
+
+#------------------------------------------------------------
+# first haplotype of every sample in the vcf as a multi fasta, the haplotypes pfp++ parses from the vcf
+def generate_samples_fasta(out_file_path, reference_path, vcf_path):
+    rootLogger = logging.getLogger()
+    if os.path.exists(out_file_path):
+        rootLogger.info('{} already exists'.format(out_file_path))
+        return out_file_path
+    with gzip.open(reference_path, 'rt') as handle:
+        reference = str(SeqIO.read(handle, 'fasta').seq)
+
+    samples = list()
+    sample_variations = list()
+    with gzip.open(vcf_path, 'rt') as vcf:
+        for line in vcf:
+            if line.startswith('##'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if line.startswith('#'):
+                samples = fields[9:]
+                sample_variations = [list() for _ in samples]
+                continue
+            pos, alt = int(fields[1]) - 1, fields[4]
+            for i, genotype in enumerate(fields[9:]):
+                if genotype.split('|')[0] == '1':
+                    sample_variations[i].append((pos, alt))
+
+    with open(out_file_path, 'w') as out_file:
+        for sample, variations in zip(samples, sample_variations):
+            haplotype = bytearray(reference, 'ascii')
+            for pos, alt in variations:
+                haplotype[pos:pos + 1] = alt.encode('ascii')
+            out_file.write('>{}\n'.format(sample))
+            out_file.write(haplotype.decode('ascii') + '\n')
+    return out_file_path
+
+#------------------------------------------------------------
+# run command repeats times, the run with the median wall time is kept
+def run_timed(command, repeats):
+    rootLogger = logging.getLogger()
+    runs = list()
+    for _ in range(repeats):
+        output, err = execute_command(command, time_it=True, return_err=True)
+        measures = parse_time_output(err)
+        if measures.get('exit_status', 1) != 0 or 'wall_seconds' not in measures:
+            rootLogger.info('Failed: {}'.format(command))
+            return None
+        runs.append(measures)
+    runs.sort(key=lambda m: m['wall_seconds'])
+    return runs[len(runs) // 2]
+
+#------------------------------------------------------------
+# pfp++ command line of a variant
+def pfp_command(pfp_exe, variant, threads, data, out_prefix):
+    base = '{pfp} -w {window} -p {modulo} -j {threads} -o {out}'.format(
+        pfp=pfp_exe, window=w_value, modulo=p_value, threads=threads, out=out_prefix)
+    if variant == 'fasta':
+        return base + ' -f {}'.format(data['fasta'])
+    command = base + ' --configure {}'.format(data['config'])
+    if variant == 'vcf_acceleration':
+        command += ' --use-vcf-acceleration'
+    return command
+
+#------------------------------------------------------------
+# regressions of results with respect to baseline: measures grown more than the tolerance and the absolute slack
+def find_regressions(results, baseline, tolerances, slacks):
+    regressions = list()
+    for key, measures in results.items():
+        if key not in baseline:
+            continue
+        for measure in compared_measures:
+            if measure not in measures or measure not in baseline[key]:
+                continue
+            current, reference = measures[measure], baseline[key][measure]
+            if current > reference * (1.0 + tolerances[measure]) and current - reference > slacks[measure]:
+                regressions.append((key, measure, reference, current))
+    return regressions
+
+def print_results(results, baseline):
+    rootLogger = logging.getLogger()
+    header = '{:<32} {:>12} {:>12} {:>12} {:>12} {:>14}'.format(
+        'benchmark', 'wall (s)', 'user (s)', 'sys (s)', 'RSS (MB)', 'wall vs base')
+    lines = [header, '-' * len(header)]
+    for key in sorted(results):
+        measures = results[key]
+        change = ''
+        if key in baseline and baseline[key].get('wall_seconds', 0) > 0:
+            change = '{:+.1f}%'.format(100.0 * (measures['wall_seconds'] / baseline[key]['wall_seconds'] - 1.0))
+        lines.append('{:<32} {:>12.2f} {:>12.2f} {:>12.2f} {:>12.1f} {:>14}'.format(
+            key, measures['wall_seconds'], measures.get('user_seconds', 0.0), measures.get('system_seconds', 0.0),
+            measures.get('max_rss_kb', 0) / 1024.0, change))
+    rootLogger.info('Results\n' + '\n'.join(lines))
+
+def main():
+    logFormatter = logging.Formatter("%(asctime)s [%(threadName)-12.12s] [%(levelname)-5.5s]  %(message)s")
+    rootLogger = logging.getLogger()
+    rootLogger.setLevel(logging.DEBUG)
+
+    parser = argparse.ArgumentParser(description='Offline pfp++ benchmarks on synthetic data.')
+    parser.add_argument('--pfp', dest='pfp_exe', type=str, help='pfp++ executable',
+                        default=os.path.join(project_base_dir, '..', '..', 'build', 'pfp++'))
+    parser.add_argument('-d', dest='work_dir', type=str, help='Directory for the generated data and the outputs',
+                        default='./benchmark_local')
+    parser.add_argument('--scales', dest='scales', type=str, help='Comma separated scales: {}'.format(','.join(scales)),
+                        default='small')
+    parser.add_argument('--variants', dest='variants', type=str, help='Comma separated variants: {}'.format(','.join(variants)),
+                        default=','.join(variants))
+    parser.add_argument('--threads', dest='threads', type=str, help='Comma separated thread counts', default='1,4')
+    parser.add_argument('--repeats', dest='repeats', type=int, help='Runs of each benchmark, the median is kept', default=3)
+    parser.add_argument('--seed', dest='seed', type=int, help='Seed of the synthetic data', default=42)
+    parser.add_argument('--baseline', dest='baseline', type=str, help='Baseline results (json)',
+                        default='./benchmark_local/baseline.json')
+    parser.add_argument('--save-baseline', dest='save_baseline', help='Store these results as the baseline',
+                        action='store_true', default=False)
+    parser.add_argument('--time-tolerance', dest='time_tolerance', type=float, help='Allowed wall time increase, fraction',
+                        default=0.15)
+    parser.add_argument('--memory-tolerance', dest='memory_tolerance', type=float, help='Allowed max RSS increase, fraction',
+                        default=0.10)
+    parser.add_argument('--time-slack', dest='time_slack', type=float, help='Wall time increases below these seconds are noise',
+                        default=0.5)
+    args = parser.parse_args()
+
+    mkdir_p(args.work_dir)
+    fileHandler = logging.FileHandler("{}/{}_logfile.log".format(args.work_dir, date_string))
+    fileHandler.setFormatter(logFormatter)
+    rootLogger.addHandler(fileHandler)
+
+    consoleHandler = logging.StreamHandler()
+    consoleHandler.setFormatter(logFormatter)
+    rootLogger.addHandler(consoleHandler)
+
+    if not os.path.exists(args.pfp_exe):
+        rootLogger.info('{} does not exist, build pfp++ first'.format(args.pfp_exe))
+        exit(1)
+    if not os.path.exists('/usr/bin/time'):
+        rootLogger.info('/usr/bin/time is needed to time the benchmarks')
+        exit(1)
+    selected_scales = [s for s in args.scales.split(',') if s]
+    selected_variants = [v for v in args.variants.split(',') if v]
+    threads_list = [int(t) for t in args.threads.split(',') if t]
+    for scale_name in selected_scales:
+        if scale_name not in scales:
+            rootLogger.info('Unknown scale {}'.format(scale_name))
+            exit(1)
+    for variant in selected_variants:
+        if variant not in variants:
+            rootLogger.info('Unknown variant {}'.format(variant))
+            exit(1)
+
+    # ============================================================
+
+    results = dict()
+    for scale_name in selected_scales:
+        scale = scales[scale_name]
+        data_dir = '{}/data/{}_seed_{}'.format(args.work_dir, scale_name, args.seed)
+        out_dir = '{}/out/{}'.format(args.work_dir, scale_name)
+        mkdir_p(data_dir)
+        mkdir_p(out_dir)
+
+        rootLogger.info('Generating the {} dataset'.format(scale_name))
+        data = dict()
+        data['reference'] = generate_reference(data_dir + '/reference.fa.gz', scale['length'], args.seed)
+        data['vcf'] = generate_vcf(data_dir + '/samples.vcf.gz', data['reference'], scale, args.seed)
+        data['fasta'] = generate_samples_fasta(data_dir + '/samples.fa', data['reference'], data['vcf'])
+        data['config'] = create_pfp_config_file([data['vcf']], [data['reference']], data_dir)
+
+        for variant in selected_variants:
+            for threads in threads_list:
+                key = '{}/{}/j{}'.format(scale_name, variant, threads)
+                out_prefix = '{}/{}_j{}'.format(out_dir, variant, threads)
+                rootLogger.info('Running {}'.format(key))
+                measures = run_timed(pfp_command(args.pfp_exe, variant, threads, data, out_prefix), args.repeats)
+                if measures is not None:
+                    results[key] = measures
+
+    # ============================================================
+
+    with open('{}/{}_results.csv'.format(args.work_dir, date_string), 'w') as csv_file:
+        columns = ['benchmark', 'wall_seconds', 'user_seconds', 'system_seconds', 'cpu_percent', 'max_rss_kb']
+        writer = csv.writer(csv_file)
+        writer.writerow(columns)
+        for key in sorted(results):
+            writer.writerow([key] + [results[key].get(c, '') for c in columns[1:]])
+
+    baseline = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        rootLogger.info('Baseline saved to {}'.format(args.baseline))
+        return
+
+    tolerances = { 'wall_seconds': args.time_tolerance, 'max_rss_kb': args.memory_tolerance }
+    slacks = { 'wall_seconds': args.time_slack, 'max_rss_kb': 0 }
+    regressions = find_regressions(results, baseline, tolerances, slacks)
+    for key, measure, reference, current in regressions:
+        rootLogger.info('REGRESSION {} {}: {} -> {}'.format(key, measure, reference, current))
+    failed = len(results) < len(selected_scales) * len(selected_variants) * len(threads_list)
+    if failed:
+        rootLogger.info('Some benchmarks failed, see the log')
+    if regressions or failed:
+        exit(1)
+    rootLogger.info('No regressions against {}'.format(args.baseline) if baseline else 'No baseline to compare with')
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,13 @@
-import sys, time, argparse, subprocess, os, wget, errno, datetime, logging, gzip, re
+import sys, time, argparse, subprocess, os, signal, wget, errno, datetime, logging, gzip, re
 from Bio import SeqIO
 from multiprocessing import Pool
 import tqdm
 
 
 #------------------------------------------------------------
-# execute command: return command's stdout if everything OK, None otherwise
-def execute_command(command, time_it=False, seconds=1000000):
+# execute command: return command's stdout if everything OK, None otherwise. With return_err return the pair
+# (stdout, stderr), /usr/bin/time writes its report on stderr
+def execute_command(command, time_it=False, seconds=1000000, return_err=False):
     rootLogger = logging.getLogger()
     try:
         if time_it:
@@ -17,19 +18,48 @@ def execute_command(command, time_it=False, seconds=1000000):
         process.wait(timeout=seconds)
     except subprocess.CalledProcessError:
         rootLogger.info("Error executing command line")
-        return None
+        return (None, None) if return_err else None
     except subprocess.TimeoutExpired:
         os.killpg(os.getpgid(process.pid), signal.SIGTERM)
         rootLogger.info("Command exceeded timeout")
-        return None
+        return (None, None) if return_err else None
     if output:
         output = output.decode("utf-8")
         rootLogger.info(output)
     if err:
         err = err.decode("utf-8")
         rootLogger.info("\n" + err)
+    if return_err:
+        return output, err
     return output
 
+#------------------------------------------------------------
+# parse the report of /usr/bin/time --verbose: wall, user and system seconds, max RSS and exit status
+def parse_time_output(err):
+    fields = {
+        'User time (seconds)': ('user_seconds', float),
+        'System time (seconds)': ('system_seconds', float),
+        'Percent of CPU this job got': ('cpu_percent', lambda v: float(v.rstrip('%'))),
+        'Elapsed (wall clock) time (h:mm:ss or m:ss)': ('wall_seconds', None),
+        'Maximum resident set size (kbytes)': ('max_rss_kb', int),
+        'Exit status': ('exit_status', int)
+    }
+    measures = dict()
+    for line in (err or '').splitlines():
+        key, sep, value = line.strip().rpartition(': ')
+        if not sep or key not in fields:
+            continue
+        name, convert = fields[key]
+        if convert is None:
+            # h:mm:ss or m:ss.cc
+            seconds = 0.0
+            for part in value.strip().split(':'):
+                seconds = seconds * 60 + float(part)
+            measures[name] = seconds
+        else:
+            measures[name] = convert(value.strip())
+    return measures
+
 #------------------------------------------------------------
 # download and compile pscan
 def get_pscan(work_dir):
@@ -11,6 +11,11 @@
 #include <utils.hpp>
 #include <pfp_algo.hpp>
 
+#include <random>
+
+#include <sys/wait.h>
+#include <unistd.h>
+
 //------------------------------------------------------------------------------
 
 struct listener : Catch::EventListenerBase
@@ -87,6 +92,27 @@ unparse_and_check(std::string& in_prefix, std::vector<data_type>& what_it_should
     return (occ_good and ((i == (unparsed.size())) and (i == (what_it_should_be.size()))));
 }
 
+// Runs the parser in a child process, for the inputs on which it exits. Returns the exit status, -1 if killed.
+// The child removes the temporary files on exit, inputs must not be temporary files.
+template <typename parser_type>
+int
+parse_in_child(const vcfbwt::pfp::Params& params, const std::string& in_file_name, const std::string& out_prefix)
+{
+    pid_t pid = fork();
+    if (pid < 0) { return -1; }
+    if (pid == 0)
+    {
+        parser_type parser(params, in_file_name, out_prefix);
+        parser();
+        parser.close();
+        _exit(EXIT_SUCCESS);
+    }
+
+    int status = 0;
+    if ((waitpid(pid, &status, 0) != pid) or (not WIFEXITED(status))) { return -1; }
+    return WEXITSTATUS(status);
+}
+
 //------------------------------------------------------------------------------
 TEST_CASE( "Initialization", "[LinkedList]" )
 {
@@ -575,6 +601,42 @@ TEST_CASE( "Periodic string Mersenne4", "[KR Mersenne4 Window]" )
 
 //------------------------------------------------------------------------------
 
+TEST_CASE( "Trigger strings, lanes against rolling hash", "[KR Mersenne Window]" )
+{
+    std::srand(42);
+    std::vector<vcfbwt::char_type> text(100000);
+    for (auto& c : text) { c = "ACGT"[std::rand() % 4]; }
+    std::vector<uint32_t> integers(100000);
+    for (auto& i : integers) { i = std::rand() % 1000; }
+    
+    std::size_t w = 10, p = 100;
+    std::vector<std::size_t> expected_text, expected_integers, from_text, from_integers;
+    
+    vcfbwt::Mersenne_KarpRabinHash kr_window(w);
+    kr_window.initialize(text.data(), w);
+    for (std::size_t i = w - 1; i < text.size(); i++)
+    {
+        if (i >= w) { kr_window.update(text[i - w], text[i]); }
+        if ((kr_window.get_hash() % p) == 0) { expected_text.push_back(i); }
+    }
+    
+    vcfbwt::Mersenne_KarpRabinHash4 kr_window4(w * 4);
+    kr_window4.initialize((vcfbwt::char_type*) integers.data(), w * 4);
+    for (std::size_t i = w - 1; i < integers.size(); i++)
+    {
+        if (i >= w) { kr_window4.update((vcfbwt::char_type*) &(integers[i - w]), (vcfbwt::char_type*) &(integers[i])); }
+        if ((kr_window4.get_hash() % p) == 0) { expected_integers.push_back(i); }
+    }
+    
+    vcfbwt::find_trigger_strings(text.data(), text.size(), 0, w, p, from_text);
+    vcfbwt::find_trigger_strings(integers.data(), integers.size(), 0, w, p, from_integers);
+    
+    REQUIRE(from_text == expected_text);
+    REQUIRE(from_integers == expected_integers);
+}
+
+//------------------------------------------------------------------------------
+
 TEST_CASE( "Dictionary size", "[Dictionary]")
 {
     vcfbwt::pfp::Dictionary<vcfbwt::char_type> dictionary;
@@ -596,6 +658,144 @@ TEST_CASE( "Dictionary size", "[Dictionary]")
     REQUIRE(dictionary.size() == elem);
 }
 
+TEST_CASE( "Dictionary growth", "[Dictionary]")
+{
+    using dictionary_type = vcfbwt::pfp::Dictionary<vcfbwt::char_type>;
+    dictionary_type dictionary;
+
+    // Filled in rounds, each one rehashes the shards again, phrases of the previous rounds are checked after
+    std::set<std::vector<vcfbwt::char_type>> phrases;
+    std::vector<vcfbwt::hash_type> hashes;
+    std::vector<std::vector<vcfbwt::char_type>> inserted;
+    std::size_t max_slots = 0;
+    for (std::size_t round_end : { 5000, 20000, 80000, 320000 })
+    {
+        for (std::size_t elem = inserted.size(); elem < round_end; elem++)
+        {
+            std::string elem_string = std::to_string(elem * 7919) + "_" + std::to_string(elem % 13);
+            inserted.emplace_back(elem_string.begin(), elem_string.end());
+            phrases.insert(inserted.back());
+            hashes.push_back(dictionary.check_and_add(inserted.back()));
+        }
+
+        std::size_t round_max_slots = 0;
+        for (auto& shard : dictionary.shards) { round_max_slots = std::max(round_max_slots, shard.slots.size()); }
+        REQUIRE(round_max_slots > max_slots);
+        max_slots = round_max_slots;
+
+        // Already there, same hash and no new entry
+        bool same_hashes = true, all_contained = true;
+        for (std::size_t i = 0; i < inserted.size(); i++)
+        {
+            all_contained = all_contained and dictionary.contains(inserted[i]);
+            same_hashes = same_hashes and (dictionary.check_and_add(inserted[i]) == hashes[i]);
+        }
+        REQUIRE(all_contained);
+        REQUIRE(same_hashes);
+        REQUIRE(dictionary.size() == phrases.size());
+
+        // Ranks follow the lexicographic order of the phrases
+        std::vector<std::vector<vcfbwt::char_type>> sorted_phrases(phrases.begin(), phrases.end());
+        bool same_ranks = true;
+        for (std::size_t i = 0; i < inserted.size(); i++)
+        {
+            std::size_t rank = std::lower_bound(sorted_phrases.begin(), sorted_phrases.end(), inserted[i]) - sorted_phrases.begin() + 1;
+            vcfbwt::pfp::PhraseView<vcfbwt::char_type> phrase = dictionary.sorted_entry_at(rank - 1);
+            same_ranks = same_ranks and (dictionary.hash_to_rank(hashes[i]) == rank) and (phrase.size() == inserted[i].size()) and
+                         std::equal(inserted[i].begin(), inserted[i].end(), phrase.begin());
+        }
+        REQUIRE(same_ranks);
+    }
+    REQUIRE(max_slots >= (dictionary_type::initial_slots << 4));
+
+    // Linear probing collisions, phrases stored away from the slot of their hash are found
+    std::size_t displaced = 0;
+    for (auto& shard : dictionary.shards)
+    {
+        for (std::size_t i = 0; i < shard.slots.size(); i++)
+        {
+            if ((shard.slots[i].length != 0) and ((shard.slots[i].hash & (shard.slots.size() - 1)) != i)) { displaced++; }
+        }
+    }
+    REQUIRE(displaced > 0);
+
+    // Memory of the arenas, slots and sorted views, reported only as it depends on the growth of the vectors
+    spdlog::info("Dictionary growth: {} phrases, {} bytes per phrase", dictionary.size(), dictionary.memory_usage() / dictionary.size());
+}
+
+TEST_CASE( "Dictionary concurrent insertions", "[Dictionary]")
+{
+    vcfbwt::pfp::Dictionary<vcfbwt::char_type> sequential, concurrent;
+
+    vcfbwt::size_type tot_elem = 100000;
+    for (vcfbwt::size_type elem = 0; elem < tot_elem; elem++)
+    {
+        std::string elem_string = std::to_string(elem % 1000) + "_" + std::to_string(elem);
+        sequential.check_and_add(std::vector<vcfbwt::char_type>(elem_string.begin(), elem_string.end()));
+    }
+
+    #pragma omp parallel for num_threads(8)
+    for (vcfbwt::size_type elem = 0; elem < 2 * tot_elem; elem++)
+    {
+        // every phrase inserted twice
+        std::string elem_string = std::to_string((elem % tot_elem) % 1000) + "_" + std::to_string(elem % tot_elem);
+        concurrent.check_and_add(std::vector<vcfbwt::char_type>(elem_string.begin(), elem_string.end()));
+    }
+
+    REQUIRE(concurrent.size() == sequential.size());
+    REQUIRE(concurrent.total_length() == sequential.total_length());
+
+    bool same_ranks = true;
+    for (vcfbwt::size_type i = 0; i < sequential.size(); i++)
+    {
+        same_ranks = same_ranks and (sequential.sorted_entry_at(i) == concurrent.sorted_entry_at(i));
+    }
+    REQUIRE(same_ranks);
+}
+
+TEST_CASE( "Dictionary parallel sort", "[Dictionary]")
+{
+    // short phrases over a tiny alphabet, including 0, share long prefixes and stress the prefix keys
+    std::srand(42);
+    std::set<std::vector<vcfbwt::char_type>> chars_phrases;
+    std::set<std::vector<uint32_t>> ints_phrases;
+    vcfbwt::pfp::Dictionary<vcfbwt::char_type> chars_dictionary;
+    vcfbwt::pfp::Dictionary<uint32_t> ints_dictionary;
+    for (std::size_t i = 0; i < 50000; i++)
+    {
+        std::vector<vcfbwt::char_type> chars_phrase(1 + std::rand() % 20);
+        for (auto& c : chars_phrase) { c = std::rand() % 4; }
+        chars_phrases.insert(chars_phrase);
+        chars_dictionary.check_and_add(chars_phrase);
+        
+        std::vector<uint32_t> ints_phrase(chars_phrase.begin(), chars_phrase.end());
+        if (not ints_phrase.empty()) { ints_phrase.back() += (std::rand() % 2) ? 0 : (uint32_t(1) << 31); }
+        ints_phrases.insert(ints_phrase);
+        ints_dictionary.check_and_add(ints_phrase);
+    }
+    
+    chars_dictionary.sort(4);
+    ints_dictionary.sort(4);
+    
+    REQUIRE(chars_dictionary.size() == chars_phrases.size());
+    REQUIRE(ints_dictionary.size() == ints_phrases.size());
+    
+    bool same_order = true;
+    std::size_t rank = 0;
+    for (auto& phrase : chars_phrases)
+    {
+        auto entry = chars_dictionary.sorted_entry_at(rank++);
+        same_order = same_order and (phrase.size() == entry.size()) and std::equal(phrase.begin(), phrase.end(), entry.begin());
+    }
+    rank = 0;
+    for (auto& phrase : ints_phrases)
+    {
+        auto entry = ints_dictionary.sorted_entry_at(rank++);
+        same_order = same_order and (phrase.size() == entry.size()) and std::equal(phrase.begin(), phrase.end(), entry.begin());
+    }
+    REQUIRE(same_order);
+}
+
 //------------------------------------------------------------------------------
 
 TEST_CASE( "Constructor with samples specified", "[VCF parser]" )
@@ -644,6 +844,76 @@ TEST_CASE( "Constructor", "[VCF parser]" )
     REQUIRE(all_match);
 }
 
+TEST_CASE( "Constructor, indexed regions", "[VCF parser]" )
+{
+    std::string vcf_file_name = testfiles_dir + "/ALL.chrY.phase3_integrated_v2a.20130502.genotypes.vcf.gz";
+    std::string ref_file_name = testfiles_dir + "/Y.fa.gz";
+    vcfbwt::VCF sequential(ref_file_name, vcf_file_name, "", 10);
+    vcfbwt::VCF regions(ref_file_name, vcf_file_name, "", 10, 0, 4, true);
+
+    REQUIRE(regions.size() == sequential.size());
+    REQUIRE(regions.get_variations().size() == sequential.get_variations().size());
+
+    bool all_match = true;
+    for (std::size_t i = 0; i < sequential.size(); i++)
+    {
+        all_match = all_match and (regions[i].id() == sequential[i].id()) and (regions[i].size() == sequential[i].size());
+        for (std::size_t v = 0; all_match and v < sequential[i].size(); v++)
+        {
+            all_match = (regions[i].get_variation(v).pos == sequential[i].get_variation(v).pos)
+                        and (regions[i].genotype(v, 0) == sequential[i].genotype(v, 0));
+        }
+    }
+    REQUIRE(all_match);
+}
+
+TEST_CASE( "Constructor, streaming batches", "[VCF parser]" )
+{
+    std::vector<std::string> vcf_file_names = { testfiles_dir + "/ALL.chrY.phase3_integrated_v2a.20130502.genotypes.vcf.gz" };
+    std::vector<std::string> ref_file_names = { testfiles_dir + "/Y.fa.gz" };
+    vcfbwt::VCF whole(ref_file_names, vcf_file_names, "", 10);
+    vcfbwt::VCF batches(ref_file_names, vcf_file_names, "", vcfbwt::VCF::Streaming(), 10);
+
+    std::size_t i = 0;
+    bool all_match = true;
+    while (batches.next_batch(3))
+    {
+        for (std::size_t j = 0; j < batches.size(); j++, i++)
+        {
+            std::string from_whole, from_batch;
+            vcfbwt::Sample::iterator it_whole(whole[i]), it_batch(batches[j]);
+            while (not it_whole.end()) { from_whole.push_back(*it_whole); ++it_whole; }
+            while (not it_batch.end()) { from_batch.push_back(*it_batch); ++it_batch; }
+            all_match = all_match and (whole[i].id() == batches[j].id()) and (from_whole == from_batch);
+        }
+    }
+
+    REQUIRE(batches.remaining_samples() == 0);
+    REQUIRE(i == whole.size());
+    REQUIRE(all_match);
+}
+
+TEST_CASE( "Streaming batches keep the variations", "[VCF parser]" )
+{
+    std::vector<std::string> vcf_file_names = { testfiles_dir + "/ALL.chrY.phase3_integrated_v2a.20130502.genotypes.vcf.gz" };
+    std::vector<std::string> ref_file_names = { testfiles_dir + "/Y.fa.gz" };
+    vcfbwt::VCF whole(ref_file_names, vcf_file_names, "", 10);
+    vcfbwt::VCF batches(ref_file_names, vcf_file_names, "", vcfbwt::VCF::Streaming(), 10);
+
+    std::size_t variations = batches.get_variations().size();
+    std::size_t fixed_memory = batches.fixed_memory_usage();
+    bool kept = true, split = true;
+    while (batches.next_batch(4))
+    {
+        kept = kept and (batches.get_variations().size() == variations) and (batches.fixed_memory_usage() == fixed_memory);
+        split = split and (batches.memory_usage() == fixed_memory + batches.samples_memory_usage());
+    }
+
+    REQUIRE(variations == whole.get_variations().size());
+    REQUIRE(kept);
+    REQUIRE(split);
+}
+
 TEST_CASE("Sample: HG00101", "[VCF parser]")
 {
     std::string vcf_file_name = testfiles_dir + "/ALL.chrY.phase3_integrated_v2a.20130502.genotypes.vcf.gz";
@@ -710,6 +980,115 @@ TEST_CASE( "Sample: HG00103", "[VCF parser]" )
     REQUIRE(((i == (from_vcf.size())) and (i == (from_fasta.size()))));
 }
 
+TEST_CASE( "Sample: HG00103, runs", "[VCF parser]" )
+{
+    std::string vcf_file_name = testfiles_dir + "/ALL.chrY.phase3_integrated_v2a.20130502.genotypes.vcf.gz";
+    std::string ref_file_name = testfiles_dir + "/Y.fa.gz";
+    vcfbwt::VCF vcf(ref_file_name, vcf_file_name, "", 3);
+
+    std::string test_sample_path = testfiles_dir + "/HG00103_chrY_H1.fa.gz";
+    std::ifstream in_stream(test_sample_path);
+
+    zstr::istream is(in_stream);
+    std::string line, from_fasta;
+    while (getline(is, line)) { if ( not (line.empty() or line[0] == '>') ) { from_fasta.append(line); } }
+
+    vcfbwt::Sample::iterator it(vcf[2]);
+    std::string from_vcf;
+    while (not it.end())
+    {
+        vcfbwt::Sample::iterator::Run run = it.current_run();
+        from_vcf.append(run.data, run.size);
+        it.advance(run.size);
+    }
+
+    REQUIRE(from_vcf == from_fasta);
+}
+
+TEST_CASE( "Sample: HG00103, go_to", "[VCF parser]" )
+{
+    std::string vcf_file_name = testfiles_dir + "/ALL.chrY.phase3_integrated_v2a.20130502.genotypes.vcf.gz";
+    std::string ref_file_name = testfiles_dir + "/Y.fa.gz";
+    vcfbwt::VCF vcf(ref_file_name, vcf_file_name, "", 3);
+
+    // jumping must leave the iterator as stepping one base at a time does
+    vcfbwt::Sample::iterator jumping(vcf[2]), stepping(vcf[2]);
+    bool same_state = true;
+    for (std::size_t target = 0; target < vcf.get_reference().size(); target += 997)
+    {
+        target = std::max(target, jumping.get_ref_it() + 1);
+        if (target >= vcf.get_reference().size()) { break; }
+        
+        jumping.go_to(target);
+        while (stepping.get_ref_it() + 1 < target) { ++stepping; }
+        
+        same_state = same_state and (*jumping == *stepping) and (jumping.get_sam_it() == stepping.get_sam_it())
+                     and (jumping.get_var_it() == stepping.get_var_it()) and (jumping.get_ref_it() == stepping.get_ref_it());
+    }
+    REQUIRE(same_state);
+}
+
+TEST_CASE( "Variations store", "[VCF parser]" )
+{
+    std::vector<vcfbwt::Variation> records(4);
+    records[0].pos = 10; records[0].ref_len = 1; records[0].alt = {"A", "C", "T"};
+    records[1].pos = 20; records[1].ref_len = 3; records[1].alt = {"ACG", "A"};
+    records[2].pos = 30; records[2].ref_len = 1; records[2].alt = {"G", "GTTA"};
+    records[3].pos = 40; records[3].ref_len = 1; records[3].alt = {"T", "A"};
+
+    vcfbwt::Variations first, second;
+    for (std::size_t i = 0; i < 2; i++) { first.push_back(records[i]); }
+    for (std::size_t i = 2; i < 4; i++) { second.push_back(records[i]); }
+    first.append(std::move(second));
+
+    REQUIRE(second.empty());
+    REQUIRE(first.size() == records.size());
+    for (std::size_t i = 0; i < records.size(); i++)
+    {
+        REQUIRE(first[i].pos == records[i].pos);
+        REQUIRE(first[i].ref_len == records[i].ref_len);
+        REQUIRE(first[i].n_alleles() == records[i].alt.size());
+        for (std::size_t a = 0; a < records[i].alt.size(); a++)
+        {
+            vcfbwt::AlleleView allele = first[i].alt(a);
+            REQUIRE(std::string(allele.data(), allele.size()) == records[i].alt[a]);
+        }
+    }
+}
+
+TEST_CASE( "Sample: compact genotypes", "[VCF parser]" )
+{
+    std::string reference = "ACGTACGTACGTACGT";
+    std::vector<vcfbwt::Variation> records(3);
+    records[0].pos = 2;  records[0].ref_len = 1; records[0].alt = {"G", "T"};
+    records[1].pos = 6;  records[1].ref_len = 2; records[1].alt = {"GT", "G", "GTTT"};
+    records[2].pos = 12; records[2].ref_len = 1; records[2].alt = {"A", "C"};
+    vcfbwt::Variations variations;
+    for (auto& record : records) { variations.push_back(record); }
+
+    vcfbwt::Sample sample("S0", reference, variations);
+    sample.add_variation(0, {1, 0});
+    sample.add_variation(1, {2, 1});
+    sample.add_variation(2, {0}); // haploid call, second haplotype stays on the reference
+
+    REQUIRE(sample.size() == 3);
+    REQUIRE(sample.variation(1) == 1);
+    REQUIRE(sample.genotype(1, 0) == 2);
+    REQUIRE(sample.genotype(1, 1) == 1);
+    REQUIRE(sample.genotype(2, 1) == 0);
+    REQUIRE(sample.get_variation(2).pos == 12);
+
+    std::string h0, h1;
+    vcfbwt::Sample::iterator it0(sample, 0), it1(sample, 1);
+    while (not it0.end()) { h0.push_back(*it0); ++it0; }
+    while (not it1.end()) { h1.push_back(*it1); ++it1; }
+
+    REQUIRE(h0 == "ACTTACGTTTACGTACGT");
+    REQUIRE(h1 == "ACGTACGACGTACGT");
+    REQUIRE(it0.length() == h0.size());
+    REQUIRE(it1.length() == h1.size());
+}
+
 TEST_CASE( "Selecting only Sample: HG00103", "[VCF parser]" )
 {
     std::string vcf_file_name = testfiles_dir + "/ALL.chrY.phase3_integrated_v2a.20130502.genotypes.vcf.gz";
@@ -844,6 +1223,286 @@ TEST_CASE( "Reference + Sample HG00096, WITH acceleration", "[PFP algorithm]" )
     REQUIRE(check);
 }
 
+TEST_CASE( "Reference parse cache", "[PFP algorithm]" )
+{
+    std::mt19937 gen(3);
+    std::string reference;
+    for (std::size_t i = 0; i < 200000; i++) { reference.push_back("ACGTN"[gen() % 5]); }
+
+    vcfbwt::pfp::Params params;
+    params.w = w_global; params.p = p_global;
+    params.reference_cache_dir = vcfbwt::TempFile::temp_dir;
+
+    vcfbwt::pfp::Params uncached_params = params;
+    uncached_params.reference_cache_dir = "";
+
+    vcfbwt::pfp::ReferenceParse uncached(reference, uncached_params);
+    vcfbwt::pfp::ReferenceParse written(reference, params);
+    vcfbwt::pfp::ReferenceParse loaded(reference, params);
+
+    REQUIRE(loaded.parse == uncached.parse);
+    REQUIRE(loaded.trigger_strings_position == uncached.trigger_strings_position);
+    REQUIRE(loaded.dictionary.size() == uncached.dictionary.size());
+    REQUIRE(loaded.dictionary.total_length() == uncached.dictionary.total_length());
+
+    bool all_match = true;
+    for (std::size_t i = 0; i < uncached.dictionary.size(); i++)
+    { all_match = all_match and (loaded.dictionary.sorted_entry_at(i) == uncached.dictionary.sorted_entry_at(i)); }
+    REQUIRE(all_match);
+
+    // The loaded dictionary keeps accepting phrases
+    std::vector<vcfbwt::char_type> phrase = { 'A', 'C', 'G', 'T', 'T', 'G', 'C', 'A', 'A', 'C', 'G', 'T' };
+    REQUIRE(loaded.dictionary.check_and_add(phrase) == uncached.dictionary.check_and_add(phrase));
+    REQUIRE(loaded.dictionary.size() == uncached.dictionary.size());
+}
+
+TEST_CASE( "Appending samples", "[PFP algorithm]" )
+{
+    std::string vcf_file_name = testfiles_dir + "/ALL.chrY.phase3_integrated_v2a.20130502.genotypes.vcf.gz";
+    std::string ref_file_name = testfiles_dir + "/Y.fa.gz";
+    vcfbwt::VCF vcf(ref_file_name, vcf_file_name, "", 3);
+
+    vcfbwt::pfp::Params params;
+    params.w = w_global; params.p = p_global;
+
+    // PFP of samples [first, last), closed by the last sample or by an end of text phrase
+    std::size_t reference_length = 0;
+    auto build = [&](std::size_t first, std::size_t last, const std::string& out_prefix)
+    {
+        vcfbwt::pfp::ReferenceParse reference_parse(vcf.get_reference(), params);
+        reference_length = reference_parse.parse.size();
+        vcfbwt::pfp::ParserVCF main_parser(params, out_prefix, reference_parse);
+        for (std::size_t i = first; i < last; i++) { main_parser(vcf[i], i); }
+        if (last != vcf.size()) { main_parser.end_of_text(last); }
+        main_parser.close();
+    };
+
+    std::string all_prefix = vcfbwt::TempFile::getName("all");
+    std::string existing_prefix = vcfbwt::TempFile::getName("existing");
+    std::string new_prefix = vcfbwt::TempFile::getName("new");
+    build(0, 3, all_prefix);
+    build(0, 2, existing_prefix);
+    build(2, 3, new_prefix);
+
+    // Appending the last sample gives the PFP of all the samples
+    vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::append(existing_prefix, new_prefix, reference_length, existing_prefix, params);
+
+    std::vector<vcfbwt::size_type> appended_parse, all_parse;
+    vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::read_parse(existing_prefix + vcfbwt::EXT::PARSE, appended_parse);
+    vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::read_parse(all_prefix + vcfbwt::EXT::PARSE, all_parse);
+    REQUIRE(appended_parse == all_parse);
+
+    std::vector<std::vector<vcfbwt::char_type>> appended_dictionary, all_dictionary;
+    vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::read_dictionary(existing_prefix + vcfbwt::EXT::DICT, appended_dictionary);
+    vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::read_dictionary(all_prefix + vcfbwt::EXT::DICT, all_dictionary);
+    REQUIRE(appended_dictionary == all_dictionary);
+}
+
+TEST_CASE( "Packed parse", "[PFP algorithm]" )
+{
+    std::mt19937 gen(11);
+    for (std::size_t dictionary_size : { std::size_t(1), std::size_t(1000), std::size_t(1) << 31 })
+    {
+        std::vector<vcfbwt::size_type> ranks;
+        for (std::size_t i = 0; i < 10007; i++) { ranks.push_back(1 + (gen() % dictionary_size)); }
+
+        std::string parse_file_name = vcfbwt::TempFile::getName("parse");
+        std::ofstream parse(parse_file_name);
+        parse.write((char*) ranks.data(), ranks.size() * sizeof(vcfbwt::size_type));
+        parse.close();
+
+        vcfbwt::pfp::pack_parse(parse_file_name, dictionary_size, 4);
+
+        // Random access, and the vector reader, read the packed ranks back
+        vcfbwt::pfp::ParseView packed(parse_file_name);
+        REQUIRE(packed.packed());
+        REQUIRE(packed.size() == ranks.size());
+        bool all_match = true;
+        for (std::size_t i = 0; i < ranks.size(); i += 7) { all_match = all_match and (packed[i] == ranks[i]); }
+        REQUIRE(all_match);
+
+        std::vector<vcfbwt::size_type> read_back;
+        vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::read_parse(parse_file_name, read_back);
+        REQUIRE(read_back == ranks);
+    }
+}
+
+TEST_CASE( "Properties with fewer threads than requested", "[PFP algorithm]" )
+{
+    std::mt19937 gen(5);
+    std::string text_file_name = vcfbwt::TempFile::getName("text");
+    std::ofstream text(text_file_name);
+    for (std::size_t i = 0; i < 200000; i++) { text.put("ACGT"[gen() % 4]); }
+    text.close();
+
+    vcfbwt::pfp::Params params;
+    params.w = w_global; params.p = p_global;
+    params.output_occurrences = true; params.output_last = true; params.output_sai = true;
+    std::string out_prefix = vcfbwt::TempFile::getName("properties");
+    vcfbwt::pfp::ParserText parser(params, text_file_name, out_prefix);
+    parser();
+    parser.close();
+
+    std::vector<std::string> extensions = { vcfbwt::EXT::OCC, vcfbwt::EXT::LAST, vcfbwt::EXT::SAI };
+    std::vector<std::string> expected;
+    for (auto& extension : extensions)
+    {
+        std::ifstream in(out_prefix + extension, std::ios::binary);
+        expected.push_back(std::string((std::istreambuf_iterator<char>(in)), std::istreambuf_iterator<char>()));
+    }
+
+    // Nested in an active parallel region the writer gets one thread, whatever it asks for
+    params.threads = 8;
+    int max_active_levels = omp_get_max_active_levels();
+    omp_set_max_active_levels(1);
+    #pragma omp parallel num_threads(2)
+    {
+        #pragma omp single
+        {
+            vcfbwt::pfp::PropertiesWriter<vcfbwt::char_type> properties_out(out_prefix, params);
+            properties_out.write();
+        }
+    }
+    omp_set_max_active_levels(max_active_levels);
+
+    for (std::size_t e = 0; e < extensions.size(); e++)
+    {
+        std::ifstream in(out_prefix + extensions[e], std::ios::binary);
+        REQUIRE(std::string((std::istreambuf_iterator<char>(in)), std::istreambuf_iterator<char>()) == expected[e]);
+    }
+}
+
+TEST_CASE( "Mapped parse and dictionary views", "[PFP algorithm]" )
+{
+    std::vector<std::string> phrases = { "\x02" "ACGTA", "TAGGA", "GACCAT", "ATTT\x02\x02" };
+    std::vector<vcfbwt::size_type> ranks = { 1, 3, 2, 3, 4 };
+
+    std::string dict_file_name = vcfbwt::TempFile::getName("dict");
+    std::ofstream dict(dict_file_name);
+    for (auto& phrase : phrases) { dict.write(phrase.data(), phrase.size()); dict.put(vcfbwt::pfp::ENDOFWORD); }
+    dict.put(vcfbwt::pfp::ENDOFDICT);
+    dict.close();
+
+    std::string parse_file_name = vcfbwt::TempFile::getName("parse");
+    std::ofstream parse(parse_file_name);
+    parse.write((char*) ranks.data(), ranks.size() * sizeof(vcfbwt::size_type));
+    parse.close();
+
+    vcfbwt::pfp::DictionaryView<vcfbwt::char_type> dictionary_view(dict_file_name);
+    REQUIRE(dictionary_view.size() == phrases.size());
+    for (std::size_t i = 0; i < phrases.size(); i++)
+    { REQUIRE(std::string(dictionary_view[i].begin(), dictionary_view[i].end()) == phrases[i]); }
+
+    vcfbwt::pfp::ParseView parse_view(parse_file_name);
+    REQUIRE(parse_view.size() == ranks.size());
+    for (std::size_t i = 0; i < ranks.size(); i++) { REQUIRE(parse_view[i] == ranks[i]); }
+
+    // The vector readers are copies of the views
+    std::vector<vcfbwt::size_type> parse_copy;
+    vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::read_parse(parse_file_name, parse_copy);
+    REQUIRE(parse_copy == ranks);
+
+    std::vector<std::vector<vcfbwt::char_type>> dictionary_copy;
+    vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::read_dictionary(dict_file_name, dictionary_copy);
+    REQUIRE(dictionary_copy.size() == phrases.size());
+    REQUIRE(std::string(dictionary_copy[2].begin(), dictionary_copy[2].end()) == phrases[2]);
+
+    // The packed parse reads the same
+    vcfbwt::pfp::pack_parse(parse_file_name, phrases.size(), 1);
+    vcfbwt::pfp::ParseView packed_view(parse_file_name);
+    REQUIRE(packed_view.packed());
+    REQUIRE(packed_view.size() == ranks.size());
+    for (std::size_t i = 0; i < ranks.size(); i++) { REQUIRE(packed_view[i] == ranks[i]); }
+
+    // An empty parse maps to an empty view
+    std::string empty_file_name = vcfbwt::TempFile::getName("parse");
+    std::ofstream(empty_file_name).close();
+    REQUIRE(vcfbwt::pfp::ParseView(empty_file_name).empty());
+}
+
+TEST_CASE( "Parse sink", "[PFP algorithm]" )
+{
+    std::vector<vcfbwt::hash_type> hashes(3 * (1 << 20) + 7);
+    std::mt19937_64 generator(23);
+    for (auto& hash : hashes) { hash = generator(); }
+
+    // No budget, a budget the parse fits in and one it outgrows after the first buffer
+    std::vector<std::size_t> budgets = { 0, 64 * vcfbwt::MEGABYTE, 10 * vcfbwt::MEGABYTE };
+    std::vector<bool> in_memory = { false, true, false };
+    for (std::size_t b = 0; b < budgets.size(); b++)
+    {
+        vcfbwt::pfp::ParseSink sink;
+        sink.open(vcfbwt::TempFile::getName("parse"), budgets[b]);
+        for (std::size_t i = 0; i < 1000; i++) { sink.write(hashes[i]); }
+        sink.write(hashes.data() + 1000, hashes.size() - 1000);
+        sink.close();
+
+        REQUIRE(sink.in_memory() == in_memory[b]);
+        REQUIRE(sink.size() == hashes.size());
+        REQUIRE(sink.disk_bytes() == (in_memory[b] ? 0 : hashes.size() * sizeof(vcfbwt::hash_type)));
+        REQUIRE(std::equal(hashes.begin(), hashes.end(), sink.data()));
+        sink.release();
+    }
+}
+
+TEST_CASE( "Parse sink, moved", "[PFP algorithm]" )
+{
+    std::vector<vcfbwt::hash_type> hashes(1000);
+    std::mt19937_64 generator(29);
+    for (auto& hash : hashes) { hash = generator(); }
+    std::size_t budget = (1 << 20) * sizeof(vcfbwt::hash_type) + 1; // one buffer
+
+    // The budget of the buffer goes with the new sink, a second sink does not fit in it
+    std::unique_ptr<vcfbwt::pfp::ParseSink> moved_from(new vcfbwt::pfp::ParseSink());
+    moved_from->open(vcfbwt::TempFile::getName("parse"), budget);
+    moved_from->write(hashes.data(), hashes.size());
+    vcfbwt::pfp::ParseSink sink(std::move(*moved_from));
+    moved_from.reset();
+
+    vcfbwt::pfp::ParseSink other;
+    other.open(vcfbwt::TempFile::getName("parse"), budget);
+    REQUIRE(not other.in_memory());
+    other.release();
+
+    sink.close();
+    REQUIRE(sink.in_memory());
+    REQUIRE(sink.size() == hashes.size());
+    REQUIRE(std::equal(hashes.begin(), hashes.end(), sink.data()));
+    sink.release();
+
+    // Moved while its writer is running
+    vcfbwt::pfp::ParseSink spilled;
+    spilled.open(vcfbwt::TempFile::getName("parse"), 0);
+    spilled.write(hashes.data(), hashes.size());
+    vcfbwt::pfp::ParseSink moved(std::move(spilled));
+    spilled.close();
+    moved.close();
+    REQUIRE(moved.disk_bytes() == hashes.size() * sizeof(vcfbwt::hash_type));
+    REQUIRE(std::equal(hashes.begin(), hashes.end(), moved.data()));
+}
+
+TEST_CASE( "Performance metrics", "[PFP algorithm]" )
+{
+    {
+        vcfbwt::Metrics::Phase phase("test phase");
+        vcfbwt::DiskWrites::update(100);
+        vcfbwt::DiskReads::update(50);
+    }
+    vcfbwt::Metrics::Worker worker; worker.name = "test worker"; worker.bases = 1000; worker.phrases = 10; worker.seconds = 0.5;
+    vcfbwt::Metrics::add_worker(worker);
+
+    std::string metrics_file_name = vcfbwt::TempFile::getName("metrics");
+    vcfbwt::Metrics::write(metrics_file_name, "tests", 1);
+
+    std::ifstream metrics(metrics_file_name);
+    std::string json((std::istreambuf_iterator<char>(metrics)), std::istreambuf_iterator<char>());
+    REQUIRE(json.find("\"tool\": \"tests\"") != std::string::npos);
+    REQUIRE(json.find("\"name\": \"test phase\"") != std::string::npos);
+    REQUIRE(json.find("\"name\": \"test worker\", \"bases\": 1000, \"phrases\": 10") != std::string::npos);
+    REQUIRE(json.find("\"bases_per_second\": 2000.000000") != std::string::npos);
+    REQUIRE(json.find("\"peak_rss_bytes\"") != std::string::npos);
+}
+
 TEST_CASE( "Sample: HG00096, twice chromosome Y", "[VCF parser]" )
 {
     std::vector<std::string> vcf_file_names =
@@ -920,6 +1579,150 @@ TEST_CASE( "Sample: HG00096, fasta", "[PFP Algo]" )
     REQUIRE(check);
 }
 
+TEST_CASE( "Sample: HG00096, fasta, multi-threaded", "[PFP Algo]" )
+{
+    vcfbwt::pfp::Params params;
+    params.w = w_global; params.p = p_global;
+    params.output_occurrences = true;
+
+    std::string test_sample_path = testfiles_dir + "/HG00096_chrY_H1.fa.gz";
+
+    // Sequential
+    std::string out_prefix_seq = testfiles_dir + "/HG00096_chrY_H1_tpfa_seq";
+    vcfbwt::pfp::ParserFasta parser_seq(params, test_sample_path, out_prefix_seq);
+    parser_seq();
+    parser_seq.close();
+
+    // Parallel
+    params.threads = 4;
+    std::string out_prefix_par = testfiles_dir + "/HG00096_chrY_H1_tpfa_par";
+    vcfbwt::pfp::ParserFasta parser_par(params, test_sample_path, out_prefix_par);
+    parser_par();
+    parser_par.close();
+
+    // Check, parse and dictionary must be the same
+    for (auto& ext : { vcfbwt::EXT::PARSE, vcfbwt::EXT::DICT, vcfbwt::EXT::OCC })
+    {
+        std::ifstream seq_stream(out_prefix_seq + ext), par_stream(out_prefix_par + ext);
+        std::string seq_content((std::istreambuf_iterator<char>(seq_stream)), std::istreambuf_iterator<char>());
+        std::string par_content((std::istreambuf_iterator<char>(par_stream)), std::istreambuf_iterator<char>());
+        REQUIRE(seq_content == par_content);
+    }
+}
+
+TEST_CASE( "VCF samples, multi-threaded", "[PFP algorithm]" )
+{
+    // Random reference and samples, some phrases of the haplotypes are not in the reference
+    std::mt19937 gen(13);
+    std::string reference;
+    for (std::size_t i = 0; i < 200000; i++) { reference.push_back("ACGT"[gen() % 4]); }
+    std::vector<vcfbwt::Variation> records;
+    for (std::size_t pos = 100; pos + 20 < reference.size(); pos += 50 + gen() % 1000)
+    {
+        vcfbwt::Variation record; record.pos = pos;
+        if (gen() % 3 == 0) { record.ref_len = 3; record.alt = { reference.substr(pos, 3), reference.substr(pos, 1) }; }
+        else { record.ref_len = 1; record.alt = { reference.substr(pos, 1), reference.substr(pos, 1) + "ACGTT" }; }
+        records.push_back(record);
+    }
+    vcfbwt::Variations variations;
+    for (auto& record : records) { variations.push_back(record); }
+    std::vector<vcfbwt::Sample> samples;
+    for (std::size_t s = 0; s < 9; s++)
+    {
+        samples.emplace_back("S" + std::to_string(s), reference, variations);
+        for (std::size_t v = 0; v < records.size(); v++)
+        {
+            int first = (gen() % (s + 2) == 0), second = (gen() % 4 == 0);
+            if (first or second) { samples.back().add_variation(v, {first, second}); }
+        }
+    }
+    samples.back().set_last(1);
+
+    // Both haplotypes, scheduled dynamically with the samples with more variations first, as pfp++ does
+    std::vector<std::string> out_prefixes;
+    for (std::size_t threads : { 1, 4 })
+    {
+        vcfbwt::pfp::Params params;
+        params.w = w_global; params.p = p_global;
+        params.output_occurrences = true;
+        params.threads = threads;
+        
+        out_prefixes.push_back(vcfbwt::TempFile::getName("vcf_threads"));
+        vcfbwt::pfp::ReferenceParse reference_parse(reference, params);
+        vcfbwt::pfp::ParserVCF main_parser(params, out_prefixes.back(), reference_parse);
+        std::vector<vcfbwt::pfp::ParserVCF> workers(threads);
+        for (auto& worker : workers)
+        {
+            worker.init(params, "", reference_parse, vcfbwt::pfp::ParserVCF::WORKER | vcfbwt::pfp::ParserVCF::UNCOMPRESSED);
+            main_parser.register_worker(worker);
+        }
+        
+        struct WorkUnit { std::size_t sample; std::size_t genotype; std::size_t unit; };
+        std::vector<WorkUnit> work_units;
+        for (std::size_t i = 0; i < samples.size(); i++) { work_units.push_back({ i, 0, 2 * i }); work_units.push_back({ i, 1, 2 * i + 1 }); }
+        std::stable_sort(work_units.begin(), work_units.end(), [&samples](const WorkUnit& a, const WorkUnit& b)
+        { return samples[a.sample].size() > samples[b.sample].size(); });
+        
+        #pragma omp parallel for schedule(dynamic, 1) num_threads(threads)
+        for (std::size_t u = 0; u < work_units.size(); u++)
+        {
+            vcfbwt::pfp::ParserVCF& worker = workers[omp_get_thread_num()];
+            worker.set_working_genotype(work_units[u].genotype);
+            worker(samples[work_units[u].sample], work_units[u].unit);
+        }
+        main_parser.close();
+    }
+
+    // Check, parse and dictionary must be the same
+    for (auto& ext : { vcfbwt::EXT::PARSE, vcfbwt::EXT::DICT, vcfbwt::EXT::OCC })
+    {
+        std::ifstream seq_stream(out_prefixes[0] + ext), par_stream(out_prefixes[1] + ext);
+        std::string seq_content((std::istreambuf_iterator<char>(seq_stream)), std::istreambuf_iterator<char>());
+        std::string par_content((std::istreambuf_iterator<char>(par_stream)), std::istreambuf_iterator<char>());
+        REQUIRE(not seq_content.empty());
+        REQUIRE(seq_content == par_content);
+    }
+}
+
+TEST_CASE( "Fasta, multi-threaded", "[PFP algorithm]" )
+{
+    // Several sequences, each split in chunks by the parallel parser
+    std::mt19937 gen(17);
+    std::string fasta_file_name = vcfbwt::TempFile::getName("fasta");
+    std::ofstream fasta(fasta_file_name);
+    for (std::size_t k = 0; k < 4; k++)
+    {
+        fasta << ">sequence_" << k << "\n";
+        for (std::size_t i = 0; i < 500000; i++) { fasta.put("ACGT"[gen() % 4]); if (i % 60 == 59) { fasta.put('\n'); } }
+        fasta << "\n";
+    }
+    fasta.close();
+
+    std::vector<std::string> out_prefixes;
+    for (std::size_t threads : { 1, 4 })
+    {
+        vcfbwt::pfp::Params params;
+        params.w = w_global; params.p = p_global;
+        params.output_occurrences = true;
+        params.threads = threads;
+        
+        out_prefixes.push_back(vcfbwt::TempFile::getName("fasta_threads"));
+        vcfbwt::pfp::ParserFasta parser(params, fasta_file_name, out_prefixes.back());
+        parser();
+        parser.close();
+    }
+
+    // Check, parse and dictionary must be the same
+    for (auto& ext : { vcfbwt::EXT::PARSE, vcfbwt::EXT::DICT, vcfbwt::EXT::OCC })
+    {
+        std::ifstream seq_stream(out_prefixes[0] + ext), par_stream(out_prefixes[1] + ext);
+        std::string seq_content((std::istreambuf_iterator<char>(seq_stream)), std::istreambuf_iterator<char>());
+        std::string par_content((std::istreambuf_iterator<char>(par_stream)), std::istreambuf_iterator<char>());
+        REQUIRE(not seq_content.empty());
+        REQUIRE(seq_content == par_content);
+    }
+}
+
 TEST_CASE( "Sample: HG00096, text", "[PFP Algo]" )
 {
     // Produce dictionary and parsing
@@ -991,6 +1794,55 @@ TEST_CASE( "Sample: HG00096, integers", "[PFP Algo]" )
     REQUIRE(check);
 }
 
+TEST_CASE( "Empty text and integers files", "[PFP algorithm]" )
+{
+    vcfbwt::pfp::Params params;
+    params.w = w_global; params.p = p_global;
+    params.integers_shift = 0;
+
+    std::string empty_file_name = testfiles_dir + "/empty.bin";
+    std::ofstream empty_file(empty_file_name, std::ios::binary); empty_file.close();
+
+    // Nothing is mapped
+    mio::mmap_source mapped;
+    vcfbwt::map_file(empty_file_name, mapped, true);
+    REQUIRE(not mapped.is_mapped());
+    REQUIRE(mapped.size() == 0);
+
+    // No sequence to end with w DOLLAR, both parsers exit with a failure
+    int text_status = parse_in_child<vcfbwt::pfp::ParserText>(params, empty_file_name, testfiles_dir + "/empty_tptxt");
+    REQUIRE(text_status == EXIT_FAILURE);
+    int integers_status = parse_in_child<vcfbwt::pfp::ParserIntegers>(params, empty_file_name, testfiles_dir + "/empty_tpintegers");
+    REQUIRE(integers_status == EXIT_FAILURE);
+}
+
+TEST_CASE( "Truncated integers file", "[PFP algorithm]" )
+{
+    vcfbwt::pfp::Params params;
+    params.w = w_global; params.p = p_global;
+    params.integers_shift = 0;
+
+    // Enough integers for a sequence, and half of one more
+    std::string truncated_file_name = testfiles_dir + "/truncated_int32_t.bin";
+    std::ofstream truncated_file(truncated_file_name, std::ios::binary);
+    std::vector<uint32_t> integers;
+    for (uint32_t i = 0; i < 1000; i++) { integers.push_back(10 + (i % 100)); }
+    truncated_file.write((char*) integers.data(), integers.size() * sizeof(uint32_t) + 2);
+    truncated_file.close();
+
+    int truncated_status = parse_in_child<vcfbwt::pfp::ParserIntegers>(params, truncated_file_name, testfiles_dir + "/truncated_int32_t_tpintegers");
+    REQUIRE(truncated_status == EXIT_FAILURE);
+
+    // The same integers without the half one are parsed
+    std::string whole_file_name = testfiles_dir + "/whole_int32_t.bin";
+    std::ofstream whole_file(whole_file_name, std::ios::binary);
+    whole_file.write((char*) integers.data(), integers.size() * sizeof(uint32_t));
+    whole_file.close();
+
+    int whole_status = parse_in_child<vcfbwt::pfp::ParserIntegers>(params, whole_file_name, testfiles_dir + "/whole_int32_t_tpintegers");
+    REQUIRE(whole_status == EXIT_SUCCESS);
+}
+
 TEST_CASE( "Reference + Sample HG00096, merging", "[PFP algorithm]" )
 {
     // Produce dictionary and parsing from reference
@@ -1052,6 +1904,136 @@ TEST_CASE( "Reference + Sample HG00096, merging", "[PFP algorithm]" )
     REQUIRE(check);
 }
 
+TEST_CASE( "N-way merging", "[PFP algorithm]" )
+{
+    vcfbwt::pfp::Params params;
+    params.w = w_global; params.p = p_global;
+    params.threads = 4;
+
+    // Three random sequences, parsed separately
+    std::mt19937 gen(7);
+    std::vector<std::string> prefixes;
+    for (std::size_t k = 0; k < 3; k++)
+    {
+        std::string fasta_file_name = vcfbwt::TempFile::getName("fasta");
+        std::ofstream fasta(fasta_file_name);
+        fasta << ">sequence_" << k << "\n";
+        for (std::size_t i = 0; i < 50000; i++) { fasta.put("ACGT"[gen() % 4]); }
+        fasta << "\n";
+        fasta.close();
+
+        prefixes.push_back(vcfbwt::TempFile::getName("nway"));
+        vcfbwt::pfp::ParserFasta parser(params, fasta_file_name, prefixes.back());
+        parser();
+        parser.close();
+    }
+
+    // One run against two pairwise runs
+    std::string out_prefix_nway = vcfbwt::TempFile::getName("nway_merged");
+    vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::merge(prefixes, out_prefix_nway, params);
+
+    std::string out_prefix_left = vcfbwt::TempFile::getName("pairwise_left");
+    std::string out_prefix_pairwise = vcfbwt::TempFile::getName("pairwise_merged");
+    vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::merge(prefixes[0], prefixes[1], out_prefix_left, params);
+    vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::merge(out_prefix_left, prefixes[2], out_prefix_pairwise, params);
+
+    std::vector<vcfbwt::size_type> nway_parse, pairwise_parse;
+    vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::read_parse(out_prefix_nway + vcfbwt::EXT::PARSE, nway_parse);
+    vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::read_parse(out_prefix_pairwise + vcfbwt::EXT::PARSE, pairwise_parse);
+    REQUIRE(nway_parse == pairwise_parse);
+
+    std::vector<std::vector<vcfbwt::char_type>> nway_dictionary, pairwise_dictionary;
+    vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::read_dictionary(out_prefix_nway + vcfbwt::EXT::DICT, nway_dictionary);
+    vcfbwt::pfp::ParserUtils<vcfbwt::char_type>::read_dictionary(out_prefix_pairwise + vcfbwt::EXT::DICT, pairwise_dictionary);
+    REQUIRE(nway_dictionary == pairwise_dictionary);
+}
+
+TEST_CASE( "Integers merging", "[PFP algorithm]" )
+{
+    vcfbwt::pfp::Params params;
+    params.w = w_global; params.p = p_global;
+    params.output_occurrences = true;
+    params.integers_shift = 0;
+
+    // Two integer sequences over a small alphabet, each terminated by DOLLAR_PRIMEs and DOLLAR_SEQUENCE
+    std::mt19937 gen(11);
+    std::vector<std::string> prefixes;
+    std::vector<uint32_t> what_it_should_be(1, vcfbwt::pfp::DOLLAR);
+    for (std::size_t k = 0; k < 2; k++)
+    {
+        std::vector<uint32_t> integers;
+        for (std::size_t i = 0; i < 30000; i++) { integers.push_back(10 + gen() % 4); }
+        integers.insert(integers.end(), params.w - 1, vcfbwt::pfp::DOLLAR_PRIME);
+        integers.push_back(vcfbwt::pfp::DOLLAR_SEQUENCE);
+        what_it_should_be.insert(what_it_should_be.end(), integers.begin(), integers.end());
+
+        std::string integers_file_name = vcfbwt::TempFile::getName("integers");
+        std::ofstream integers_file(integers_file_name, std::ios::binary);
+        integers_file.write((char*) integers.data(), integers.size() * sizeof(uint32_t));
+        integers_file.close();
+
+        prefixes.push_back(vcfbwt::TempFile::getName("integers_merging"));
+        vcfbwt::pfp::ParserIntegers parser(params, integers_file_name, prefixes.back());
+        parser();
+        parser.close();
+    }
+    what_it_should_be.insert(what_it_should_be.end(), params.w, vcfbwt::pfp::DOLLAR);
+
+    std::string out_prefix_merged = vcfbwt::TempFile::getName("integers_merged");
+    vcfbwt::pfp::ParserUtils<uint32_t>::merge(prefixes, out_prefix_merged, params);
+
+    // The phrases in parse order, the last one of the left PFP without its dollars and the first one of the right
+    // PFP starting with DOLLAR_PRIMEs and DOLLAR_SEQUENCE, collected in a set gives the expected dictionary
+    std::vector<std::vector<uint32_t>> phrases;
+    for (std::size_t k = 0; k < 2; k++)
+    {
+        std::vector<vcfbwt::size_type> parse;
+        std::vector<std::vector<uint32_t>> dictionary;
+        vcfbwt::pfp::ParserUtils<uint32_t>::read_parse(prefixes[k] + vcfbwt::EXT::PARSE, parse);
+        vcfbwt::pfp::ParserUtils<uint32_t>::read_dictionary(prefixes[k] + vcfbwt::EXT::DICT, dictionary);
+        for (std::size_t i = 0; i < parse.size(); i++)
+        {
+            std::vector<uint32_t> phrase = dictionary[parse[i] - 1];
+            if ((k == 0) and (i == parse.size() - 1))
+            {
+                REQUIRE(phrase.back() == vcfbwt::pfp::DOLLAR);
+                phrase.resize(phrase.size() - params.w);
+                REQUIRE(phrase.back() == vcfbwt::pfp::DOLLAR_SEQUENCE);
+            }
+            if ((k == 1) and (i == 0))
+            {
+                REQUIRE(phrase.front() == vcfbwt::pfp::DOLLAR);
+                phrase[0] = vcfbwt::pfp::DOLLAR_SEQUENCE;
+                phrase.insert(phrase.begin(), params.w - 1, vcfbwt::pfp::DOLLAR_PRIME);
+            }
+            phrases.push_back(phrase);
+        }
+    }
+    std::set<std::vector<uint32_t>> phrases_set(phrases.begin(), phrases.end());
+    std::vector<std::vector<uint32_t>> expected_dictionary(phrases_set.begin(), phrases_set.end());
+    std::vector<vcfbwt::size_type> expected_parse;
+    for (auto& phrase : phrases)
+    {
+        auto it = std::lower_bound(expected_dictionary.begin(), expected_dictionary.end(), phrase);
+        expected_parse.push_back(vcfbwt::size_type(it - expected_dictionary.begin() + 1));
+    }
+
+    std::vector<vcfbwt::size_type> merged_parse;
+    std::vector<std::vector<uint32_t>> merged_dictionary;
+    vcfbwt::pfp::ParserUtils<uint32_t>::read_parse(out_prefix_merged + vcfbwt::EXT::PARSE, merged_parse);
+    vcfbwt::pfp::ParserUtils<uint32_t>::read_dictionary(out_prefix_merged + vcfbwt::EXT::DICT, merged_dictionary);
+    REQUIRE(merged_dictionary == expected_dictionary);
+    REQUIRE(merged_parse == expected_parse);
+
+    // Output occurrences
+    vcfbwt::pfp::PropertiesWriter<uint32_t> properties_out(out_prefix_merged, params);
+    properties_out.write();
+
+    // Check
+    bool check = unparse_and_check<uint32_t>(out_prefix_merged, what_it_should_be, params.w, vcfbwt::pfp::DOLLAR);
+    REQUIRE(check);
+}
+
 //------------------------------------------------------------------------------
 
 int main( int argc, char* argv[] )
@@ -24,6 +24,7 @@ class Parameters:
     N = 0
     P = 70
     offset = 17000000
+    seed = None
     R = '/blue/boucher/marco.oliva/tmp/generated_vcf/22.fa.gz'
     out_file = 'generated.vcf.gz'
 
@@ -58,6 +59,7 @@ def main():
     parser.add_argument('-P', help='same as p for N', type=int, default=parameters.P, dest="common_snp_probs")
     parser.add_argument('-o', help='output file', type=str, default=parameters.out_file, dest="out_file")
     parser.add_argument('--offset', help='the first possible position for a variation', type=int, default=parameters.offset, dest="offset")
+    parser.add_argument('--seed', help='random seed, the current time if not set', type=int, default=parameters.seed, dest="seed")
     args = parser.parse_args()
 
 
@@ -69,6 +71,7 @@ def main():
     parameters.N = args.common
     parameters.P = args.common_snp_probs
     parameters.offset = args.offset
+    parameters.seed = args.seed
     parameters.R = args.reference
     parameters.out_file = args.out_file
 
@@ -97,8 +100,11 @@ def main():
     # Variations list (vcf)
     variations = list()
 
-    # Seeding random generator with time, something more random?
-    random.seed(datetime.now())
+    # Seeding random generator with time, something more random? A given seed makes the output reproducible
+    if parameters.seed is None:
+        random.seed(datetime.now().timestamp())
+    else:
+        random.seed(parameters.seed)
 
     # Create samples per region map
     samples_per_region = dict()
@@ -110,7 +116,7 @@ def main():
 
     # For each region
     print('Generating random variations for each region')
-    rand_variations_pos = list()
+    rand_variations_pos = set()
     for region, samples_list in samples_per_region.items():
         # Create variations
         for i in tqdm(range(parameters.n)):
@@ -120,7 +126,7 @@ def main():
                 pos = math.floor(random.uniform(parameters.offset, reference_length))
                 if (pos not in rand_variations_pos):
                     break
-            rand_variations_pos.append(pos)
+            rand_variations_pos.add(pos)
 
             # Samples subset
             samples_sublist = random.sample(samples_list, k=(math.floor((parameters.p/100)*len(samples_list))))
@@ -132,7 +138,7 @@ def main():
 
             nucleotide_set = {'A','C','G','T','N'}
             nucleotide_set.remove(reference[pos])
-            var.alt = random.sample(nucleotide_set, k=1)[0]
+            var.alt = random.choice(sorted(nucleotide_set))
 
             var.reference_length = 1
             var.samples = samples_sublist
@@ -153,7 +159,7 @@ def main():
             pos = math.floor(random.uniform(parameters.offset, reference_length))
             if (pos not in rand_variations_pos):
                 break
-        rand_variations_pos.append(pos)
+        rand_variations_pos.add(pos)
 
         samples_sublist = random.sample(all_samples, k=(math.floor((parameters.P/100)*len(all_samples))))
 
@@ -163,7 +169,7 @@ def main():
 
         nucleotide_set = {'A','C','G','T','N'}
         nucleotide_set.remove(reference[pos])
-        var.alt = random.sample(nucleotide_set, k=1)[0]
+        var.alt = random.choice(sorted(nucleotide_set))
 
         var.reference_length = 1
         var.samples = samples_sublist
@@ -246,8 +252,9 @@ def main():
             variation_line.append(variation.format_s)
 
             # Samples matrix
+            variation_samples = set(variation.samples)
             for sample in all_samples:
-                if (sample in variation.samples):
+                if (sample in variation_samples):
                     variation_line.append('1|1')
                 else:
                     variation_line.append('0|0')
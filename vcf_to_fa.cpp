@@ -21,6 +21,7 @@ int main(int argc, char **argv)
     std::size_t threads = 1;
     std::string samples_file_name;
     std::string haplotype_string = "1";
+    bool use_vcf_index = false;
 
     vcfbwt::pfp::Params params;
     
@@ -31,6 +32,7 @@ int main(int argc, char **argv)
     app.add_option("-m, --max", max_samples, "Max number of samples to analyze")->configurable();
     app.add_option("-S, --samples", samples_file_name, "File containing the list of samples to parse")->configurable();
     app.add_option("-t, --threads", threads, "Number of threads")->configurable();
+    app.add_flag("--vcf-index", use_vcf_index, "Read each indexed vcf by regions in parallel, using its tabix/CSI index.")->configurable();
     app.add_flag_callback("--version",vcfbwt::Version::print,"Version");
     app.set_config("--configure");
     app.allow_windows_style_options();
@@ -47,7 +49,7 @@ int main(int argc, char **argv)
     spdlog::info("Current Configuration:\n{}", app.config_to_str(true,true));
     
     // Parse the VCF
-    vcfbwt::VCF vcf(refs_file_names, vcfs_file_names, samples_file_name, max_samples);
+    vcfbwt::VCF vcf(refs_file_names, vcfs_file_names, samples_file_name, max_samples, 0, threads, use_vcf_index);
 
     // Generate fasta file, reference first
     std::ofstream samples(out_file);
@@ -67,9 +69,9 @@ int main(int argc, char **argv)
             else { sample_genotype = 1; }
     
             vcfbwt::Sample::iterator it(vcf[i], sample_genotype);
-            std::string sample;
+            std::string sample; sample.reserve(it.length());
     
-            while (not it.end()) { sample.push_back(*it); ++it; }
+            while (not it.end()) { vcfbwt::Sample::iterator::Run run = it.current_run(); sample.append(run.data, run.size); it.advance(run.size); }
             samples << "> " + vcf[i].id() + "\n";
             samples.write(sample.c_str(), sample.size());
             samples.put('\n');
@@ -78,16 +80,16 @@ int main(int argc, char **argv)
         {
             // first haplotype
             vcfbwt::Sample::iterator it_h1(vcf[i], 0);
-            std::string sample_h1;
-            while (not it_h1.end()) { sample_h1.push_back(*it_h1); ++it_h1; }
+            std::string sample_h1; sample_h1.reserve(it_h1.length());
+            while (not it_h1.end()) { vcfbwt::Sample::iterator::Run run = it_h1.current_run(); sample_h1.append(run.data, run.size); it_h1.advance(run.size); }
             samples << "> " + vcf[i].id() + "H1 \n";
             samples.write(sample_h1.c_str(), sample_h1.size());
             samples.put('\n');
     
             // second haplotype
             vcfbwt::Sample::iterator it_h2(vcf[i], 1);
-            std::string sample_h2;
-            while (not it_h2.end()) { sample_h2.push_back(*it_h2); ++it_h2; }
+            std::string sample_h2; sample_h2.reserve(it_h2.length());
+            while (not it_h2.end()) { vcfbwt::Sample::iterator::Run run = it_h2.current_run(); sample_h2.append(run.data, run.size); it_h2.advance(run.size); }
             samples << "> " + vcf[i].id() + "H2 \n";
             samples.write(sample_h2.c_str(), sample_h2.size());
             samples.put('\n');